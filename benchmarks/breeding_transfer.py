@@ -0,0 +1,81 @@
+"""Measures the bytes moved between the breeder and its worker processes in one generation, when the workers get the
+parents as pickled Genome objects (before) and when they read them from a shared memory GenerationSnapshot (after).
+
+Run with: python -m benchmarks.breeding_transfer
+"""
+import functools
+import pickle
+import random
+
+import numpy as np
+
+from simplyneat.breeder import mutations
+from simplyneat.breeder.breeder import Breeder, _produce_offspring, _produce_offsprings_from_snapshot
+from simplyneat.breeder.snapshot import GenerationSnapshot
+from simplyneat.config.config import Config, LoggingLevel
+from simplyneat.genome.genome import Genome
+from simplyneat.workers import workers
+
+POPULATION_SIZE = 200
+GENOME_SIZES = [10, 100, 500]
+NUMBER_OF_CHUNKS = 16
+
+
+def constant_fitness(agent):
+    return 1.0
+
+
+def make_population(config, number_of_connections):
+    """Returns POPULATION_SIZE evaluated genomes with about number_of_connections connection genes each"""
+    breeder = Breeder(config)
+    genomes = []
+    for _ in range(POPULATION_SIZE):
+        genome = Genome(config)
+        new_genes = []
+        while len(genome.connection_genes) < number_of_connections:
+            if random.random() < 0.8:
+                new_genes += mutations.mutate_add_connection(genome, np.random.normal)
+            else:
+                new_genes += mutations.mutate_add_node(genome, breeder.node_registry)
+        breeder._assign_innovations(new_genes)
+        genome.fitness = random.random()
+        genomes.append(genome)
+    return genomes, breeder.node_registry
+
+
+def bytes_moved_with_pickled_genomes(pairs, config, node_registry):
+    task = functools.partial(_produce_offspring, config=config, node_registry=node_registry)
+    sent = sum(len(pickle.dumps((task, pair))) for pair in pairs)
+    received = sum(len(pickle.dumps(task(pair))) for pair in pairs)
+    return sent + received
+
+
+def bytes_moved_with_snapshot(genomes, pairs, config, node_registry):
+    genome_numbers = {id(genome): genome_number for genome_number, genome in enumerate(genomes)}
+    pairs_of_genome_numbers = [(genome_numbers[id(genome1)], genome_numbers[id(genome2)]) for genome1, genome2 in pairs]
+    chunks = [pairs_of_genome_numbers[i::NUMBER_OF_CHUNKS] for i in range(NUMBER_OF_CHUNKS)]
+    # the workers get the config once, from the pool's initializer, so it isn't part of the tasks
+    workers._initialize_worker(config)
+    with GenerationSnapshot(genomes, node_registry) as snapshot:
+        task = functools.partial(_produce_offsprings_from_snapshot, descriptor=snapshot.descriptor)
+        sent = sum(len(pickle.dumps((task, chunk))) for chunk in chunks)
+        received = sum(len(pickle.dumps(task(chunk))) for chunk in chunks)
+        return snapshot.nbytes + sent + received
+
+
+def main():
+    random.seed(0)
+    np.random.seed(0)
+    config = Config({'fitness_function': constant_fitness, 'number_of_input_nodes': 8, 'number_of_output_nodes': 4,
+                     'processes_in_pool': 1, 'logging_level': LoggingLevel.WARNING})
+    print("%-15s %20s %20s %10s" % ('genome size', 'pickled genomes', 'shared snapshot', 'ratio'))
+    for number_of_connections in GENOME_SIZES:
+        genomes, node_registry = make_population(config, number_of_connections)
+        pairs = [(random.choice(genomes), random.choice(genomes)) for _ in range(POPULATION_SIZE)]
+        before = bytes_moved_with_pickled_genomes(pairs, config, node_registry)
+        after = bytes_moved_with_snapshot(genomes, pairs, config, node_registry)
+        print("%-15s %20s %20s %10.1f" % (number_of_connections, before, after, before / after))
+
+
+if __name__ == '__main__':
+    main()
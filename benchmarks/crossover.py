@@ -0,0 +1,44 @@
+"""Measures the time _breed_parents takes to produce one offspring, for parents of increasing genome size.
+
+Run with: python -m benchmarks.crossover
+"""
+import gc
+import random
+import time
+
+import numpy as np
+
+from benchmarks.breeding_transfer import constant_fitness, make_population
+from simplyneat.breeder.breeder import _breed_parents
+from simplyneat.config.config import Config, LoggingLevel
+
+GENOME_SIZES = [10, 100, 500]
+NUMBER_OF_OFFSPRINGS = 200
+REPEATS = 3
+
+
+def seconds_per_offspring(pairs, config):
+    """Best of REPEATS runs, keeping the offsprings alive like the breeder does"""
+    best = float('inf')
+    for _ in range(REPEATS):
+        gc.collect()
+        start_time = time.perf_counter()
+        offsprings = [_breed_parents(genome1, genome2, config) for genome1, genome2 in pairs]
+        best = min(best, (time.perf_counter() - start_time) / len(offsprings))
+    return best
+
+
+def main():
+    random.seed(0)
+    np.random.seed(0)
+    config = Config({'fitness_function': constant_fitness, 'number_of_input_nodes': 8, 'number_of_output_nodes': 4,
+                     'processes_in_pool': 1, 'logging_level': LoggingLevel.WARNING})
+    print("%-15s %20s" % ('genome size', 'usec per offspring'))
+    for number_of_connections in GENOME_SIZES:
+        genomes, _ = make_population(config, number_of_connections)
+        pairs = [(random.choice(genomes), random.choice(genomes)) for _ in range(NUMBER_OF_OFFSPRINGS)]
+        print("%-15s %20.1f" % (number_of_connections, seconds_per_offspring(pairs, config) * 1e6))
+
+
+if __name__ == '__main__':
+    main()
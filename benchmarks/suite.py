@@ -0,0 +1,284 @@
+"""Times every phase of a generation - compiling and running networks, crossover, mutation, speciation, fitness sharing
+and a whole generation - over synthetic populations (see synthetic.py) of increasing population and genome sizes, and
+whole runs of the standard tasks (see tasks.py). Reports each phase's time, throughput and peak memory, and compares
+them to a stored baseline.
+
+Run with: python -m benchmarks.suite [--quick] [--save-baseline PATH] [--compare PATH]
+e.g. python -m benchmarks.suite --quick --compare benchmarks/baselines/quick.json
+"""
+import argparse
+import gc
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from benchmarks import synthetic, tasks
+from simplyneat.agent.agent import _NumpyAgent
+from simplyneat.agent.network import PopulationNetwork
+from simplyneat.breeder import fitness_sharing
+from simplyneat.breeder.breeder import Breeder, _breed_parents, _mutate_offspring
+from simplyneat.neat import Neat
+from simplyneat.population.population import Population
+from simplyneat.steady_state.steady_state import SteadyStateNeat
+
+POPULATION_SIZES = [100, 1000, 10000]
+GENOME_SIZES = [10, 100, 1000]
+# population x genome sizes above this aren't built, 10k genomes of 1000 genes take gigabytes
+MAX_GENES = 1000000
+# the exact fitness sharing is O(population^2 x genome size), skip it above this
+MAX_EXACT_SHARING_WORK = 2e9
+INNOVATION_SPREAD = 2.0
+# the per-genome phases run over a sample of the population
+SAMPLE_SIZE = 1000
+FORWARD_PASS_STEPS = 10
+OBSERVATIONS_BATCH_SIZE = 32
+REPEATS = 3
+TASK_GENERATIONS = 10
+# a phase is reported as a regression if it's this many times slower than its baseline
+REGRESSION_THRESHOLD = 1.25
+
+
+def _sample(genomes, size):
+    return genomes if len(genomes) <= size else random.sample(genomes, size)
+
+
+def _sample_pairs(genomes, size):
+    return [(random.choice(genomes), random.choice(genomes)) for _ in range(min(len(genomes), size))]
+
+
+# Each phase is a function of (config, synthetic population) doing the untimed setup and returning the function to time
+# and the number of items it processes. It's called again for every repeat, since some phases change their input.
+
+def _compile_phase(config, population):
+    genomes = _sample(population.genomes, SAMPLE_SIZE)
+    for genome in genomes:
+        genome.invalidate_compiled_network()
+    return lambda: [genome.compiled_network for genome in genomes], len(genomes)
+
+
+def _forward_pass_phase(config, population):
+    agents = [_NumpyAgent(genome.compiled_network) for genome in _sample(population.genomes, SAMPLE_SIZE)]
+    observation = np.random.random(config.number_of_input_nodes)
+
+    def forward_passes():
+        for agent in agents:
+            for _ in range(FORWARD_PASS_STEPS):
+                agent._forward_pass(observation)
+    return forward_passes, len(agents) * FORWARD_PASS_STEPS
+
+
+def _population_forward_pass_phase(config, population):
+    genomes = _sample(population.genomes, SAMPLE_SIZE)
+    network = PopulationNetwork(genomes)
+    observations = np.random.random((OBSERVATIONS_BATCH_SIZE, config.number_of_input_nodes))
+    return lambda: network.activate(observations), len(genomes) * OBSERVATIONS_BATCH_SIZE
+
+
+def _crossover_phase(config, population):
+    pairs = _sample_pairs(population.genomes, SAMPLE_SIZE)
+    return lambda: [_breed_parents(genome1, genome2, config) for genome1, genome2 in pairs], len(pairs)
+
+
+def _mutation_phase(config, population):
+    offsprings = [_breed_parents(genome1, genome2, config)
+                  for genome1, genome2 in _sample_pairs(population.genomes, SAMPLE_SIZE)]
+    return lambda: [_mutate_offspring(offspring, config, population.node_registry) for offspring in offsprings], \
+        len(offsprings)
+
+
+def _speciation_phase(config, population):
+    return lambda: Population(config, genomes=list(population.genomes)), len(population.genomes)
+
+
+def _species_sharing_phase(config, population):
+    speciated = Population(config, genomes=list(population.genomes))
+    return lambda: fitness_sharing.species_adjusted_fitness(speciated.species), len(population.genomes)
+
+
+def _exact_sharing_phase(config, population):
+    speciated = Population(config, genomes=list(population.genomes))
+    return lambda: fitness_sharing.exact_adjusted_fitness(speciated.species, speciated.genomes, config), \
+        len(population.genomes)
+
+
+def _generation_phase(config, population):
+    speciated = Population(config, genomes=list(population.genomes))
+    breeder = Breeder(config)
+    breeder.restore_innovations(dict(population.innovations_dictionary), population.innovation_counter,
+                                population.node_registry)
+    return lambda: breeder.breed_population(speciated), len(population.genomes)
+
+
+# key: phase name, value: (phase function, whether the phase can run with the given population and genome sizes)
+PHASES = {
+    'compile': (_compile_phase, None),
+    'forward_pass': (_forward_pass_phase, None),
+    'population_forward_pass': (_population_forward_pass_phase, None),
+    'crossover': (_crossover_phase, None),
+    'mutation': (_mutation_phase, None),
+    'speciation': (_speciation_phase, None),
+    'species_sharing': (_species_sharing_phase, None),
+    'exact_sharing': (_exact_sharing_phase,
+                      lambda population_size, genome_size:
+                      population_size ** 2 * genome_size <= MAX_EXACT_SHARING_WORK),
+    'generation': (_generation_phase, None),
+}
+
+
+def time_phase(phase, config, population, repeats, measure_memory):
+    """Returns the best time of repeats runs of the phase, the number of items it processes and the peak memory (in
+    bytes) allocated while running it, None if measure_memory is False. Memory is traced in a run of its own since
+    tracing slows everything down."""
+    best_time = float('inf')
+    for _ in range(repeats):
+        function, number_of_items = phase(config, population)
+        gc.collect()
+        start_time = time.perf_counter()
+        function()
+        best_time = min(best_time, time.perf_counter() - start_time)
+    peak_memory = None
+    if measure_memory:
+        function, _ = phase(config, population)
+        gc.collect()
+        tracemalloc.start()
+        function()
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return best_time, number_of_items, peak_memory
+
+
+def run_phases(population_sizes, genome_sizes, phases, repeats, measure_memory, max_genes):
+    results = []
+    for population_size in population_sizes:
+        for genome_size in genome_sizes:
+            if population_size * genome_size > max_genes:
+                print("skipping %s genomes of %s genes, above %s genes" % (population_size, genome_size, max_genes))
+                continue
+            config = synthetic.make_config(population_size)
+            population = synthetic.SyntheticPopulation(config, population_size, genome_size, INNOVATION_SPREAD)
+            for phase_name in phases:
+                phase, can_run = PHASES[phase_name]
+                if can_run is not None and not can_run(population_size, genome_size):
+                    continue
+                seconds, number_of_items, peak_memory = time_phase(phase, config, population, repeats,
+                                                                   measure_memory)
+                results.append(_result(phase_name, population_size, genome_size, seconds, number_of_items,
+                                       peak_memory))
+                _print_result(results[-1])
+    return results
+
+
+def run_tasks(population_sizes, number_of_generations, measure_memory):
+    """Runs number_of_generations generations of every task from its initial genome, for each population size, and
+    as many evaluations steady-state (see steady_state.py). A task's items are its evaluations."""
+    results = []
+    for task_name, (fitness_function, number_of_inputs, number_of_outputs) in tasks.TASKS.items():
+        for population_size in population_sizes:
+            config = synthetic.make_config(population_size, fitness_function=fitness_function,
+                                           number_of_input_nodes=number_of_inputs,
+                                           number_of_output_nodes=number_of_outputs)
+            number_of_evaluations = number_of_generations * population_size
+
+            def task_phase(config, population):
+                random.seed(0)
+                np.random.seed(0)
+                neat = Neat(config)
+                return lambda: neat.run(number_of_generations), number_of_evaluations
+
+            def steady_state_task_phase(config, population):
+                random.seed(0)
+                np.random.seed(0)
+                neat = SteadyStateNeat(config)
+                return lambda: neat.run(number_of_evaluations), number_of_evaluations
+            for phase_name, phase in (('task_', task_phase), ('steady_state_task_', steady_state_task_phase)):
+                seconds, number_of_items, peak_memory = time_phase(phase, config, None, 1, measure_memory)
+                results.append(_result(phase_name + task_name, population_size, None, seconds, number_of_items,
+                                       peak_memory))
+                _print_result(results[-1])
+    return results
+
+
+def compare(results, baseline_results, threshold=REGRESSION_THRESHOLD):
+    """Prints each result's time relative to its baseline, returns the regressed results"""
+    baseline = {_key(result): result for result in baseline_results}
+    regressions = []
+    print("\n%-30s %10s %8s %12s %12s %8s" % ('phase', 'population', 'genes', 'baseline s', 'current s', 'ratio'))
+    for result in results:
+        baseline_result = baseline.get(_key(result))
+        if baseline_result is None:
+            continue
+        ratio = result['seconds'] / baseline_result['seconds']
+        mark = ''
+        if ratio > threshold:
+            mark = 'SLOWER'
+            regressions.append(result)
+        elif ratio < 1 / threshold:
+            mark = 'faster'
+        print("%-30s %10s %8s %12.5f %12.5f %8.2f %s" % (result['phase'], result['population_size'],
+                                                         result['genome_size'], baseline_result['seconds'],
+                                                         result['seconds'], ratio, mark))
+    return regressions
+
+
+def _result(phase_name, population_size, genome_size, seconds, number_of_items, peak_memory):
+    return {'phase': phase_name, 'population_size': population_size, 'genome_size': genome_size, 'seconds': seconds,
+            'items': number_of_items, 'items_per_second': number_of_items / seconds, 'peak_memory_bytes': peak_memory}
+
+
+def _key(result):
+    return result['phase'], result['population_size'], result['genome_size']
+
+
+def _print_result(result):
+    peak_memory = '-' if result['peak_memory_bytes'] is None else '%.1f' % (result['peak_memory_bytes'] / 2 ** 20)
+    print("%-30s %10s %8s %12.5f %14.1f %10s" % (result['phase'], result['population_size'], result['genome_size'],
+                                                 result['seconds'], result['items_per_second'], peak_memory))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--quick', action='store_true', help="small sizes and a single repeat, for a fast check")
+    parser.add_argument('--population-sizes', type=int, nargs='+')
+    parser.add_argument('--genome-sizes', type=int, nargs='+')
+    parser.add_argument('--max-genes', type=int, default=MAX_GENES)
+    parser.add_argument('--phases', nargs='+', choices=list(PHASES), default=list(PHASES))
+    parser.add_argument('--no-tasks', action='store_true')
+    parser.add_argument('--no-memory', action='store_true', help="don't measure peak memory, halves the run time")
+    parser.add_argument('--save-baseline', metavar='PATH', help="write the results to PATH")
+    parser.add_argument('--compare', metavar='PATH', help="compare the results to the baseline at PATH")
+    arguments = parser.parse_args()
+
+    population_sizes = arguments.population_sizes or ([100, 1000] if arguments.quick else POPULATION_SIZES)
+    genome_sizes = arguments.genome_sizes or ([10, 100] if arguments.quick else GENOME_SIZES)
+    repeats = 1 if arguments.quick else REPEATS
+    random.seed(0)
+    np.random.seed(0)
+
+    print("%-30s %10s %8s %12s %14s %10s" % ('phase', 'population', 'genes', 'seconds', 'items/sec', 'peak MiB'))
+    results = run_phases(population_sizes, genome_sizes, arguments.phases, repeats, not arguments.no_memory,
+                         arguments.max_genes)
+    if not arguments.no_tasks:
+        largest_task_population = 100 if arguments.quick else 1000
+        results += run_tasks([size for size in population_sizes if size <= largest_task_population],
+                             3 if arguments.quick else TASK_GENERATIONS, not arguments.no_memory)
+
+    if arguments.save_baseline:
+        with open(arguments.save_baseline, 'w') as baseline_file:
+            json.dump({'python': platform.python_version(), 'numpy': np.__version__, 'machine': platform.machine(),
+                       'quick': arguments.quick, 'results': results}, baseline_file, indent=1)
+            baseline_file.write('\n')
+    if arguments.compare:
+        with open(arguments.compare) as baseline_file:
+            regressions = compare(results, json.load(baseline_file)['results'])
+        if regressions:
+            print("%s phases regressed by more than %sx" % (len(regressions), REGRESSION_THRESHOLD))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""Synthetic populations for the benchmarks: genomes of a controllable size and innovation spread, built directly from
+gene arrays rather than grown by mutations, so large populations of large genomes are cheap to make.
+
+Every genome is a feed-forward network over the same input, output and hidden nodes. Its connection genes are drawn
+from a pool of candidate connections, whose size is genome_size * innovation_spread: a spread of 1 gives every genome
+the same topology (only the weights differ), larger spreads give fewer matching and more disjoint and excess genes.
+Connection k of the pool has innovation number k, so the genomes can be bred like any evolved population.
+"""
+import numpy as np
+
+from simplyneat.config.config import Config, EvaluationBackend, LoggingLevel
+from simplyneat.genome.genes.node_gene import NodeRegistry, set_node_registry
+from simplyneat.genome.genome import Genome
+
+NUMBER_OF_INPUT_NODES = 8
+NUMBER_OF_OUTPUT_NODES = 4
+ENABLED_PROBABILITY = 0.9
+
+
+def constant_fitness(agent):
+    return 1.0
+
+
+def make_config(population_size, **params):
+    """A serial config for a population of population_size, more params override the defaults"""
+    params_dict = {'fitness_function': constant_fitness,
+                   'number_of_input_nodes': NUMBER_OF_INPUT_NODES,
+                   'number_of_output_nodes': NUMBER_OF_OUTPUT_NODES,
+                   'population_size': population_size,
+                   'elite_group_size': max(1, population_size // 20),
+                   'processes_in_pool': 1,
+                   'evaluation_backend': EvaluationBackend.SERIAL,
+                   'logging_level': LoggingLevel.WARNING}
+    params_dict.update(params)
+    return Config(params_dict)
+
+
+class SyntheticPopulation:
+    """number_of_genomes evaluated genomes of genome_size connection genes each, along with the node registry and the
+    innovations dictionary a breeder needs to continue breeding them (see Breeder.restore_innovations)"""
+
+    def __init__(self, config, number_of_genomes, genome_size, innovation_spread=2.0, seed=0):
+        if innovation_spread < 1:
+            raise ValueError("innovation_spread must be at least 1")
+        rng = np.random.default_rng(seed)
+        first_hidden_index = config.number_of_input_nodes + config.number_of_output_nodes
+        number_of_hidden_nodes = max(1, genome_size // 4)
+        self.node_registry = NodeRegistry(first_hidden_index)
+        for hidden_number in range(number_of_hidden_nodes):
+            # a made up lineage, the hidden nodes only need distinct ones
+            self.node_registry.intern(-1, 0, hidden_number)
+        set_node_registry(self.node_registry)
+
+        # in topological order: the bias and inputs, the hidden nodes and then the outputs
+        ordered_nodes = np.concatenate([[-1], np.arange(config.number_of_input_nodes),
+                                        first_hidden_index + np.arange(number_of_hidden_nodes),
+                                        config.number_of_input_nodes + np.arange(config.number_of_output_nodes)])
+        sources, destinations = _sample_forward_edges(rng, ordered_nodes, config.number_of_input_nodes + 1,
+                                                      int(genome_size * innovation_spread))
+        self.innovations_dictionary = {(source, destination): innovation for innovation, (source, destination)
+                                       in enumerate(zip(sources.tolist(), destinations.tolist()))}
+
+        self.genomes = []
+        genome_size = min(genome_size, len(sources))
+        for _ in range(number_of_genomes):
+            innovations = np.sort(rng.choice(len(sources), size=genome_size, replace=False))
+            genome = Genome.from_gene_arrays(config,
+                                             sources=sources[innovations].tolist(),
+                                             destinations=destinations[innovations].tolist(),
+                                             weights=rng.normal(size=genome_size).tolist(),
+                                             enabled=(rng.random(genome_size) < ENABLED_PROBABILITY).tolist(),
+                                             innovations=innovations.tolist(),
+                                             split_numbers=[0] * genome_size)
+            genome.fitness = float(rng.random())
+            self.genomes.append(genome)
+
+    @property
+    def innovation_counter(self):
+        return len(self.innovations_dictionary)
+
+
+def _sample_forward_edges(rng, ordered_nodes, number_of_source_only_nodes, number_of_edges):
+    """Returns arrays of the sources and destinations of number_of_edges distinct edges (fewer if there aren't that
+    many) going forward in ordered_nodes, never into one of its first number_of_source_only_nodes nodes"""
+    number_of_nodes = len(ordered_nodes)
+    # edge (i, j) of the order, i < j, is code i * number_of_nodes + j
+    codes = set()
+    maximal_number_of_edges = sum(number_of_nodes - max(i + 1, number_of_source_only_nodes)
+                                  for i in range(number_of_nodes))
+    number_of_edges = min(number_of_edges, maximal_number_of_edges)
+    while len(codes) < number_of_edges:
+        i = rng.integers(0, number_of_nodes, size=number_of_edges)
+        j = rng.integers(number_of_source_only_nodes, number_of_nodes, size=number_of_edges)
+        valid = i < j
+        codes.update((i[valid] * number_of_nodes + j[valid]).tolist())
+    codes = rng.permutation(np.fromiter(codes, dtype=np.int64))[:number_of_edges]
+    return ordered_nodes[codes // number_of_nodes], ordered_nodes[codes % number_of_nodes]
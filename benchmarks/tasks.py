@@ -0,0 +1,82 @@
+"""Standard tasks for the benchmarks, small enough to run many generations of: XOR and a pure NumPy stand-in for
+OpenAI gym's CartPole-v1, so the benchmarks don't depend on gym."""
+import math
+
+import numpy as np
+
+XOR_CASES = [((0.0, 0.0), 0.0), ((0.0, 1.0), 1.0), ((1.0, 0.0), 1.0), ((1.0, 1.0), 0.0)]
+
+
+def xor_fitness(agent):
+    """4 minus the squared error over the XOR truth table, in [0, 4]"""
+    with agent as network_agent:
+        error = 0.0
+        for inputs, expected_output in XOR_CASES:
+            network_agent.reset()
+            error += (network_agent._forward_pass(np.array(inputs))[0] - expected_output) ** 2
+    return 4.0 - error
+
+
+class CartPole:
+    """The cart-pole dynamics of CartPole-v1 (Barto, Sutton & Anderson 1983), with Euler integration. The 4
+    observations are the cart position and velocity and the pole angle and angular velocity, action 0 pushes the cart
+    left and 1 pushes it right. An episode ends when the pole falls, the cart leaves the track or after max_steps."""
+    GRAVITY = 9.8
+    CART_MASS = 1.0
+    POLE_MASS = 0.1
+    POLE_HALF_LENGTH = 0.5
+    FORCE = 10.0
+    TIME_STEP = 0.02
+    ANGLE_LIMIT = 12 * 2 * math.pi / 360
+    POSITION_LIMIT = 2.4
+
+    def __init__(self, seed=0, max_steps=500):
+        self._rng = np.random.default_rng(seed)
+        self._max_steps = max_steps
+        self._state = None
+        self._steps = 0
+
+    def reset(self):
+        self._state = self._rng.uniform(-0.05, 0.05, size=4)
+        self._steps = 0
+        return self._state.copy()
+
+    def step(self, action):
+        """Returns the observation and whether the episode is over"""
+        position, velocity, angle, angular_velocity = self._state
+        force = self.FORCE if action == 1 else -self.FORCE
+        cos_angle, sin_angle = math.cos(angle), math.sin(angle)
+        total_mass = self.CART_MASS + self.POLE_MASS
+        pole_mass_length = self.POLE_MASS * self.POLE_HALF_LENGTH
+        temp = (force + pole_mass_length * angular_velocity ** 2 * sin_angle) / total_mass
+        angular_acceleration = (self.GRAVITY * sin_angle - cos_angle * temp) / \
+            (self.POLE_HALF_LENGTH * (4.0 / 3.0 - self.POLE_MASS * cos_angle ** 2 / total_mass))
+        acceleration = temp - pole_mass_length * angular_acceleration * cos_angle / total_mass
+        self._state = np.array([position + self.TIME_STEP * velocity,
+                                velocity + self.TIME_STEP * acceleration,
+                                angle + self.TIME_STEP * angular_velocity,
+                                angular_velocity + self.TIME_STEP * angular_acceleration])
+        self._steps += 1
+        done = abs(self._state[0]) > self.POSITION_LIMIT or abs(self._state[2]) > self.ANGLE_LIMIT or \
+            self._steps >= self._max_steps
+        return self._state.copy(), done
+
+
+def cart_pole_fitness(agent):
+    """The number of steps the agent keeps the pole up, in [1, 500]. Needs 4 input nodes and 2 output nodes."""
+    environment = CartPole()
+    observation = environment.reset()
+    steps = 0
+    with agent as network_agent:
+        done = False
+        while not done:
+            observation, done = environment.step(network_agent.next_move(observation))
+            steps += 1
+    return float(steps)
+
+
+# key: task name, value: (fitness function, number of inputs, number of outputs)
+TASKS = {
+    'xor': (xor_fitness, 2, 1),
+    'cart_pole': (cart_pole_fitness, 4, 2),
+}
@@ -2,21 +2,17 @@ import logging
 import pickle
 import random
 
-from scipy.special import expit
-
 import numpy as np
-import tensorflow as tf
 
-from simplyneat.config.config import LoggingLevel
-from simplyneat.genome.genes.node_gene import NodeType
+from simplyneat.agent.network import NetworkRunner
+from simplyneat.config.config import AgentBackend, LoggingLevel
 
 
 class Agent:
 
     def __init__(self, config, genome):
         self._config = config
-        self._node_genes_dict = genome.node_genes
-        self._connection_genes_dict = genome.connection_genes
+        self._genome = genome
 
     #todo: change default
     def save(self, file_path='temp.p'):
@@ -25,7 +21,12 @@ class Agent:
 
     def __enter__(self):
         #TODO: inconsistent naming below
-        self._tf_agent = _NumpyAgent(self._config, self._node_genes_dict, self._connection_genes_dict)
+        if self._config.agent_backend == AgentBackend.NUMPY:
+            self._tf_agent = _NumpyAgent(self._genome.compiled_network)
+        elif self._config.agent_backend == AgentBackend.TENSORFLOW:
+            self._tf_agent = _TensorflowAgent(self._config, self._genome.compiled_network)
+        else:
+            raise ValueError("Agent backend %s unknown" % str(self._config.agent_backend))
         return self._tf_agent
 
     def __exit__(self, exc_type, exc_val, exc_tb):
@@ -33,17 +34,17 @@ class Agent:
 
 
 class _TensorflowAgent:
-
-    def __init__(self, config, genome):
-        self._genome = genome
-        self._sorted_outputs_list = self._define_order_on_outputs(genome)
-        self._layer_to_node_genes_dict = self._divide_nodes_to_layers(genome.node_genes.values())
-        self._activations = {node.index: 0 for node in genome.node_genes.values()}
-        self._activation_functions = {}
-        self.node_to_tf_scalar = {node.index: tf.placeholder(dtype=tf.float32, shape=()) for node
-                                  in genome.node_genes.values()}
-        self._create_activation_functions(genome)
-        self._session = self._init_session(config)
+    """Evaluates the genome's compiled network with a tensorflow graph holding one fused matmul per layer, so a step is
+    a single session run. The recurrent state is kept in numpy and fed to the graph."""
+
+    def __init__(self, config, network):
+        tf = _import_tensorflow()
+        self._network = network
+        self._activations = network.initial_activations()
+        self._graph = tf.Graph()
+        with self._graph.as_default():
+            self._state, self._next_state = self._build_graph(tf, network)
+        self._session = self._init_session(tf, config)
         # no need to run tf.global_variables_initializer with session since we don't use variables in the network
 
     def next_move(self, inputs):
@@ -53,7 +54,11 @@ class _TensorflowAgent:
     def close(self):
         return self._session.close()
 
-    def _init_session(self, config):
+    def reset(self):
+        """Forgets the recurrent state"""
+        self._activations = self._network.initial_activations()
+
+    def _init_session(self, tf, config):
         gpu_options = tf.GPUOptions(per_process_gpu_memory_fraction=0.0001)
 
         if config.logging_level <= LoggingLevel.DEBUG:
@@ -63,114 +68,48 @@ class _TensorflowAgent:
         tf.logging.set_verbosity(logging.FATAL)
         session_config.gpu_options.allow_growth = True
         session_config.gpu_options.per_process_gpu_memory_fraction=0.0001
-        self._session = tf.Session(config=session_config)
+        self._session = tf.Session(graph=self._graph, config=session_config)
         return self._session
 
-    def _create_activation_functions(self, genome):
-        # shape = () indicates a scalar (a floating point number)
-        connection_weights = {connection: tf.constant(value=connection.weight, dtype=tf.float32, shape=())
-                              for connection in genome.enabled_connection_genes.values()}
-        index_to_node = genome.node_genes
-        for node_index in self.node_to_tf_scalar.keys():
-            function_inputs = []
-            if index_to_node[node_index].node_type == NodeType.INPUT or not index_to_node[node_index].enabled_incoming_connections:
-                input_node_tf_scalar = self.node_to_tf_scalar[node_index]
-                function_inputs.append(input_node_tf_scalar)
-                node_activation_func = input_node_tf_scalar  # identity function for inputs
-            else:
-                node_activation_func = 0
-                for connection in index_to_node[node_index].enabled_incoming_connections:
-                    source_node_tf_scalar = self.node_to_tf_scalar[connection.source_node]
-                    function_inputs.append(source_node_tf_scalar)
-                    node_activation_func += connection_weights[connection] * source_node_tf_scalar
-                node_activation_func = tf.sigmoid(node_activation_func) #TODO: change (configurable)
-            #TODO: utilize outputs to have one function per layer instead of one per node
-            self._activation_functions[node_index] = node_activation_func
-
-    def _forward_pass(self, inputs):
-        # from layer 0 (inputs) onwards
-        sorted_layer_numbers = sorted(self._layer_to_node_genes_dict.keys())
-        node_to_index = self._genome.node_genes
-        for layer_num in sorted_layer_numbers:
-            current_layer_new_activations = {}
-            for node_index in self._layer_to_node_genes_dict[layer_num]:
-                activation_function_inputs = {}
-                if node_to_index[node_index].node_type == NodeType.INPUT:
-                    # TODO: relying on node index to be a 0 to #inputs -1 integer - not good
-                    node_activation = inputs[node_to_index[node_index].index]
-                    self._activations[node_index] = node_activation
-                    activation_function_inputs[self.node_to_tf_scalar[node_index]] = node_activation
-                elif node_to_index[node_index].node_type == NodeType.BIAS:  # BIAS node activation is always 1.0
-                    node_activation = 1.0
-                    self._activations[node_to_index[node_index]] = node_activation
-                    activation_function_inputs[self.node_to_tf_scalar[node_to_index[node_index]]] = node_activation
-                else:
-                    for connection in node_to_index[node_index].enabled_incoming_connections:
-                        source_node = connection.source_node
-                        activation_function_inputs[self.node_to_tf_scalar[source_node]] = self._activations[source_node]
-                    node_activation = self._session.run(self._activation_functions[node_to_index[node_index]], feed_dict=activation_function_inputs)
-                current_layer_new_activations[node_index] = node_activation
-            # update activations for the next layer to use
-            # we don't update during the previous loop since recurrent loop of the same layer should use old activations
-            for node_index, activation in current_layer_new_activations.items():
-                self._activations[node_index] = activation
-
-        outputs_activations = []
-        for output_node in self._sorted_outputs_list:
-            outputs_activations.append(self._activations[output_node.index])
-        return outputs_activations
-
     @staticmethod
-    def _define_order_on_outputs(genome):
-        # from output node 0 to output node #outputs - 1
-        sorted_outputs_list = []
-        for node_gene in genome.node_genes.values():
-            if node_gene.node_type == NodeType.OUTPUT:
-                sorted_outputs_list.append(node_gene)
-        list.sort(sorted_outputs_list, key=lambda node: node.index)
-        return sorted_outputs_list
-
-    # Layer 0 contains all and only input nodes. Layer number might not be contagious (i.e. layers: 0, 1, 3...)
-    def _divide_nodes_to_layers(self, node_genes):
-        node_to_longest_acyclic_path_len = {}  # key: node index, value: longest white path to node TODO: explain
-
-        color = {node.index: 'not visited' for node in node_genes}
-        for node in node_genes:
-            if node.node_type == NodeType.INPUT:
-                self._get_longest_acyclic_paths(node, 0, color, node_to_longest_acyclic_path_len)
-
-        layer_to_node_genes = {}     # key: layer number, value: nodes list
-        for node_index, longest_acyclic_path in node_to_longest_acyclic_path_len.items():
-            if longest_acyclic_path not in layer_to_node_genes:
-                layer_to_node_genes[longest_acyclic_path] = []
-            layer_to_node_genes[longest_acyclic_path].append(node_index)
-
-        return layer_to_node_genes
-
-    def _get_longest_acyclic_paths(self, node, path_len, color, node_to_longest_acyclic_path_len):
-        if color[node.index] == 'visited':
-            return
-
-        color[node.index] = 'visited'
+    def _build_graph(tf, network):
+        """Returns the (batch, nodes) state placeholder and the state after a forward pass, same as
+        CompiledNetwork.activate"""
+        number_of_nodes = network.number_of_nodes
+        state = tf.placeholder(dtype=tf.float64, shape=(None, number_of_nodes))
+        next_state = state
+        for destination_positions, source_positions, weights in network.layers:
+            layer_activations = tf.sigmoid(tf.matmul(tf.gather(next_state, source_positions, axis=1), weights))
+            # the layer's activations are written to their positions through constant masks, which avoids scatters
+            placement = np.zeros((len(destination_positions), number_of_nodes))
+            placement[np.arange(len(destination_positions)), destination_positions] = 1.0
+            keep = np.ones(number_of_nodes)
+            keep[destination_positions] = 0.0
+            next_state = next_state * keep + tf.matmul(layer_activations, placement)
+        return state, next_state
 
-        if node.index not in node_to_longest_acyclic_path_len or node_to_longest_acyclic_path_len[node.index] < path_len:
-            node_to_longest_acyclic_path_len[node.index] = path_len
+    def _forward_pass(self, inputs):
+        activations = self._activations
+        activations[self._network.input_positions] = np.asarray(inputs, dtype=np.float64)[self._network.input_indices]
+        activations[self._network.bias_positions] = 1.0  # BIAS node activation is always 1.0
+        self._activations = self._session.run(self._next_state, feed_dict={self._state: activations[np.newaxis]})[0]
+        return self._activations[self._network.output_positions]
 
-            for connection in node.enabled_outgoing_connections:
-                dest = connection.destination_node
-                if color[dest.index] != 'visited':  # if doesn't create a cycle
-                    self._get_longest_acyclic_paths(dest, path_len + 1, color, node_to_longest_acyclic_path_len)
 
-        color[node.index] = 'not visited'
+def _import_tensorflow():
+    # tensorflow is slow to import, so it's only imported by the agents which use it and not by every process which
+    # imports simplyneat
+    import tensorflow as tf
+    return tf
 
 
 class _NumpyAgent:
 
-    def __init__(self, config, node_genes_dict, connection_genes_dict):
-        self._sorted_outputs_list = self._define_order_on_outputs(node_genes_dict.values())
-        self._layer_to_node_indices_dict = self._divide_nodes_to_layers(node_genes_dict.values())
-        self._activations = {node.index: 0.0 for node in node_genes_dict.values()}
-        self._node_index_to_gene = node_genes_dict
+    def __init__(self, network):
+        # the network is the genome's cached CompiledNetwork, shared with other agents of the genome. The activations
+        # (recurrent state) are the agent's own
+        self._network = network
+        self._activations = self._network.initial_activations()
 
     def next_move(self, inputs):
         outputs = self._forward_pass(inputs)
@@ -179,80 +118,13 @@ class _NumpyAgent:
     def close(self):
         pass
 
-    def _forward_pass(self, inputs):
-        # from layer 0 (inputs) onwards
-        sorted_layer_numbers = sorted(self._layer_to_node_indices_dict.keys())
-        for layer_num in sorted_layer_numbers:
-            current_layer_new_activations = {}
-            for node_index in self._layer_to_node_indices_dict[layer_num]:
-                node = self._node_index_to_gene[node_index]
-                if node.node_type == NodeType.INPUT:
-                    # TODO: relying on node index to be a 0 to #inputs -1 integer - not good
-                    node_activation = float(inputs[node.index])
-                elif node.node_type == NodeType.BIAS:  # BIAS node activation is always 1.0
-                    node_activation = 1.0
-                else:
-                    source_nodes_activations = [self._activations[connection.source_node.index] for connection
-                                                in node.enabled_incoming_connections]
-                    connection_weights = [connection.weight for connection in node.enabled_incoming_connections]
-                    node_activation = expit(np.dot(connection_weights, source_nodes_activations))
-
-                current_layer_new_activations[node.index] = node_activation
-            # update activations for the next layer to use
-            # we don't update during the previous loop since recurrent loop of the same layer should use old activations
-            for node_index, activation in current_layer_new_activations.items():
-                self._activations[node_index] = activation
-
-        outputs_activations = []
-
-        for output_node in self._sorted_outputs_list:
-            outputs_activations.append(self._activations[output_node.index])
-        return outputs_activations
-
-    @staticmethod
-    def _define_order_on_outputs(node_genes):
-        # from output node 0 to output node #outputs - 1
-        sorted_outputs_list = []
-        for node_gene in node_genes:
-            if node_gene.node_type == NodeType.OUTPUT:
-                sorted_outputs_list.append(node_gene)
-        list.sort(sorted_outputs_list, key=lambda node: node.index)
-        return sorted_outputs_list
-
-    # Layer 0 contains all and only input nodes. Layer number might not be contagious (i.e. layers: 0, 1, 3...)
-    def _divide_nodes_to_layers(self, node_genes):
-        node_to_longest_acyclic_path_len = {}  # key: node index, value: longest white path to node TODO: explain
+    def reset(self):
+        """Forgets the recurrent state"""
+        self._activations = self._network.initial_activations()
 
-        color = {node.index: 'not visited' for node in node_genes}
-        for node in node_genes:
-            if node.node_type == NodeType.INPUT or node.node_type == NodeType.BIAS:
-                self._get_longest_acyclic_paths(node, 0, color, node_to_longest_acyclic_path_len)
+    def runner(self, batch_size=1):
+        """Returns a NetworkRunner of the agent's network, to step a batch of input streams with their own state"""
+        return NetworkRunner(self._network, batch_size)
 
-        max_layer = max(node_to_longest_acyclic_path_len.values())
-        for node in node_genes:
-            if node.index not in node_to_longest_acyclic_path_len:
-                node_to_longest_acyclic_path_len[node.index] = max_layer + 1
-
-        layer_to_node_genes = {}     # key: layer number, value: nodes list
-        for node_index, longest_acyclic_path in node_to_longest_acyclic_path_len.items():
-            if longest_acyclic_path not in layer_to_node_genes:
-                layer_to_node_genes[longest_acyclic_path] = []
-            layer_to_node_genes[longest_acyclic_path].append(node_index)
-
-        return layer_to_node_genes
-
-    def _get_longest_acyclic_paths(self, node, path_len, color, node_to_longest_acyclic_path_len):
-        if color[node.index] == 'visited':
-            return
-
-        color[node.index] = 'visited'
-
-        if node.index not in node_to_longest_acyclic_path_len or node_to_longest_acyclic_path_len[node.index] < path_len:
-            node_to_longest_acyclic_path_len[node.index] = path_len
-
-            for connection in node.enabled_outgoing_connections:
-                dest = connection.destination_node
-                if color[dest.index] != 'visited':  # if doesn't create a cycle
-                    self._get_longest_acyclic_paths(dest, path_len + 1, color, node_to_longest_acyclic_path_len)
-
-        color[node.index] = 'not visited'
+    def _forward_pass(self, inputs):
+        return self._network.activate(self._activations, inputs)
@@ -0,0 +1,370 @@
+import numpy as np
+from scipy import sparse
+from scipy.special import expit
+
+from simplyneat.genome.genes.node_gene import NodeType
+
+
+class CompiledNetwork:
+    """A genome's phenotype compiled into flat arrays. Built once per genome, after which a forward pass is a handful
+    of vectorized numpy operations per layer (no per-node python work).
+    Every node has a fixed position in a contiguous activation vector. Each layer holds the positions of the nodes it
+    updates, the positions of the nodes they read from and a dense weight block between the two."""
+
+    def __init__(self, node_genes_dict):
+        node_genes = list(node_genes_dict.values())
+        # key: node index, value: the node's position in the activation vector
+        self._node_positions = {node_index: position for position, node_index in enumerate(node_genes_dict.keys())}
+        self._number_of_nodes = len(node_genes)
+
+        input_nodes = [node for node in node_genes if node.node_type == NodeType.INPUT]
+        # input node i reads entry i of the inputs, input nodes are numbered 0 to #inputs - 1 (see NodeRegistry)
+        self._input_positions = np.array([self._node_positions[node.index] for node in input_nodes], dtype=np.intp)
+        self._input_indices = np.array([node.index for node in input_nodes], dtype=np.intp)
+        self._bias_positions = np.array([self._node_positions[node.index] for node in node_genes
+                                         if node.node_type == NodeType.BIAS], dtype=np.intp)
+        self._output_positions = np.array([self._node_positions[node.index]
+                                           for node in define_order_on_outputs(node_genes)], dtype=np.intp)
+
+        # list of (destination positions, source positions, transposed weight block) triplets, from the first layer
+        # after the inputs onwards
+        self._layers = []
+        # key: index of an enabled connection, value: (layer number, row, column) of its weight, for set_weight
+        self._weight_positions = {}
+        layer_to_node_indices_dict = divide_nodes_to_layers(node_genes)
+        for layer_num in sorted(layer_to_node_indices_dict.keys()):
+            layer_nodes = [node_genes_dict[node_index] for node_index in layer_to_node_indices_dict[layer_num]
+                           if node_genes_dict[node_index].node_type not in (NodeType.INPUT, NodeType.BIAS)]
+            if layer_nodes:
+                self._layers.append(self._compile_layer(layer_nodes))
+
+    @property
+    def number_of_nodes(self):
+        return self._number_of_nodes
+
+    @property
+    def number_of_outputs(self):
+        return len(self._output_positions)
+
+    @property
+    def input_positions(self):
+        return self._input_positions
+
+    @property
+    def input_indices(self):
+        """The entry of the inputs vector read by each of the input_positions"""
+        return self._input_indices
+
+    @property
+    def bias_positions(self):
+        return self._bias_positions
+
+    @property
+    def output_positions(self):
+        return self._output_positions
+
+    @property
+    def layers(self):
+        """A list of (destination positions, source positions, weights) triplets in activation order, where weights is
+        a (sources x destinations) array"""
+        return self._layers
+
+    def initial_activations(self):
+        """Returns a new activation vector, all nodes start with a 0.0 activation"""
+        return np.zeros(self._number_of_nodes)
+
+    def activate(self, activations, inputs):
+        """Performs a single forward pass, updating activations in place. Returns the output nodes' activations,
+        ordered from output node 0 to output node #outputs - 1.
+        activations may also be a (batch, nodes) array, in which case inputs is a (batch, inputs) array."""
+        activations[..., self._input_positions] = np.asarray(inputs, dtype=np.float64)[..., self._input_indices]
+        activations[..., self._bias_positions] = 1.0  # BIAS node activation is always 1.0
+        for destination_positions, source_positions, weights in self._layers:
+            # the whole layer reads the activations before it updates any of them, so a recurrent loop inside the
+            # layer uses old activations
+            activations[..., destination_positions] = expit(activations[..., source_positions] @ weights)
+        return activations[..., self._output_positions]
+
+    def set_weight(self, connection_index, weight):
+        """Patches the weight of a connection in place, so a weight change doesn't need a recompile. Returns False if
+        the connection isn't part of the network (i.e. it's disabled)"""
+        weight_position = self._weight_positions.get(connection_index)
+        if weight_position is None:
+            return False
+        layer_number, row, column = weight_position
+        self._layers[layer_number][2][row, column] = weight
+        return True
+
+    def _compile_layer(self, layer_nodes):
+        destination_positions = np.array([self._node_positions[node.index] for node in layer_nodes], dtype=np.intp)
+        # key: source node position, value: column in the layer's weight block
+        source_columns = {}
+        for node in layer_nodes:
+            for connection in node.enabled_incoming_connections:
+                source_columns.setdefault(self._node_positions[connection.source_node.index], len(source_columns))
+        source_positions = np.array(list(source_columns.keys()), dtype=np.intp)
+        # stored transposed (sources x destinations) so a pass is a single activations @ weights product.
+        # a node without enabled incoming connections gets an all-zeros column, i.e. sigmoid(0)
+        weights = np.zeros((len(source_positions), len(destination_positions)))
+        layer_number = len(self._layers)
+        for column, node in enumerate(layer_nodes):
+            for connection in node.enabled_incoming_connections:
+                row = source_columns[self._node_positions[connection.source_node.index]]
+                weights[row, column] = connection.weight
+                self._weight_positions[connection.index] = (layer_number, row, column)
+        return destination_positions, source_positions, weights
+
+
+class NetworkRunner:
+    """Runs a CompiledNetwork over a batch of independent input streams (e.g. episodes of a control task), keeping the
+    recurrent state of each stream as a row of a (batch, nodes) array between steps."""
+
+    def __init__(self, network, batch_size=1):
+        self._network = network
+        self._state = None
+        self.reset(batch_size)
+
+    @property
+    def batch_size(self):
+        return self._state.shape[0]
+
+    @property
+    def state(self):
+        """Returns a copy of the (batch, nodes) recurrent state, which can later be restored with set_state"""
+        return self._state.copy()
+
+    def set_state(self, state):
+        state = np.asarray(state, dtype=np.float64)
+        if state.ndim != 2 or state.shape[1] != self._network.number_of_nodes:
+            raise ValueError("State must be a (batch, %s) array" % self._network.number_of_nodes)
+        self._state = state.copy()
+
+    def reset(self, batch_size=None):
+        """Forgets the recurrent state, all nodes go back to a 0.0 activation. The batch size may be changed."""
+        if batch_size is None:
+            batch_size = self.batch_size
+        if batch_size <= 0:
+            raise ValueError("Batch size must be positive")
+        self._state = np.zeros((batch_size, self._network.number_of_nodes))
+
+    def step(self, batch_of_inputs):
+        """Performs a single forward pass of every stream. batch_of_inputs is a (batch, inputs) array, returns a
+        (batch, outputs) array"""
+        batch_of_inputs = np.asarray(batch_of_inputs, dtype=np.float64)
+        if batch_of_inputs.ndim != 2 or batch_of_inputs.shape[0] != self.batch_size:
+            raise ValueError("Inputs must be a (%s, inputs) array" % self.batch_size)
+        return self._network.activate(self._state, batch_of_inputs)
+
+    def run_sequence(self, inputs):
+        """Steps through a (time, batch, inputs) array of inputs, continuing from the current state. Returns the
+        (time, batch, outputs) array of outputs. Only the loop over time is done in python."""
+        inputs = np.asarray(inputs, dtype=np.float64)
+        if inputs.ndim != 3 or inputs.shape[1] != self.batch_size:
+            raise ValueError("Inputs must be a (time, %s, inputs) array" % self.batch_size)
+        network, state = self._network, self._state
+        # gather the input nodes' values of all steps at once
+        input_values = inputs[..., network.input_indices]
+        input_positions, output_positions, layers = network.input_positions, network.output_positions, network.layers
+        outputs = np.empty((inputs.shape[0], self.batch_size, network.number_of_outputs))
+        # no layer updates the bias nodes, so they're set once
+        state[:, network.bias_positions] = 1.0
+        for time_step in range(inputs.shape[0]):
+            state[:, input_positions] = input_values[time_step]
+            for destination_positions, source_positions, weights in layers:
+                state[:, destination_positions] = expit(state[:, source_positions] @ weights)
+            outputs[time_step] = state[:, output_positions]
+        return outputs
+
+
+class PopulationNetwork:
+    """Many genomes' networks packed into a single block-diagonal network, so that a forward pass of all genomes over a
+    batch of observations is one sparse matmul per layer.
+    The k-th layer of every genome is evaluated together - genomes are independent of each other so they only need to
+    agree on the order of their own layers. Like the single genome agent, recurrent state is kept between calls to
+    activate (one state per observation in the batch)."""
+
+    def __init__(self, genomes):
+        networks = [genome.compiled_network for genome in genomes]
+        if not networks:
+            raise ValueError("A population network must be built from at least one genome")
+        if len(set(network.number_of_outputs for network in networks)) != 1:
+            raise ValueError("All genomes must have the same number of output nodes")
+        self._number_of_genomes = len(networks)
+        self._number_of_outputs = networks[0].number_of_outputs
+
+        # each genome's activation vector is a contiguous block of the packed activation vector
+        offsets = np.cumsum([0] + [network.number_of_nodes for network in networks])
+        self._number_of_nodes = int(offsets[-1])
+        self._input_positions = np.concatenate([network.input_positions + offset
+                                                for network, offset in zip(networks, offsets)])
+        self._input_indices = np.concatenate([network.input_indices for network in networks])
+        # the genome each input position belongs to, used when every genome gets its own observations
+        self._input_genomes = np.concatenate([np.full(len(network.input_positions), genome_number, dtype=np.intp)
+                                              for genome_number, network in enumerate(networks)])
+        self._bias_positions = np.concatenate([network.bias_positions + offset
+                                               for network, offset in zip(networks, offsets)])
+        self._output_positions = np.concatenate([network.output_positions + offset
+                                                 for network, offset in zip(networks, offsets)])
+
+        self._layers = []
+        number_of_layers = max(len(network.layers) for network in networks)
+        for layer_number in range(number_of_layers):
+            blocks = [(network.layers[layer_number], offset) for network, offset in zip(networks, offsets)
+                      if layer_number < len(network.layers)]
+            self._layers.append(self._pack_layer(blocks))
+
+        self._activations = None
+
+    def reset(self):
+        """Forgets the recurrent state, all nodes go back to a 0.0 activation"""
+        self._activations = None
+
+    def activate(self, observations):
+        """Performs a single forward pass of every genome over a batch of observations.
+        observations is either a (batch, inputs) array fed to all genomes, or a (genomes, batch, inputs) array holding
+        each genome's own observations. Returns a (genomes, batch, outputs) array."""
+        observations = np.asarray(observations, dtype=np.float64)
+        if observations.ndim == 2:
+            inputs = observations.T[self._input_indices]
+        elif observations.ndim == 3:
+            if observations.shape[0] != self._number_of_genomes:
+                raise ValueError("Expected observations for %s genomes, got %s" %
+                                 (self._number_of_genomes, observations.shape[0]))
+            inputs = observations[self._input_genomes, :, self._input_indices]
+        else:
+            raise ValueError("Observations must be a 2-D or a 3-D array")
+
+        batch_size = observations.shape[-2]
+        if self._activations is None or self._activations.shape[1] != batch_size:
+            # (nodes, batch) so that a layer is a sparse (destinations x nodes) @ (nodes x batch) product
+            self._activations = np.zeros((self._number_of_nodes, batch_size))
+        activations = self._activations
+
+        activations[self._input_positions] = inputs
+        activations[self._bias_positions] = 1.0
+        for destination_positions, weights in self._layers:
+            activations[destination_positions] = expit(weights @ activations)
+
+        outputs = activations[self._output_positions]
+        return outputs.reshape(self._number_of_genomes, self._number_of_outputs, batch_size).transpose(0, 2, 1)
+
+    def _pack_layer(self, blocks):
+        """Packs the same layer of several genomes into one sparse (destinations x all nodes) weight matrix"""
+        destination_positions, rows, columns, weights = [], [], [], []
+        number_of_rows = 0
+        for (layer_destinations, layer_sources, layer_weights), offset in blocks:
+            destination_positions.append(layer_destinations + offset)
+            source_numbers, destination_numbers = np.nonzero(layer_weights)
+            rows.append(destination_numbers + number_of_rows)
+            columns.append(layer_sources[source_numbers] + offset)
+            weights.append(layer_weights[source_numbers, destination_numbers])
+            number_of_rows += len(layer_destinations)
+        packed_weights = sparse.csr_matrix((np.concatenate(weights), (np.concatenate(rows), np.concatenate(columns))),
+                                           shape=(number_of_rows, self._number_of_nodes))
+        return np.concatenate(destination_positions), packed_weights
+
+
+def activate_population(genomes, observations):
+    """Returns the outputs of a single (stateless) forward pass of every genome over observations.
+    See PopulationNetwork.activate for the expected shapes."""
+    return PopulationNetwork(genomes).activate(observations)
+
+
+def define_order_on_outputs(node_genes):
+    # from output node 0 to output node #outputs - 1
+    sorted_outputs_list = []
+    for node_gene in node_genes:
+        if node_gene.node_type == NodeType.OUTPUT:
+            sorted_outputs_list.append(node_gene)
+    list.sort(sorted_outputs_list, key=lambda node: node.index)
+    return sorted_outputs_list
+
+
+def divide_nodes_to_layers(node_genes):
+    """Returns a dict, key: layer number, value: list of the layer's node indices.
+    Layer 0 contains all and only input (and bias) nodes. A node's layer is the length of the longest path reaching it
+    from the inputs in the graph where every strongly connected component (i.e. every recurrent loop) is collapsed
+    into a single node. All nodes of a loop thus share a layer and read each other's previous-step activations, while
+    every other edge goes forward from a lower layer to a higher one. Nodes which can't be reached from the inputs are
+    put in the last layer. Runs in O(V+E) and without recursion.
+    Acyclic networks get the same layers as with the longest acyclic path to each node, but recurrent networks don't:
+    within a loop, an edge which went forward on the node's longest acyclic path used to read the current step's
+    activation and now reads the previous step's, so their outputs differ. Ordering the nodes of a loop by their
+    longest acyclic paths would take exponential time."""
+    node_genes = list(node_genes)
+    successors = {node.index: [connection.destination_node.index for connection in node.enabled_outgoing_connections]
+                  for node in node_genes}
+    components = _strongly_connected_components(successors)
+    component_of_node = {node_index: component_number for component_number, component in enumerate(components)
+                         for node_index in component}
+
+    # key: component number, value: longest path to the component, -1 if it isn't reachable from the inputs
+    longest_path = [-1] * len(components)
+    for node in node_genes:
+        if node.node_type == NodeType.INPUT or node.node_type == NodeType.BIAS:
+            longest_path[component_of_node[node.index]] = 0
+    # Tarjan's algorithm finds the components in reverse topological order, so every component is reached only after
+    # all of its predecessors
+    for component_number in reversed(range(len(components))):
+        if longest_path[component_number] < 0:
+            continue
+        for node_index in components[component_number]:
+            for successor in successors[node_index]:
+                successor_component = component_of_node[successor]
+                if successor_component != component_number:
+                    longest_path[successor_component] = max(longest_path[successor_component],
+                                                            longest_path[component_number] + 1)
+
+    max_layer = max(longest_path)
+    layer_to_node_genes = {}     # key: layer number, value: nodes list
+    for node in node_genes:
+        layer = longest_path[component_of_node[node.index]]
+        if layer < 0:
+            layer = max_layer + 1
+        layer_to_node_genes.setdefault(layer, []).append(node.index)
+
+    return layer_to_node_genes
+
+
+def _strongly_connected_components(successors):
+    """Iterative Tarjan's algorithm. successors is a dict, key: node, value: list of the node's successors.
+    Returns a list of components (lists of nodes) in reverse topological order."""
+    order = {}          # key: node, value: the order in which the node was discovered
+    lowlink = {}
+    stack = []
+    on_stack = set()
+    components = []
+    for root in successors:
+        if root in order:
+            continue
+        order[root] = lowlink[root] = len(order)
+        stack.append(root)
+        on_stack.add(root)
+        work = [(root, iter(successors[root]))]
+        while work:
+            node, node_successors = work[-1]
+            for successor in node_successors:
+                if successor not in order:
+                    order[successor] = lowlink[successor] = len(order)
+                    stack.append(successor)
+                    on_stack.add(successor)
+                    work.append((successor, iter(successors[successor])))
+                    break
+                elif successor in on_stack:
+                    lowlink[node] = min(lowlink[node], order[successor])
+            else:
+                # all of node's successors were visited
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[node])
+                if lowlink[node] == order[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.remove(member)
+                        component.append(member)
+                        if member == node:
+                            break
+                    components.append(component)
+    return components
@@ -1,55 +1,159 @@
-import copy
 import functools
+import itertools
 import logging
 import random
 import time
 
 import numpy as np
 
-from simplyneat.breeder import mutations
+from simplyneat.breeder import fitness_sharing, mutations, selection
+from simplyneat.breeder.snapshot import GenerationSnapshot, attach_generation_snapshot
+from simplyneat.config.config import FitnessSharing
+from simplyneat.evaluator.evaluator import create_evaluator
+from simplyneat.genome.encoding import decode_genome, encode_genomes
 from simplyneat.genome.genes.connection_gene import ConnectionGene
-from simplyneat.genome.genome import calculate_mismatching_genes, Genome, compatibility_distance
+from simplyneat.genome.genes.node_gene import NodeRegistry, set_node_registry
+from simplyneat.genome.genome import Genome
+from simplyneat.instrumentation.instrumentation import Instrumentation
 from simplyneat.population.population import Population
+from simplyneat.workers.workers import WorkerPool, worker_config
 
 #TODO: openai gym not thread sasfe (doesnt work)
-#from multiprocessing.dummy import Pool
-from multiprocessing import Pool
 
 
 class Breeder:
-    """In charge of breeding populations, while applying mutations to new genomes. Keeps track of all innovations."""
+    """In charge of breeding populations, while applying mutations to new genomes. Keeps track of all innovations and
+    of all hidden nodes' indices. Owns the worker pool (if processes_in_pool > 1) for as long as it lives, close() it
+    when done."""
     def __init__(self, config):
         #TODO: re-add reset innovations each generation to config
-        self._compatibility_threshold = config.compatibility_threshold
         self._population_size = config.population_size
         self._elite_group_size = config.elite_group_size
+        self._fitness_sharing = config.fitness_sharing
         self._processes_in_pool = config.processes_in_pool
+        self._pipelined_breeding = config.pipelined_breeding
         self._config = config
 
         self._innovation_counter = 0
         self._innovations_dictionary = {}
+        # interns the hidden nodes' lineages to integer node indices, also used to decode them in logs
+        self._node_registry = NodeRegistry(config.number_of_input_nodes + config.number_of_output_nodes)
+        set_node_registry(self._node_registry)
+        # timings and counters of the breeding phases, taken once per generation by Neat
+        self._instrumentation = Instrumentation()
 
         if self._processes_in_pool > 1:
-            self._pool = Pool(self._processes_in_pool)
+            self._pool = WorkerPool(config)
         else:
             self._pool = None
 
+        self._evaluator = create_evaluator(config, pool=self._pool, node_registry=self._node_registry)
+
+    @property
+    def evaluator(self):
+        return self._evaluator
+
+    @property
+    def node_registry(self):
+        return self._node_registry
+
+    @property
+    def instrumentation(self):
+        return self._instrumentation
+
+    @property
+    def innovations_dictionary(self):
+        return self._innovations_dictionary
+
+    @property
+    def innovation_counter(self):
+        return self._innovation_counter
+
+    def restore_innovations(self, innovations_dictionary, innovation_counter, node_registry):
+        """Continues the innovation and node numbering of an earlier run, e.g. one resumed from a checkpoint"""
+        self._innovations_dictionary = innovations_dictionary
+        self._innovation_counter = innovation_counter
+        self._node_registry = node_registry
+        set_node_registry(self._node_registry)
+        self._evaluator.node_registry = node_registry
+
+    def close(self):
+        """Closes the evaluator and the worker pool"""
+        self._evaluator.close()
+        if self._pool is not None:
+            self._pool.close()
+
     def breed_population(self, population):
-        """Breeds and mutates population, returning the next generation"""
+        """Breeds and mutates population, returning the next generation. With a pool, the workers' utilization during
+        the generation is recorded: the time each of them spent running tasks, out of the generation's time."""
+        start_time = time.perf_counter()
+        self.reset_worker_utilization()     # only the tasks of this generation count
         new_population_genomes = population.elite_group
         pairs_of_parents_to_breed = self._generate_parents_pairs_to_breed(population)
-        # the functools.partial is a workaround to pass the config since pool.map doesn't accept lambda functions
-        #TODO: if config holds a lambda function (i.e. fitness) it fails. don't allow lambdas in config
-        #TODO: refactor to function with logging and everything
-        breeding_start_time = time.time()
-        if self._pool:
-            offsprings_structural_innovations_pairs = self._pool.map(functools.partial(_produce_offspring, config=self._config),
-                                                                    pairs_of_parents_to_breed)
+        if self._pool is not None and self._pipelined_breeding:
+            next_population = self._breed_pipelined(population, new_population_genomes, pairs_of_parents_to_breed)
         else:
-            offsprings_structural_innovations_pairs = list(map(functools.partial(_produce_offspring, config=self._config),
-                                                         pairs_of_parents_to_breed))
-
-        logging.debug("Breeding pairs of parents took %s sec", (time.time() - breeding_start_time))
+            next_population = self._breed_phased(population, new_population_genomes, pairs_of_parents_to_breed)
+        self.record_worker_utilization(time.perf_counter() - start_time)
+        return next_population
+
+    def reset_worker_utilization(self):
+        """Forgets the time the workers spent running tasks so far"""
+        if self._pool is not None:
+            self._pool.take_busy_times()
+
+    def record_worker_utilization(self, elapsed_time):
+        """Records the time the workers spent running tasks since the last reset or record, in total and out of
+        elapsed_time, if there are workers"""
+        if self._pool is None:
+            return
+        busy_times = self._pool.take_busy_times()
+        self._instrumentation.add_timing('worker_busy', sum(busy_times))
+        self._instrumentation.gauge('worker_utilization', sum(busy_times) / (len(busy_times) * elapsed_time))
+        self._instrumentation.gauge('worker_utilizations', [busy_time / elapsed_time for busy_time in busy_times])
+
+    def breed_offspring(self, population):
+        """Breeds and mutates a single offspring of population, with its innovations numbered, for steady-state
+        evolution (see steady_state.py). As in rtNEAT its species is drawn proportionately to the species' average
+        fitness, whatever config.fitness_sharing, and its parents are drawn from the species by
+        config.parent_selection."""
+        with self._instrumentation.timer('pair_selection'):
+            fitness, species_numbers = population.fitness_array, population.species_numbers
+            number_of_species = len(population.species)
+            average_fitness = np.bincount(species_numbers, weights=fitness, minlength=number_of_species) / \
+                np.bincount(species_numbers, minlength=number_of_species)
+            total_fitness = average_fitness.sum()
+            #TODO: assuming fitness function >=0
+            if total_fitness > 0:
+                species_number = np.random.choice(number_of_species, p=average_fitness / total_fitness)
+            else:
+                species_number = np.random.randint(number_of_species)
+            members = np.flatnonzero(species_numbers == species_number)
+            parent1, parent2 = members[selection.select_parent_numbers(fitness[members], 1, self._config)[0]]
+            parents_pair = (population.genomes[parent1], population.genomes[parent2])
+        number_of_nodes = len(self._node_registry)
+        with self._instrumentation.timer('breeding'):
+            offspring, structural_innovations = _produce_offspring(parents_pair, self._config, self._node_registry)
+        self._assign_innovations(structural_innovations)
+        offspring.invalidate_innovation_arrays()
+        self._instrumentation.count('offsprings')
+        self._instrumentation.count('structural_mutations', len(structural_innovations))
+        self._instrumentation.count('new_nodes', len(self._node_registry) - number_of_nodes)
+        return offspring
+
+    def _breed_phased(self, population, new_population_genomes, pairs_of_parents_to_breed):
+        """Breeds all of the offsprings, then assigns their innovations, then evaluates them and then speciates them.
+        Returns the next generation, made of new_population_genomes and the offsprings."""
+        number_of_nodes = len(self._node_registry)
+        # the functools.partial is a workaround to pass the config since pool.map doesn't accept lambda functions
+        with self._instrumentation.timer('breeding'):
+            if self._pool:
+                offsprings_structural_innovations_pairs = self._produce_offsprings_in_pool(population.genomes,
+                                                                                          pairs_of_parents_to_breed)
+            else:
+                offsprings_structural_innovations_pairs = list(map(
+                    functools.partial(_produce_offspring, config=self._config, node_registry=self._node_registry),
+                    pairs_of_parents_to_breed))
 
         new_structural_innovations = []
         new_offsprings = []
@@ -59,8 +163,18 @@ class Breeder:
         # assign the proper innovation numbers to the structural changes (for example, new connection) from the last
         # breeding session.
         self._assign_innovations(new_structural_innovations)
-        logging.debug("Breeder's innovations dictionary: " + str(self._innovations_dictionary))
-        logging.debug("Breeder's innovations counter: " + str(self._innovation_counter))
+        for offspring in new_offsprings:
+            offspring.invalidate_innovation_arrays()
+        # the innovations dictionary is large, don't format it unless it's logged
+        logging.debug("Breeder's innovations dictionary: %s", self._innovations_dictionary)
+        logging.debug("Breeder's innovations counter: %s", self._innovation_counter)
+        self._instrumentation.count('offsprings', len(new_offsprings))
+        self._instrumentation.count('structural_mutations', len(new_structural_innovations))
+        self._instrumentation.count('new_nodes', len(self._node_registry) - number_of_nodes)
+
+        # the offsprings are evaluated all together, once they are final
+        with self._instrumentation.timer('evaluation'):
+            self._evaluator.evaluate(new_offsprings)
 
         # add the new offsprings (with the correct innovation number for all of the genes)
         # to the new population's genomes
@@ -71,62 +185,130 @@ class Breeder:
             species.reset_genomes()
 
         assert len(new_population_genomes) == self._population_size
-        return Population(self._config, genomes=new_population_genomes, species=population.species)
+        with self._instrumentation.timer('speciation'):
+            return Population(self._config, genomes=new_population_genomes, species=population.species,
+                              pool=self._pool)
+
+    def _breed_pipelined(self, population, new_population_genomes, pairs_of_parents_to_breed):
+        """Same as _breed_phased, but the phases overlap: the new population speciates the offsprings as they stream
+        in from _breed_and_evaluate_in_pool, while the workers go on breeding and evaluating the rest"""
+        for species in population.species:
+            species.reset_genomes()
+        offsprings = self._breed_and_evaluate_in_pool(population.genomes, pairs_of_parents_to_breed)
+        with self._instrumentation.timer('pipeline'):
+            next_population = Population(self._config, genomes=itertools.chain(new_population_genomes, offsprings),
+                                         species=population.species, pool=self._pool)
+        assert len(next_population.genomes) == self._population_size
+        return next_population
+
+    def _breed_and_evaluate_in_pool(self, genomes, pairs_of_parents_to_breed):
+        """Yields an offspring for each pair of parents. The pool breeds chunks of the pairs from a snapshot of the
+        generation, like in _produce_offsprings_in_pool, and each chunk is handled as soon as any worker returns it:
+        its new nodes and innovations are numbered, its offsprings are submitted for evaluation and yielded. Once
+        all are yielded, waits for their evaluations."""
+        number_of_nodes = len(self._node_registry)
+        genome_numbers = {id(genome): genome_number for genome_number, genome in enumerate(genomes)}
+        pairs_of_genome_numbers = [(genome_numbers[id(genome1)], genome_numbers[id(genome2)])
+                                   for genome1, genome2 in pairs_of_parents_to_breed]
+        # a few chunks per worker, so the workers which are done breeding start evaluating the first chunks while
+        # the last ones are bred
+        number_of_chunks = min(len(pairs_of_genome_numbers), 4 * self._processes_in_pool)
+        chunks = [pairs_of_genome_numbers[i::number_of_chunks] for i in range(number_of_chunks)]
+        first_provisional_index = self._node_registry.first_hidden_index + len(self._node_registry)
+        evaluations = []
+        with GenerationSnapshot(genomes, self._node_registry) as snapshot:
+            self._instrumentation.count('snapshot_bytes', snapshot.nbytes)
+            chunks_results = self._pool.imap_unordered(functools.partial(_produce_offsprings_from_snapshot,
+                                                                         descriptor=snapshot.descriptor), chunks)
+            while True:
+                with self._instrumentation.timer('breeding_wait'):
+                    chunk_results = next(chunks_results, None)
+                if chunk_results is None:
+                    break
+                encoded_offsprings, new_node_lineages, structural_positions = chunk_results
+                self._intern_provisional_nodes(encoded_offsprings, new_node_lineages, first_provisional_index)
+                offsprings = []
+                new_structural_innovations = []
+                for offspring_number, positions in enumerate(structural_positions):
+                    offspring = decode_genome(encoded_offsprings, offspring_number, self._config)
+                    connections = list(offspring.connection_genes.values())
+                    new_structural_innovations += [connections[position] for position in positions]
+                    offsprings.append(offspring)
+                self._assign_innovations(new_structural_innovations)
+                for offspring in offsprings:
+                    offspring.invalidate_innovation_arrays()
+                evaluations.append(self._evaluator.submit(offsprings))
+                self._instrumentation.count('offsprings', len(offsprings))
+                self._instrumentation.count('structural_mutations', len(new_structural_innovations))
+                yield from offsprings
+        self._instrumentation.count('new_nodes', len(self._node_registry) - number_of_nodes)
+        with self._instrumentation.timer('evaluation_wait'):
+            for evaluation in evaluations:
+                evaluation.wait()
+
+    def _produce_offsprings_in_pool(self, genomes, pairs_of_parents_to_breed):
+        """Same as mapping _produce_offspring over the pairs, but the workers read the parents from a shared memory
+        snapshot of the generation and send back the offsprings in the compact encoding, so no genome object is
+        pickled either way"""
+        genome_numbers = {id(genome): genome_number for genome_number, genome in enumerate(genomes)}
+        pairs_of_genome_numbers = [(genome_numbers[id(genome1)], genome_numbers[id(genome2)])
+                                   for genome1, genome2 in pairs_of_parents_to_breed]
+        # a few chunks per worker balance the load while each worker decodes every parent at most once per chunk
+        number_of_chunks = min(len(pairs_of_genome_numbers), 4 * self._processes_in_pool)
+        chunks = [pairs_of_genome_numbers[i::number_of_chunks] for i in range(number_of_chunks)]
+
+        # workers give the new nodes they create provisional indices, starting right after the snapshot's nodes
+        first_provisional_index = self._node_registry.first_hidden_index + len(self._node_registry)
+        with GenerationSnapshot(genomes, self._node_registry) as snapshot:
+            chunks_results = self._pool.map(functools.partial(_produce_offsprings_from_snapshot,
+                                                              descriptor=snapshot.descriptor), chunks)
+            self._instrumentation.count('snapshot_bytes', snapshot.nbytes)
+
+        offsprings_structural_innovations_pairs = [None] * len(pairs_of_genome_numbers)
+        for chunk_number, (encoded_offsprings, new_node_lineages, structural_positions) in enumerate(chunks_results):
+            self._intern_provisional_nodes(encoded_offsprings, new_node_lineages, first_provisional_index)
+            for offspring_number, positions in enumerate(structural_positions):
+                offspring = decode_genome(encoded_offsprings, offspring_number, self._config)
+                connections = list(offspring.connection_genes.values())
+                # chunk i holds pairs i, i + #chunks, i + 2 * #chunks...
+                offsprings_structural_innovations_pairs[chunk_number + offspring_number * number_of_chunks] = \
+                    (offspring, [connections[position] for position in positions])
+        return offsprings_structural_innovations_pairs
+
+    def _intern_provisional_nodes(self, encoded_genomes, new_node_lineages, first_provisional_index):
+        """Interns the lineages of the nodes a worker created in the breeder's registry, and replaces their provisional
+        indices in the encoded genomes with the interned ones. Provisional index first_provisional_index + k stands
+        for the node of row k of new_node_lineages."""
+        interned_indices = np.empty(len(new_node_lineages), dtype=np.int64)
+        for k, (source_index, dest_index, split_number) in enumerate(new_node_lineages.tolist()):
+            # a lineage may only refer to provisional indices of nodes created before it
+            if source_index >= first_provisional_index:
+                source_index = int(interned_indices[source_index - first_provisional_index])
+            if dest_index >= first_provisional_index:
+                dest_index = int(interned_indices[dest_index - first_provisional_index])
+            interned_indices[k] = self._node_registry.intern(source_index, dest_index, split_number)
+        for column in ('sources', 'destinations'):
+            node_indices = encoded_genomes[column]
+            provisional = node_indices >= first_provisional_index
+            node_indices[provisional] = interned_indices[node_indices[provisional] - first_provisional_index]
 
     def _generate_parents_pairs_to_breed(self, population):
         #TODO: why wait? when pair is ready, breed async (or not? map is better because chinks?)
-        pairs_calc_start_time = time.time()
-
         species_list = population.species
         new_species_distribution = self._calculate_offspring_per_species(species_list, population)
-        pairs_of_parents_to_breed = []
-        # create new genomes from existing ones
-        for species_index in range(len(species_list)):
-            # repeat once for each genomes in the new species' distribution
-            for _ in range(new_species_distribution[species_index]):
-                genomes = species_list[species_index].genomes
-                assert len(genomes) > 0
-                #TODO: give a small chance for 0-fitness genomes?
-                fitness_list = [genome.fitness for genome in genomes]
-                sum_of_fitness = sum(fitness_list)
-                #TODO: assuming fitness function >=0
-                if sum_of_fitness == 0:
-                    # uniform distribution
-                    probabilities = None
-                else:
-                    probabilities = [genome.fitness/sum_of_fitness for genome in genomes]
-
-                genome1 = np.random.choice(genomes, p=probabilities)
-                genome2 = np.random.choice(genomes, p=probabilities)
-
-                pairs_of_parents_to_breed.append((genome1, genome2))
-
-        logging.debug("Pairs to breed (#%s) calculation took %s sec" % (len(pairs_of_parents_to_breed),
-                                                                        (time.time() - pairs_calc_start_time)))
-        return pairs_of_parents_to_breed
+        # create new genomes from existing ones, each species breeds as many pairs as its share in the distribution
+        with self._instrumentation.timer('pair_selection'):
+            return selection.select_parents(species_list, new_species_distribution, self._config)
 
     def _calculate_adjusted_fitness_of_list_of_species(self, list_of_species, population):
-        start_time = time.time()
-        genomes = population.genomes
-        if self._pool:
-            # parallel evaluation
-            adjusted_fitness = list(self._pool.map(
-                functools.partial(_calculate_adjusted_fitness_of_genome, population=population,
-                                  compatibility_threshold=self._compatibility_threshold), genomes))
-        else:
-            # sequential evaluation
-            adjusted_fitness = list(map(
-                functools.partial(_calculate_adjusted_fitness_of_genome, population=population,
-                                  compatibility_threshold=self._compatibility_threshold), genomes))
-
-        adjusted_fitness_of_species = [0] * len(list_of_species)
-        for genome_index in range(len(genomes)):
-            for species_index in range(len(list_of_species)):
-                if genomes[genome_index] in list_of_species[species_index].genomes:
-                    adjusted_fitness_of_species[species_index] += adjusted_fitness[genome_index]
-
-        logging.debug("Adjusted fitness of all species' genomes calculation took %s sec" % (time.time() - start_time))
-        return adjusted_fitness_of_species
+        with self._instrumentation.timer('fitness_sharing'):
+            if self._fitness_sharing == FitnessSharing.SPECIES:
+                return fitness_sharing.species_adjusted_fitness(list_of_species)
+            elif self._fitness_sharing == FitnessSharing.EXACT:
+                return fitness_sharing.exact_adjusted_fitness(list_of_species, population.genomes, self._config,
+                                                              pool=self._pool)
+            else:
+                raise ValueError("Fitness sharing %s unknown" % str(self._fitness_sharing))
 
     def _calculate_offspring_per_species(self, list_of_species, population):
         """returns a list, entry [i] is the number of offsprings for species i in the following generation"""
@@ -151,24 +333,50 @@ class Breeder:
 
     def _assign_innovations(self, genes):
         # we only assign innovation numbers to connection genes
-        assignment_start_time = time.time()
-        connection_genes = [gene for gene in genes if isinstance(gene, ConnectionGene)]
-        for gene in connection_genes:
-            if gene.index in self._innovations_dictionary:
-                gene.innovation = self._innovations_dictionary[gene.index]
-            else:
-                gene.innovation = self._innovation_counter
-                self._innovations_dictionary[gene.index] = gene.innovation
-                self._innovation_counter += 1
-        logging.debug("Innovation numbers assignment to offsprings took %s" % (time.time() - assignment_start_time))
+        with self._instrumentation.timer('innovation_assignment'):
+            innovation_counter_before = self._innovation_counter
+            connection_genes = [gene for gene in genes if isinstance(gene, ConnectionGene)]
+            for gene in connection_genes:
+                if gene.index in self._innovations_dictionary:
+                    gene.innovation = self._innovations_dictionary[gene.index]
+                else:
+                    gene.innovation = self._innovation_counter
+                    self._innovations_dictionary[gene.index] = gene.innovation
+                    self._innovation_counter += 1
+            self._instrumentation.count('new_innovations', self._innovation_counter - innovation_counter_before)
 
 
-def _produce_offspring(parents_pair, config):
+def _produce_offspring(parents_pair, config, node_registry):
     offspring = _breed_parents(parents_pair[0], parents_pair[1], config)
-    structural_innovations = _mutate_offspring(offspring, config)
+    structural_innovations = _mutate_offspring(offspring, config, node_registry)
     return offspring, structural_innovations
 
-#TODO: refactor - error prone (using innvation as keys, than index, that's confusing)
+
+def _produce_offsprings_from_snapshot(pairs_of_genome_numbers, descriptor):
+    """Produces an offspring for each pair of genome numbers of a GenerationSnapshot. Returns the encoded offsprings,
+    the lineages of the nodes they added to the snapshot's node registry (in the order of their provisional indices),
+    and for each offspring the positions (in its connection genes) of the structural innovations' connection genes"""
+    config = worker_config()
+    offsprings = []
+    structural_positions = []
+    with attach_generation_snapshot(descriptor) as (arrays, node_registry):
+        number_of_snapshot_nodes = len(node_registry)
+        parents = {}    # key: genome number, value: decoded genome
+        for genome_number1, genome_number2 in pairs_of_genome_numbers:
+            for genome_number in (genome_number1, genome_number2):
+                if genome_number not in parents:
+                    parents[genome_number] = decode_genome(arrays, genome_number, config)
+            offspring, structural_innovations = _produce_offspring((parents[genome_number1], parents[genome_number2]),
+                                                                   config, node_registry)
+            positions = {id(connection): position
+                         for position, connection in enumerate(offspring.connection_genes.values())}
+            offsprings.append(offspring)
+            # only connection genes are assigned innovation numbers, so there's no need to send back the new nodes
+            structural_positions.append([positions[id(gene)] for gene in structural_innovations
+                                         if isinstance(gene, ConnectionGene)])
+
+    return encode_genomes(offsprings), node_registry.lineages[number_of_snapshot_nodes:], structural_positions
+
 def _breed_parents(parent_genome1, parent_genome2, config):
     """Returns a genome containing the crossover of connection-genes from both genomes"""
     # Matching genes are inherited randomly, excess and disjoint genes are inherited from the better parent
@@ -179,38 +387,29 @@ def _breed_parents(parent_genome1, parent_genome2, config):
     if fitness2 > fitness1 or (fitness1 == fitness2 and parent_genome2.size < parent_genome1.size):
         parent_genome1, parent_genome2 = parent_genome2, parent_genome1
 
-    innovation_to_connections1 = {connection.innovation: connection for connection in parent_genome1.connection_genes.values()}
-    innovation_to_connections2 = {connection.innovation: connection for connection in parent_genome2.connection_genes.values()}
+    # the offspring has exactly the fitter parent's genes (mismatching genes of the other parent are dropped), so
+    # its columns are a copy of the fitter parent's, patched at the matching genes
+    genes1, genes2 = parent_genome1.gene_arrays, parent_genome2.gene_arrays
+    weights, enabled, split_numbers = genes1['weights'].copy(), genes1['enabled'].copy(), genes1['split_numbers'].copy()
+
+    # both innovation columns are sorted, so one binary search aligns the matching genes
+    innovations1, innovations2 = genes1['innovations'], genes2['innovations']
+    positions = np.minimum(np.searchsorted(innovations2, innovations1), max(len(innovations2) - 1, 0))
+    matching1 = np.flatnonzero(innovations2[positions] == innovations1) if len(innovations2) else positions[:0]
+    matching2 = positions[matching1]
 
-    disjoint, excess = calculate_mismatching_genes(innovation_to_connections1, innovation_to_connections2)
-    mismatching = disjoint + excess
-    matching = set(innovation_to_connections1.keys()).intersection(set(innovation_to_connections2.keys()))
-    #TODO: deep copy nodes and connections for the new genome instead of doing this
     #TODO: disable in probability p if disabled in one parent
-    offspring_connection_genes = {}
-    # matching genes - inherit one from a random parent
-    for innovation_number in matching:
-        max_split_number = max(innovation_to_connections1[innovation_number].split_number,
-                               innovation_to_connections2[innovation_number].split_number)
-        if random.choice([True, False]):        # take parent1's weight
-            connection_gene = copy.copy(innovation_to_connections1[innovation_number])
-            connection_gene.split_number = max_split_number
-            offspring_connection_genes[innovation_number] = connection_gene
-        else:                                   # take parent2's weight
-            connection_gene = copy.copy(innovation_to_connections2[innovation_number])
-            connection_gene.split_number = max_split_number
-            offspring_connection_genes[innovation_number] = connection_gene
-    # mismatched genes - inherit all from the fitter parent
-    for innovation_number in mismatching:
-        if innovation_number in innovation_to_connections1.keys():
-            offspring_connection_genes[innovation_number] = copy.copy(innovation_to_connections1[innovation_number])
-
-    offspring_connection_genes = {connection.index: connection for connection in offspring_connection_genes.values()}
-    new_genome = Genome(config, connection_genes=offspring_connection_genes)
-    return new_genome
-
-
-def _mutate_offspring(offspring, config):
+    # matching genes - inherit the weight and enabled flag of a random parent, and the larger split number
+    from_parent2 = np.random.random(len(matching1)) < 0.5
+    weights[matching1[from_parent2]] = genes2['weights'][matching2[from_parent2]]
+    enabled[matching1[from_parent2]] = genes2['enabled'][matching2[from_parent2]]
+    split_numbers[matching1] = np.maximum(split_numbers[matching1], genes2['split_numbers'][matching2])
+
+    return Genome.from_gene_arrays(config, genes1['sources'].tolist(), genes1['destinations'].tolist(),
+                                   weights.tolist(), enabled.tolist(), innovations1.tolist(), split_numbers.tolist())
+
+
+def _mutate_offspring(offspring, config, node_registry):
     """returns a list of the new structural changes' genes added to the offspring so the breeder can assign them
     the appropriate innovation number"""
     structural_mutations_genes = []
@@ -218,9 +417,11 @@ def _mutate_offspring(offspring, config):
     if random.random() < config.add_connection_probability:
         structural_mutations_genes += mutations.mutate_add_connection(genome=offspring,
                                                                       connection_weight_mutation_distribution=
-                                                                      config.connection_weight_mutation_distribution)
+                                                                      config.connection_weight_mutation_distribution,
+                                                                      allow_recurrent_connections=
+                                                                      config.allow_recurrent_connections)
     if random.random() < config.add_node_probability:
-        structural_mutations_genes += mutations.mutate_add_node(genome=offspring)
+        structural_mutations_genes += mutations.mutate_add_node(genome=offspring, node_registry=node_registry)
     if random.random() < config.change_weight_probability:
         mutations.mutate_connection_weight(genome=offspring,
                                            weight_mutation_distribution=
@@ -229,27 +430,3 @@ def _mutate_offspring(offspring, config):
         mutations.mutate_toggle_connection_enable(genome=offspring)
 
     return structural_mutations_genes
-
-
-def _calculate_adjusted_fitness_of_genome(genome, population, compatibility_threshold):
-    """Calculates the adjusted fitness of a single genome"""
-    sum_of_sharing = sum([_sharing_function(compatibility_distance(genome, other_genome), compatibility_threshold)
-                          for other_genome in population.genomes])
-    # sum_of_sharing is at least 1 since the sharing of an genome with itself is 1
-    return genome.fitness / sum_of_sharing
-
-
-def _sharing_function(distance, compatibility_threshold):
-    if distance >= compatibility_threshold:
-        return 0
-    else:
-        return 1
-
-
-#TODO: fitnesses typo
-def _sum_of_adjusted_fitness_in_species(species, population, compatibility_threshold):
-    species_total_adjusted_fitness = 0
-    for genome in species.genomes:
-        species_total_adjusted_fitness += _calculate_adjusted_fitness_of_genome(genome, population, compatibility_threshold)
-    return species_total_adjusted_fitness
-
@@ -0,0 +1,112 @@
+"""Fitness sharing: each genome's fitness is divided by the number of genomes it shares its niche with, so that no
+single species can take over the population. Each function returns a list, entry [i] is the sum of the adjusted
+fitness of species i's genomes."""
+import functools
+
+import numpy as np
+
+from simplyneat.breeder.shared_arrays import SharedArrays, attach_shared_arrays
+
+
+def species_adjusted_fitness(list_of_species):
+    """Explicit fitness sharing as in the NEAT paper: a genome's niche is its species, so its adjusted fitness is its
+    fitness divided by the size of its species. O(N)."""
+    adjusted_fitness_of_species = []
+    for species in list_of_species:
+        if species.size == 0:
+            adjusted_fitness_of_species.append(0)
+        else:
+            adjusted_fitness_of_species.append(sum(genome.fitness for genome in species.genomes) / species.size)
+    return adjusted_fitness_of_species
+
+
+def exact_adjusted_fitness(list_of_species, genomes, config, pool=None):
+    """A genome's niche is every genome (in the entire population) within compatibility threshold of it.
+    The N x N compatibility distances are computed once per generation by vectorized kernels over a dense encoding of
+    the population's genes. With a pool, the encoding is placed in shared memory and each worker computes a block of
+    rows, returning only the number of genomes within threshold of each genome of the block."""
+    gene_arrays = _encode_genes(genomes)
+    coefficients = (config.excess_coefficient, config.disjoint_coefficient, config.weight_difference_coefficient)
+    row_blocks = _split_rows(len(genomes), 1 if pool is None else config.processes_in_pool)
+    if pool is None:
+        neighbours = np.concatenate([_count_neighbours(gene_arrays, rows, coefficients, config.compatibility_threshold)
+                                     for rows in row_blocks])
+    else:
+        with SharedArrays(gene_arrays) as shared_gene_arrays:
+            neighbours = np.concatenate(pool.map(
+                functools.partial(_count_neighbours_in_shared_memory, descriptor=shared_gene_arrays.descriptor,
+                                  coefficients=coefficients,
+                                  compatibility_threshold=config.compatibility_threshold), row_blocks))
+
+    # key: id of genome, value: adjusted fitness of the genome
+    # neighbours is at least 1 since the sharing of an genome with itself is 1
+    adjusted_fitness = {id(genome): genome.fitness / number_of_neighbours
+                        for genome, number_of_neighbours in zip(genomes, neighbours)}
+    return [sum(adjusted_fitness[id(genome)] for genome in species.genomes) for species in list_of_species]
+
+
+def _encode_genes(genomes):
+    """Returns a dict of dense arrays describing the connection genes of all genomes, where column k stands for the
+    k-th smallest innovation number present in the population"""
+    innovation_arrays = [genome.innovation_arrays for genome in genomes]
+    all_innovations = np.unique(np.concatenate([innovations for innovations, _ in innovation_arrays] +
+                                               [np.empty(0, dtype=np.int64)]))
+    present = np.zeros((len(genomes), len(all_innovations)), dtype=bool)
+    weights = np.zeros((len(genomes), len(all_innovations)))
+    for row, (innovations, genome_weights) in enumerate(innovation_arrays):
+        columns = np.searchsorted(all_innovations, innovations)
+        present[row, columns] = True
+        weights[row, columns] = genome_weights
+    lengths = present.sum(axis=1)
+    # column of each genome's max innovation number, -1 for a genome without genes
+    max_columns = np.full(len(genomes), -1)
+    if len(all_innovations):
+        max_columns[lengths > 0] = len(all_innovations) - 1 - np.argmax(present[lengths > 0, ::-1], axis=1)
+    # entry [i, k + 1] is the number of genes of genome i up to (and including) column k, entry [i, 0] is 0
+    cumulative_counts = np.zeros((len(genomes), len(all_innovations) + 1), dtype=np.int32)
+    np.cumsum(present, axis=1, dtype=np.int32, out=cumulative_counts[:, 1:])
+    return {'present': present, 'weights': weights, 'lengths': lengths, 'max_columns': max_columns,
+            'cumulative_counts': cumulative_counts}
+
+
+def _distances_from_genome(gene_arrays, row, coefficients):
+    """Returns the compatibility distances of genome number row to all genomes. Same as compatibility_distance."""
+    excess_coefficient, disjoint_coefficient, weight_difference_coefficient = coefficients
+    present, weights, lengths = gene_arrays['present'], gene_arrays['weights'], gene_arrays['lengths']
+    max_columns, cumulative_counts = gene_arrays['max_columns'], gene_arrays['cumulative_counts']
+
+    # only the row's own genes can match, so the work is O(N * the row's genome size)
+    columns = np.flatnonzero(present[row])
+    matching = present[:, columns]
+    number_of_matching = matching.sum(axis=1)
+    weight_differences = (np.abs(weights[:, columns] - weights[row, columns]) * matching).sum(axis=1)
+    average_weight_difference = np.divide(weight_differences, number_of_matching,
+                                          out=np.zeros(len(lengths)), where=number_of_matching > 0)
+
+    # mismatching genes up to the smaller max innovation number are disjoint, the rest are excess.
+    # if one of the genomes has no genes the smaller max column is -1, there are no genes up to it and so no disjoint
+    n_columns = np.minimum(max_columns, max_columns[row])
+    up_to_n = cumulative_counts[row, n_columns + 1] + cumulative_counts[np.arange(len(lengths)), n_columns + 1]
+    number_of_disjoint = up_to_n - 2 * number_of_matching
+    number_of_excess = lengths[row] + lengths - 2 * number_of_matching - number_of_disjoint
+
+    N = np.maximum(np.maximum(lengths, lengths[row]), 1)
+    return excess_coefficient * number_of_excess / N + disjoint_coefficient * number_of_disjoint / N + \
+        weight_difference_coefficient * average_weight_difference
+
+
+def _count_neighbours(gene_arrays, rows, coefficients, compatibility_threshold):
+    """Returns, for each genome number in rows, the number of genomes within compatibility_threshold of it"""
+    return np.array([np.count_nonzero(_distances_from_genome(gene_arrays, row, coefficients) < compatibility_threshold)
+                     for row in rows], dtype=np.int64)
+
+
+def _count_neighbours_in_shared_memory(rows, descriptor, coefficients, compatibility_threshold):
+    with attach_shared_arrays(descriptor) as gene_arrays:
+        return _count_neighbours(gene_arrays, rows, coefficients, compatibility_threshold)
+
+
+def _split_rows(number_of_rows, number_of_workers):
+    # a few blocks per worker balance the load without making tasks too small
+    number_of_blocks = 1 if number_of_workers <= 1 else max(1, min(number_of_rows, 4 * number_of_workers))
+    return [rows for rows in np.array_split(np.arange(number_of_rows), number_of_blocks) if len(rows)]
@@ -1,4 +1,3 @@
-import itertools
 import logging
 import random
 
@@ -10,6 +9,11 @@ mutates the genome inplace.
 Returns a list of the changed gene(s) of the given genome.
 """
 
+# number of uniformly drawn pairs of nodes add_connection tries before enumerating all of the free pairs
+_MAX_EDGE_SAMPLING_ATTEMPTS = 20
+# above this ratio of existing connections to pairs of nodes, the graph is nearly complete and sampling is wasteful
+_NEARLY_COMPLETE_GRAPH_DENSITY = 0.75
+
 #TODO: have it flip the state instead only enable
 def mutate_toggle_connection_enable(genome):
     connection_genes = list(genome.connection_genes.values())
@@ -21,25 +25,22 @@ def mutate_toggle_connection_enable(genome):
         connection_to_toggle.disable()
     else:  # connection disabled
         connection_to_toggle.enable()
+    genome.invalidate_innovation_arrays()
+    genome.invalidate_compiled_network()
     return [connection_to_toggle]
 
 
-def mutate_add_connection(genome, connection_weight_mutation_distribution):
+def mutate_add_connection(genome, connection_weight_mutation_distribution, allow_recurrent_connections=True):
+    """Connects a pair of nodes which aren't connected yet, chosen uniformly from all such pairs. If recurrent
+    connections aren't allowed, only pairs whose connection keeps the network acyclic are considered."""
     assert isinstance(genome, Genome)
-    # the keys of the genome.node_genes dict are the corresponding nodes' indexes
-    possible_sources = genome.node_genes.keys()
-    # INPUT\BIAS neurons can't be a destination.
-    possible_destinations = [node_index for node_index in genome.node_genes.keys()
-                             if genome.node_genes[node_index].node_type not in [NodeType.BIAS, NodeType.INPUT]]
-    # Two edges with the same source and destination are not possible.
-    possible_edges = list(set(itertools.product(possible_sources, possible_destinations)) -
-                          set([connection_gene.index for connection_gene in genome.connection_genes.values()]))
-    if not possible_edges:
-        logging.debug("No possible edges. Possible sources: %s, possible destinations: %s, current edges: %s",
-                      str(possible_sources), str(possible_destinations), str(genome.connection_genes.values()))
+    edge = _sample_free_edge(genome, allow_recurrent_connections)
+    if edge is None:
+        logging.debug("add_connection mutation failed: no possible edges. Node indices: %s, current edges: %s",
+                      str(genome.node_indices), str(list(genome.connection_genes.keys())))
         return []
     else:
-        source_index, dest_index = random.choice(possible_edges)  # randomly choose one edge from the possible edges
+        source_index, dest_index = edge
         source, dest = genome.node_genes[source_index], genome.node_genes[dest_index]
 
         new_connection = genome.add_connection_gene(source, dest, weight=connection_weight_mutation_distribution(),
@@ -47,8 +48,56 @@ def mutate_add_connection(genome, connection_weight_mutation_distribution):
         return [new_connection]
 
 
-def mutate_add_node(genome):
-    """Takes an existing edge and splits it in the middle with a new node"""
+def _sample_free_edge(genome, allow_recurrent_connections):
+    """Returns a uniformly chosen (source index, dest index) pair which isn't a connection of the genome (and doesn't
+    close a cycle, if recurrent connections aren't allowed), or None if there's no such pair"""
+    possible_sources, possible_destinations = genome.node_indices, genome.destination_node_indices
+    # the connection genes are keyed by (source index, dest index), so they're also the genome's set of edges
+    connection_genes = genome.connection_genes
+    if len(connection_genes) < _NEARLY_COMPLETE_GRAPH_DENSITY * len(possible_sources) * len(possible_destinations):
+        # drawing a pair uniformly and rejecting it if it's not free is uniform over the free pairs
+        for _ in range(_MAX_EDGE_SAMPLING_ATTEMPTS):
+            edge = random.choice(possible_sources), random.choice(possible_destinations)
+            if edge not in connection_genes and (allow_recurrent_connections or not _creates_cycle(genome, *edge)):
+                return edge
+    # the graph is nearly complete (or most pairs would close a cycle), enumerate the free pairs instead
+    free_edges = _enumerate_free_edges(genome, allow_recurrent_connections)
+    if not free_edges:
+        return None
+    return random.choice(free_edges)
+
+
+def _enumerate_free_edges(genome, allow_recurrent_connections):
+    connection_genes = genome.connection_genes
+    free_edges = []
+    for dest_index in genome.destination_node_indices:
+        # a connection into dest closes a cycle iff its source is reachable from dest
+        forbidden_sources = set() if allow_recurrent_connections else _reachable_node_indices(genome, dest_index)
+        free_edges += [(source_index, dest_index) for source_index in genome.node_indices
+                       if source_index not in forbidden_sources and (source_index, dest_index) not in connection_genes]
+    return free_edges
+
+
+def _creates_cycle(genome, source_index, dest_index):
+    return source_index in _reachable_node_indices(genome, dest_index)
+
+
+def _reachable_node_indices(genome, node_index):
+    """Returns the set of indices of nodes reachable from node_index (itself included), through enabled and disabled
+    connections alike since a disabled connection may be enabled again"""
+    reachable = {node_index}
+    stack = [node_index]
+    while stack:
+        for connection in genome.node_genes[stack.pop()].outgoing_connections:
+            next_index = connection.destination_node.index
+            if next_index not in reachable:
+                reachable.add(next_index)
+                stack.append(next_index)
+    return reachable
+
+
+def mutate_add_node(genome, node_registry):
+    """Takes an existing edge and splits it in the middle with a new node, whose index is interned in node_registry"""
     assert isinstance(genome, Genome)
     if not genome.connection_genes:
         logging.debug("add_note mutation failed: no connection genes to split")
@@ -66,10 +115,12 @@ def mutate_add_node(genome):
         # the split number makes sure that splitting the same connection more than once wouldn't result with nodes
         # with the same indices. The definition is recursive (we rely on previous node indexes - the old_source and
         # the old_dest, but that's ok because the input and output nodes' indexes are defined independently.
-        new_node_index = encode_node(old_source.index, old_dest.index, old_connection.split_number)
+        # The registry interns this definition to a small integer, so node indexes don't nest.
+        new_node_index = encode_node(old_source.index, old_dest.index, old_connection.split_number, node_registry)
 
         old_connection.split_number += 1
         old_connection.disable()
+        genome.invalidate_compiled_network()
 
         new_node = genome.add_node_gene(NodeType.HIDDEN, new_node_index)
         # the new connection leading into the new node from the old source has weight 1 according to the NEAT paper
@@ -88,7 +139,8 @@ def mutate_connection_weight(genome, weight_mutation_distribution):
         return []
     else:
         connection_gene = random.choice(list(genome.connection_genes.values()))
-        connection_gene.weight += weight_mutation_distribution()
+        # patches the genome's compiled network in place instead of recompiling it
+        genome.set_connection_weight(connection_gene, connection_gene.weight + weight_mutation_distribution())
         #TODO: clip weights?
         return [connection_gene]
         # TODO: read 4.1 better to understand how this works
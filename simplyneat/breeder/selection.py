@@ -0,0 +1,94 @@
+"""Parent selection: picks the pairs of parents each species breeds. The fitness of all breeding species is laid out
+in one array, species after species, so that every parent of the generation is drawn with a single vectorized call
+to numpy's RNG whatever the strategy."""
+import numpy as np
+
+from simplyneat.config.config import ParentSelection
+
+
+def select_parents(list_of_species, offspring_per_species, config):
+    """Returns a list of pairs of parent genomes, offspring_per_species[i] pairs from species i, in species order"""
+    # only species which have offsprings take part
+    breeding_species = [(species, number_of_offsprings)
+                        for species, number_of_offsprings in zip(list_of_species, offspring_per_species)
+                        if number_of_offsprings > 0]
+    if not breeding_species:
+        return []
+    genomes = [genome for species, _ in breeding_species for genome in species.genomes]
+    sizes = np.array([species.size for species, _ in breeding_species], dtype=np.int64)
+    assert np.all(sizes > 0)
+    starts = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+    fitness = np.array([genome.fitness for genome in genomes], dtype=np.float64)
+    # entry [k] is the number of the breeding species offspring k comes from
+    owners = np.repeat(np.arange(len(breeding_species)),
+                       [number_of_offsprings for _, number_of_offsprings in breeding_species])
+    parents = _select(fitness, sizes, starts, owners, config)
+    return [(genomes[parent1], genomes[parent2]) for parent1, parent2 in parents.tolist()]
+
+
+def select_parent_numbers(fitness, number_of_pairs, config):
+    """Same as select_parents for a single species whose members' fitness is the array fitness. Returns an array of
+    number_of_pairs rows, each a pair of member numbers."""
+    if not len(fitness):
+        raise ValueError("Can't select parents from an empty species")
+    return _select(fitness, np.array([len(fitness)]), np.array([0]), np.zeros(number_of_pairs, dtype=np.int64),
+                   config)
+
+
+def _select(fitness, sizes, starts, owners, config):
+    if config.parent_selection == ParentSelection.FITNESS_PROPORTIONATE:
+        return _fitness_proportionate(fitness, sizes, starts, owners)
+    if config.parent_selection == ParentSelection.TOURNAMENT:
+        return _tournament(fitness, sizes, starts, owners, config.tournament_size)
+    if config.parent_selection == ParentSelection.TRUNCATION:
+        return _truncation(fitness, sizes, starts, owners, config.truncation_fraction)
+    raise ValueError("Parent selection %s unknown" % str(config.parent_selection))
+
+
+def _fitness_proportionate(fitness, sizes, starts, owners):
+    """Roulette wheel selection: each parent is a species member with probability proportionate to its fitness, or
+    uniformly if the species' total fitness is 0. The wheel is the cumulative fitness table of all species, a parent
+    is a binary search for a random point on its species' part of the wheel."""
+    #TODO: assuming fitness function >=0
+    cumulative_fitness = np.cumsum(fitness)
+    # entry [i] is the total fitness of the species before species i
+    species_offsets = np.concatenate([[0.0], cumulative_fitness])[starts]
+    species_totals = np.concatenate([species_offsets[1:], cumulative_fitness[-1:]]) - species_offsets
+
+    points = np.random.random((len(owners), 2))
+    owner_totals = species_totals[owners, np.newaxis]
+    parents = np.searchsorted(cumulative_fitness, species_offsets[owners, np.newaxis] + points * owner_totals,
+                              side='right')
+    # rounding may land a point just past its species
+    parents = np.minimum(parents, (starts + sizes - 1)[owners, np.newaxis])
+    uniform = np.broadcast_to(owner_totals == 0, parents.shape)
+    parents[uniform] = _uniform_members(points, sizes, starts, owners)[uniform]
+    return parents
+
+
+def _tournament(fitness, sizes, starts, owners, tournament_size):
+    """Each parent is the fittest of tournament_size members of its species, drawn uniformly with replacement"""
+    if tournament_size < 1:
+        raise ValueError("tournament_size must be at least 1")
+    contestants = _uniform_members(np.random.random((len(owners), 2, tournament_size)), sizes, starts, owners)
+    winners = np.argmax(fitness[contestants], axis=2)
+    return np.take_along_axis(contestants, winners[..., np.newaxis], axis=2)[..., 0]
+
+
+def _truncation(fitness, sizes, starts, owners, truncation_fraction):
+    """Each parent is drawn uniformly from the fittest truncation_fraction of its species (at least one genome)"""
+    if not 0 < truncation_fraction <= 1:
+        raise ValueError("truncation_fraction must be in (0, 1]")
+    # the members of each species by descending fitness, species after species
+    ranked = np.concatenate([start + np.argsort(-fitness[start:start + size], kind='stable')
+                             for start, size in zip(starts.tolist(), sizes.tolist())])
+    kept_sizes = np.maximum(1, np.ceil(truncation_fraction * sizes).astype(np.int64))
+    return ranked[_uniform_members(np.random.random((len(owners), 2)), kept_sizes, starts, owners)]
+
+
+def _uniform_members(points, sizes, starts, owners):
+    """Maps points in [0, 1) to members of the owners' species, uniformly. points has the owners on its first axis."""
+    shape = (len(owners),) + (1,) * (points.ndim - 1)
+    owner_sizes = sizes[owners].reshape(shape)
+    # rounding may take a point just below 1 to the species' size
+    return starts[owners].reshape(shape) + np.minimum((points * owner_sizes).astype(np.int64), owner_sizes - 1)
@@ -0,0 +1,86 @@
+import contextlib
+
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+
+class SharedArrays:
+    """A set of named numpy arrays placed in shared memory, so worker processes can read them without having them
+    pickled into every task. The creating process owns the memory and must close() it (or use it as a context
+    manager) once the workers are done. Workers get the arrays with attach_shared_arrays(shared_arrays.descriptor)."""
+
+    def __init__(self, arrays):
+        self._blocks = []
+        # key: array name, value: (shared memory block name, shape, dtype string)
+        self._descriptor = {}
+        self._arrays = {}
+        for name, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            # shared memory blocks can't be empty
+            block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            self._blocks.append(block)
+            shared_array = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+            shared_array[...] = array
+            self._arrays[name] = shared_array
+            self._descriptor[name] = (block.name, array.shape, array.dtype.str)
+
+    @property
+    def descriptor(self):
+        """A small picklable description of the arrays, to pass to the workers"""
+        return self._descriptor
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in self._arrays.values())
+
+    def __getitem__(self, name):
+        return self._arrays[name]
+
+    def close(self):
+        self._arrays.clear()
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+        self._blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+@contextlib.contextmanager
+def attach_shared_arrays(descriptor):
+    """Yields a dict of the arrays described by a SharedArrays descriptor, for use in worker processes.
+    The arrays are only valid inside the with block."""
+    blocks = []
+    arrays = {}
+    try:
+        for name, (block_name, shape, dtype) in descriptor.items():
+            block = _attach_block(block_name)
+            blocks.append(block)
+            arrays[name] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+        yield arrays
+    finally:
+        # drop the arrays first, a block can't be closed while arrays still use its memory
+        arrays.clear()
+        for block in blocks:
+            block.close()
+
+
+def _attach_block(block_name):
+    """Attaches to an existing shared memory block without registering it with the resource tracker - the creating
+    process owns the block, and a worker must neither unlink it on exit nor unregister the owner's registration"""
+    try:
+        return shared_memory.SharedMemory(name=block_name, track=False)
+    except TypeError:
+        pass
+    # before python 3.13 attaching always registers the block, so skip the registration
+    register = resource_tracker.register
+    resource_tracker.register = lambda name, rtype: None
+    try:
+        return shared_memory.SharedMemory(name=block_name)
+    finally:
+        resource_tracker.register = register
@@ -0,0 +1,47 @@
+import contextlib
+
+import numpy as np
+
+from simplyneat.breeder.shared_arrays import SharedArrays, attach_shared_arrays
+from simplyneat.genome.encoding import encode_genomes
+from simplyneat.genome.genes.node_gene import NodeRegistry
+
+
+class GenerationSnapshot:
+    """A whole generation's genomes, encoded into columnar arrays (see encoding.py) and placed in shared memory along
+    with the node registry's lineages. Workers attach to the snapshot with
+    attach_generation_snapshot(snapshot.descriptor) and refer to genomes by their number in the generation, so no
+    genome is pickled into a task."""
+
+    def __init__(self, genomes, node_registry):
+        arrays = encode_genomes(genomes)
+        arrays['node_lineages'] = node_registry.lineages
+        arrays['first_hidden_index'] = np.array([node_registry.first_hidden_index], dtype=np.int64)
+        self._shared_arrays = SharedArrays(arrays)
+
+    @property
+    def descriptor(self):
+        return self._shared_arrays.descriptor
+
+    @property
+    def nbytes(self):
+        """Number of bytes written to shared memory"""
+        return self._shared_arrays.nbytes
+
+    def close(self):
+        self._shared_arrays.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+@contextlib.contextmanager
+def attach_generation_snapshot(descriptor):
+    """Yields the snapshot's encoded arrays and a copy of the node registry it was taken with, for use in worker
+    processes"""
+    with attach_shared_arrays(descriptor) as arrays:
+        node_registry = NodeRegistry(int(arrays['first_hidden_index'][0]), arrays['node_lineages'].tolist())
+        yield arrays, node_registry
@@ -0,0 +1,243 @@
+"""Checkpoints of a NEAT run, so that a crashed run can be resumed (see Neat.resume).
+A checkpoint directory holds:
+    manifest.json           format version and the generations checkpointed so far, rewritten last on every save so
+                            a crash mid-save leaves the previous checkpoints intact
+    innovations.bin         append-only int64 records (source index, destination index, innovation number), in the
+                            order the breeder assigned them
+    node_lineages.bin       append-only int64 records (source index, destination index, split number), the node
+                            registry's lineages in node index order
+    generation_<n>/         the generation's genomes, species, best genome and statistics as .npy files (see
+                            encoding.py), plus a small pickled state: the generation number, the breeder's innovation
+                            counter, the number of records of each append-only file at that generation and the RNG
+                            states
+Innovations and node lineages only grow, so each save appends just the records added since the previous save; the
+rest of a generation is a few flat arrays."""
+import json
+import logging
+import os
+import pickle
+import random
+import shutil
+import time
+
+import numpy as np
+
+from simplyneat.genome.encoding import decode_genome, encode_genomes, number_of_encoded_genomes
+from simplyneat.genome.genes.node_gene import NodeRegistry
+
+CHECKPOINT_FORMAT_VERSION = 1
+
+_MANIFEST = 'manifest.json'
+_INNOVATIONS = 'innovations.bin'
+_NODE_LINEAGES = 'node_lineages.bin'
+_STATE = 'state.pickle'
+_RECORD_WIDTH = 3
+
+
+class Checkpoint:
+    """The state of a NEAT run after some generation, as read by load_checkpoint"""
+
+    def __init__(self, generation, genomes, species, best_genome, statistics, innovations_dictionary,
+                 innovation_counter, node_registry, random_state, numpy_random_state):
+        self.generation = generation
+        self.genomes = genomes
+        self.species = species                          # list of (representative, list of member genomes) pairs
+        self.best_genome = best_genome
+        self.statistics = statistics                    # key: statistic name, value: list of values per generation
+        self.innovations_dictionary = innovations_dictionary
+        self.innovation_counter = innovation_counter
+        self.node_registry = node_registry
+        self.random_state = random_state
+        self.numpy_random_state = numpy_random_state
+
+    def restore_random_states(self):
+        random.setstate(self.random_state)
+        np.random.set_state(self.numpy_random_state)
+
+
+class Checkpointer:
+    """Writes checkpoints of a run to a directory, every checkpoint_interval generations, keeping the last
+    checkpoints_to_keep of them (0 keeps all).
+    A new run starts the directory over, a resumed run (resume_generation is not None) continues it from that
+    generation, dropping whatever was checkpointed after it."""
+
+    def __init__(self, path, checkpoints_to_keep=0, resume_generation=None, checkpoint_interval=1):
+        if checkpoints_to_keep < 0:
+            raise ValueError("checkpoints_to_keep can't be negative")
+        if checkpoint_interval < 1:
+            raise ValueError("checkpoint_interval must be at least 1")
+        self._path = path
+        self._checkpoints_to_keep = checkpoints_to_keep
+        self._checkpoint_interval = checkpoint_interval
+        os.makedirs(path, exist_ok=True)
+        if resume_generation is None:
+            if os.path.exists(os.path.join(path, _MANIFEST)):
+                for generation in _read_manifest(path)['generations']:
+                    shutil.rmtree(_generation_path(path, generation), ignore_errors=True)
+            self._generations = []
+            self._number_of_innovations = self._number_of_node_lineages = 0
+        else:
+            self._generations = [generation for generation in _read_manifest(path)['generations']
+                                 if generation <= resume_generation]
+            state = _read_state(path, resume_generation)
+            self._number_of_innovations = state['number_of_innovations']
+            self._number_of_node_lineages = state['number_of_node_lineages']
+        # drop records appended after the checkpoint we start from, or by a save which crashed
+        _truncate_records(os.path.join(path, _INNOVATIONS), self._number_of_innovations)
+        _truncate_records(os.path.join(path, _NODE_LINEAGES), self._number_of_node_lineages)
+
+    @property
+    def path(self):
+        return self._path
+
+    def is_due(self, generation):
+        """Returns whether generation is to be checkpointed"""
+        return generation % self._checkpoint_interval == 0
+
+    def save(self, generation, population, best_genome, statistics, innovations_dictionary, innovation_counter,
+             node_registry):
+        """Checkpoints the run after generation. statistics is a dict, key: statistic name, value: list of values."""
+        start_time = time.time()
+        # innovations are assigned in increasing order and never removed, so the dictionary's order is theirs
+        new_innovations = list(innovations_dictionary.items())[self._number_of_innovations:]
+        _append_records(os.path.join(self._path, _INNOVATIONS),
+                        [(source, destination, innovation) for (source, destination), innovation in new_innovations])
+        _append_records(os.path.join(self._path, _NODE_LINEAGES),
+                        node_registry.lineages[self._number_of_node_lineages:])
+        self._number_of_innovations = len(innovations_dictionary)
+        self._number_of_node_lineages = len(node_registry)
+
+        genomes = population.genomes
+        genome_numbers = {id(genome): genome_number for genome_number, genome in enumerate(genomes)}
+        species_of_genomes = np.full(len(genomes), -1, dtype=np.int64)
+        for species_number, species in enumerate(population.species):
+            species_of_genomes[[genome_numbers[id(genome)] for genome in species.genomes]] = species_number
+        assert np.all(species_of_genomes >= 0)
+        # representatives may be left from an earlier generation, so they're stored as genomes of their own
+        arrays = _prefix(encode_genomes(genomes), 'genomes_')
+        arrays.update(_prefix(encode_genomes([species.representative for species in population.species]),
+                              'representatives_'))
+        arrays.update(_prefix(encode_genomes([best_genome]), 'best_genome_'))
+        arrays['species_of_genomes'] = species_of_genomes
+        arrays.update(_prefix({name: np.array(values) for name, values in statistics.items()}, 'statistics_'))
+        state = {'generation': generation,
+                 'innovation_counter': innovation_counter,
+                 'number_of_innovations': self._number_of_innovations,
+                 'number_of_node_lineages': self._number_of_node_lineages,
+                 'first_hidden_index': node_registry.first_hidden_index,
+                 'statistics': list(statistics),
+                 'random_state': random.getstate(),
+                 'numpy_random_state': np.random.get_state()}
+
+        # written under a temporary name and renamed, a generation directory is either complete or missing
+        temporary_path = _generation_path(self._path, generation) + '.tmp'
+        shutil.rmtree(temporary_path, ignore_errors=True)
+        os.makedirs(temporary_path)
+        for name, array in arrays.items():
+            np.save(os.path.join(temporary_path, name + '.npy'), array)
+        with open(os.path.join(temporary_path, _STATE), 'wb') as state_file:
+            pickle.dump(state, state_file, protocol=pickle.HIGHEST_PROTOCOL)
+        shutil.rmtree(_generation_path(self._path, generation), ignore_errors=True)
+        os.replace(temporary_path, _generation_path(self._path, generation))
+
+        self._generations = [previous for previous in self._generations if previous != generation] + [generation]
+        removed_generations = []
+        if self._checkpoints_to_keep > 0:
+            removed_generations = self._generations[:-self._checkpoints_to_keep]
+            self._generations = self._generations[-self._checkpoints_to_keep:]
+        _write_manifest(self._path, self._generations)
+        for removed_generation in removed_generations:
+            shutil.rmtree(_generation_path(self._path, removed_generation), ignore_errors=True)
+        logging.debug("Checkpoint of generation %s took %s sec" % (generation, time.time() - start_time))
+
+
+def load_checkpoint(path, config, generation=None, mmap_mode=None):
+    """Returns the Checkpoint of the given generation (the latest if None) from the checkpoint directory at path.
+    mmap_mode is passed to np.load, 'r' memory-maps the arrays instead of reading them."""
+    start_time = time.time()
+    generations = _read_manifest(path)['generations']
+    if not generations:
+        raise ValueError("No checkpoints in %s" % path)
+    if generation is None:
+        generation = generations[-1]
+    elif generation not in generations:
+        raise ValueError("Generation %s isn't checkpointed in %s, checkpointed generations: %s" %
+                         (generation, path, generations))
+    state = _read_state(path, generation)
+    generation_path = _generation_path(path, generation)
+    arrays = {file_name[:-len('.npy')]: np.load(os.path.join(generation_path, file_name), mmap_mode=mmap_mode)
+              for file_name in os.listdir(generation_path) if file_name.endswith('.npy')}
+
+    innovations = _read_records(os.path.join(path, _INNOVATIONS), state['number_of_innovations'], mmap_mode)
+    innovations_dictionary = {(source, destination): innovation
+                              for source, destination, innovation in innovations.tolist()}
+    node_registry = NodeRegistry(state['first_hidden_index'],
+                                 _read_records(os.path.join(path, _NODE_LINEAGES), state['number_of_node_lineages'],
+                                               mmap_mode).tolist())
+
+    genome_arrays = _unprefix(arrays, 'genomes_')
+    genomes = [decode_genome(genome_arrays, genome_number, config)
+               for genome_number in range(number_of_encoded_genomes(genome_arrays))]
+    representative_arrays = _unprefix(arrays, 'representatives_')
+    species = [(decode_genome(representative_arrays, species_number, config), [])
+               for species_number in range(number_of_encoded_genomes(representative_arrays))]
+    for genome, species_number in zip(genomes, arrays['species_of_genomes'].tolist()):
+        species[species_number][1].append(genome)
+    best_genome = decode_genome(_unprefix(arrays, 'best_genome_'), 0, config)
+    statistics = {name: arrays['statistics_' + name].tolist() for name in state['statistics']}
+    logging.debug("Loading the checkpoint of generation %s took %s sec" % (generation, time.time() - start_time))
+    return Checkpoint(generation, genomes, species, best_genome, statistics, innovations_dictionary,
+                      state['innovation_counter'], node_registry, state['random_state'], state['numpy_random_state'])
+
+
+def _generation_path(path, generation):
+    return os.path.join(path, 'generation_%06d' % generation)
+
+
+def _prefix(arrays, prefix):
+    return {prefix + name: array for name, array in arrays.items()}
+
+
+def _unprefix(arrays, prefix):
+    return {name[len(prefix):]: array for name, array in arrays.items() if name.startswith(prefix)}
+
+
+def _read_manifest(path):
+    with open(os.path.join(path, _MANIFEST)) as manifest_file:
+        manifest = json.load(manifest_file)
+    if manifest['format_version'] != CHECKPOINT_FORMAT_VERSION:
+        raise ValueError("Checkpoint format version %s isn't supported, expected version %s" %
+                         (manifest['format_version'], CHECKPOINT_FORMAT_VERSION))
+    return manifest
+
+
+def _write_manifest(path, generations):
+    temporary_path = os.path.join(path, _MANIFEST + '.tmp')
+    with open(temporary_path, 'w') as manifest_file:
+        json.dump({'format_version': CHECKPOINT_FORMAT_VERSION, 'generations': generations}, manifest_file)
+    os.replace(temporary_path, os.path.join(path, _MANIFEST))
+
+
+def _read_state(path, generation):
+    with open(os.path.join(_generation_path(path, generation), _STATE), 'rb') as state_file:
+        return pickle.load(state_file)
+
+
+def _append_records(file_path, records):
+    records = np.asarray(records, dtype=np.int64).reshape(-1, _RECORD_WIDTH)
+    if len(records):
+        with open(file_path, 'ab') as records_file:
+            records_file.write(records.tobytes())
+
+
+def _read_records(file_path, number_of_records, mmap_mode=None):
+    if number_of_records == 0:
+        return np.empty((0, _RECORD_WIDTH), dtype=np.int64)
+    if mmap_mode is not None:
+        return np.memmap(file_path, dtype=np.int64, mode=mmap_mode, shape=(number_of_records, _RECORD_WIDTH))
+    return np.fromfile(file_path, dtype=np.int64, count=number_of_records * _RECORD_WIDTH).reshape(-1, _RECORD_WIDTH)
+
+
+def _truncate_records(file_path, number_of_records):
+    with open(file_path, 'ab') as records_file:
+        records_file.truncate(number_of_records * _RECORD_WIDTH * np.dtype(np.int64).itemsize)
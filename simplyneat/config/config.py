@@ -22,6 +22,34 @@ class LoggingLevel(Enum):
             return NotImplemented
 
 
+class AgentBackend(Enum):
+    NUMPY = 'NUMPY'             # the genome's compiled network, evaluated with numpy
+    TENSORFLOW = 'TENSORFLOW'   # a tensorflow graph of the compiled network. tensorflow is only imported if selected
+
+
+class EvaluationBackend(Enum):
+    SERIAL = 'SERIAL'           # evaluate genomes one after the other in the current process
+    PROCESS = 'PROCESS'         # multiprocessing pool of processes_in_pool processes
+    THREAD = 'THREAD'           # thread pool, useful when the fitness function releases the GIL
+    ASYNCIO = 'ASYNCIO'         # asyncio event loop, the fitness function may be a coroutine function
+
+
+class ParentSelection(Enum):
+    FITNESS_PROPORTIONATE = 'FITNESS_PROPORTIONATE'     # a species member is a parent with probability proportionate to its fitness
+    TOURNAMENT = 'TOURNAMENT'                           # the fittest of tournament_size random species members
+    TRUNCATION = 'TRUNCATION'                           # a random member of the fittest truncation_fraction of the species
+
+
+class StatisticsFormat(Enum):
+    JSONL = 'JSONL'             # a JSON object per generation per line
+    CSV = 'CSV'                 # a row per generation, nested statistics are flattened to dotted column names
+
+
+class FitnessSharing(Enum):
+    SPECIES = 'SPECIES'         # a genome shares its fitness with the members of its species, as in the NEAT paper
+    EXACT = 'EXACT'             # a genome shares its fitness with every genome within compatibility threshold of it
+
+
 #TODO: don't allow lambdas
 class Config:
     # Dictionary of the config attributes and their default values
@@ -41,8 +69,14 @@ class Config:
         'excess_coefficient': 2.0,            # TODO: find values and give meaningful documentation
         'disjoint_coefficient': 2.0,
         'weight_difference_coefficient': 1.0,
+        'fitness_sharing': FitnessSharing.SPECIES,
+        'parallel_speciation': False,                                   # speciate chunks of the genomes in the pool, see speciation.py
+        'parent_selection': ParentSelection.FITNESS_PROPORTIONATE,
+        'tournament_size': 3,                                           # used by ParentSelection.TOURNAMENT
+        'truncation_fraction': 0.5,                                     # used by ParentSelection.TRUNCATION
         'change_weight_mutation_distribution': np.random.normal,               # weight to add in change_weight mutation               # TODO: check against paper
         'connection_weight_mutation_distribution': np.random.normal,    # weight to give in add_connection mutation
+        'allow_recurrent_connections': True,                            # if False, add_connection only adds connections which keep the network acyclic
         'add_connection_probability': 0.2,                              # probability of add_connection mutation occurring      # TODO: think of default value
         'add_node_probability': 0.2,                                    # probability of add_node mutation occurring            # TODO: think of default value
         'change_weight_probability': 0.2,                               # probability of change_weight mutation occurring       # TODO: think of default value
@@ -52,6 +86,25 @@ class Config:
         #TODO: not actually implemented (the inherit attrib) - implement
         'inherit_disabled_connection_probability': 0.2,
         'processes_in_pool': multiprocessing.cpu_count(),
+        'pipelined_breeding': True,                                     # with a pool, evaluate and speciate offsprings as they're bred, see Breeder
+        'steady_state_minimum_age': None,                               # evaluations a genome survives before SteadyStateNeat may replace it, None is population_size // 4
+        'agent_backend': AgentBackend.NUMPY,                            # how the agents given to the fitness function run their network
+        'evaluation_backend': EvaluationBackend.PROCESS,                 # PROCESS falls back to SERIAL if processes_in_pool <= 1
+        'evaluation_chunk_size': 1,                                     # number of genomes sent together to a worker
+        'evaluation_timeout': None,                                     # seconds, None means no timeout
+        'timeout_fitness': 0.0,                                         # fitness given to a genome whose evaluation timed out
+        # LRU cache of fitness values keyed by genome structure, only valid for deterministic fitness functions.
+        # 0 disables the cache. If a path is given the cache is loaded from it and saved to it at the end of each run
+        'fitness_cache_size': 0,
+        'fitness_cache_path': None,
+        # None disables checkpointing. Otherwise a checkpoint is written to the directory every checkpoint_interval
+        # generations, see checkpoint.py and Neat.resume. 0 checkpoints_to_keep keeps all of them
+        'checkpoint_path': None,
+        'checkpoint_interval': 1,
+        'checkpoints_to_keep': 3,
+        # if a path is given, every generation's statistics, timings and counters are streamed to it (see instrumentation.py)
+        'statistics_path': None,
+        'statistics_format': StatisticsFormat.JSONL,
         'logging_level': LoggingLevel.INFO,
 
     }
@@ -0,0 +1,404 @@
+import asyncio
+import concurrent.futures
+import functools
+import logging
+import signal
+import threading
+import time
+
+from simplyneat.agent.agent import Agent
+from simplyneat.config.config import EvaluationBackend
+from simplyneat.evaluator.fitness_cache import FitnessCache, genome_key
+from simplyneat.genome.encoding import decode_genome, encode_genomes, number_of_encoded_genomes
+from simplyneat.workers.workers import WorkerPool, setup_worker_fitness_function, setup_fitness_function, \
+    teardown_fitness_function, worker_config
+
+
+def create_evaluator(config, pool=None, node_registry=None):
+    """Returns the evaluator chosen by config.evaluation_backend.
+    pool is an optional WorkerPool for the PROCESS backend to use instead of creating one of its own. node_registry is
+    the NodeRegistry the evaluated genomes' hidden nodes are interned by, needed by the fitness cache."""
+    backend = config.evaluation_backend
+    if backend == EvaluationBackend.PROCESS:
+        if pool is None and config.processes_in_pool <= 1:
+            return SerialEvaluator(config, node_registry=node_registry)
+        return ProcessPoolEvaluator(config, pool=pool, node_registry=node_registry)
+    if backend == EvaluationBackend.SERIAL:
+        return SerialEvaluator(config, node_registry=node_registry)
+    if backend == EvaluationBackend.THREAD:
+        return ThreadPoolEvaluator(config, node_registry=node_registry)
+    if backend == EvaluationBackend.ASYNCIO:
+        return AsyncioEvaluator(config, node_registry=node_registry)
+    raise ValueError("Evaluation backend %s unknown" % str(backend))
+
+
+def evaluate_genome(genome, config):
+    """Returns the fitness of a single genome"""
+    return config.fitness_function(Agent(config, genome))
+
+
+class Evaluator:
+    """Computes the fitness of a whole list of genomes at once, e.g. all of the offspring of a generation.
+    The genomes are split to chunks of config.evaluation_chunk_size genomes, each chunk is a single task for the
+    backend. A genome whose evaluation takes longer than config.evaluation_timeout seconds gets
+    config.timeout_fitness as its fitness.
+    Evaluators which evaluate in the calling process set up the fitness function there when created and tear it
+    down when closed (see workers.py)."""
+    _evaluates_in_process = True
+
+    def __init__(self, config, node_registry=None):
+        self._config = config
+        self._node_registry = node_registry
+        self._chunk_size = config.evaluation_chunk_size
+        self._timeout = config.evaluation_timeout
+        self._timeout_fitness = config.timeout_fitness
+        if self._chunk_size < 1:
+            raise ValueError("Evaluation chunk size must be at least 1")
+        if self._timeout is not None and self._timeout <= 0:
+            raise ValueError("Evaluation timeout must be positive")
+
+        if config.fitness_cache_size > 0:
+            if node_registry is None:
+                raise ValueError("The fitness cache needs the genomes' node registry")
+            self._fitness_cache = FitnessCache(config.fitness_cache_size, path=config.fitness_cache_path)
+        else:
+            self._fitness_cache = None
+        if self._evaluates_in_process:
+            setup_fitness_function(config.fitness_function)
+
+    @property
+    def fitness_cache(self):
+        """Returns the evaluator's FitnessCache, or None if caching is disabled"""
+        return self._fitness_cache
+
+    @property
+    def node_registry(self):
+        """Returns the NodeRegistry the evaluated genomes are interned by. Set it if they're interned by another one
+        from now on, e.g. when a run is resumed"""
+        return self._node_registry
+
+    @node_registry.setter
+    def node_registry(self, node_registry):
+        self._node_registry = node_registry
+
+    def evaluate(self, genomes):
+        """Sets the fitness of every genome in genomes"""
+        self.submit(genomes).wait()
+
+    def submit(self, genomes, callback=None):
+        """Starts evaluating genomes, returns an Evaluation whose wait() sets their fitness once they're evaluated.
+        Backends which evaluate in other processes evaluate while the caller goes on, the others evaluate right away.
+        If given, callback() is called once the evaluation is done and wait() won't block, possibly from another
+        thread or before submit returns."""
+        if callback is None:
+            callback = _do_nothing
+        genomes = list(genomes)
+        if self._fitness_cache is None:
+            genomes_to_evaluate, genomes_by_key = genomes, None
+        else:
+            genomes_to_evaluate, genomes_by_key = self._evaluate_from_cache(genomes)
+        chunks = [genomes_to_evaluate[i:i + self._chunk_size]
+                  for i in range(0, len(genomes_to_evaluate), self._chunk_size)]
+        if chunks:
+            get_fitnesses = self._submit_chunks(chunks, callback)
+        else:
+            get_fitnesses = list
+            callback()
+        return Evaluation(functools.partial(self._set_fitnesses, genomes, genomes_to_evaluate, genomes_by_key,
+                                            get_fitnesses, time.time()))
+
+    def _set_fitnesses(self, genomes, genomes_to_evaluate, genomes_by_key, get_fitnesses, evaluation_start_time):
+        fitnesses = get_fitnesses()
+        assert len(fitnesses) == len(genomes_to_evaluate)
+
+        number_of_timeouts = 0
+        for genome, fitness in zip(genomes_to_evaluate, fitnesses):
+            if fitness is None:
+                number_of_timeouts += 1
+                genome.fitness = self._timeout_fitness
+            else:
+                genome.fitness = fitness
+        if number_of_timeouts:
+            logging.warning("Evaluation of %s genomes timed out" % number_of_timeouts)
+
+        if genomes_by_key is not None:
+            # genomes_to_evaluate holds the first genome of each key, in the same order as genomes_by_key
+            for (key, (genome, *duplicates)), fitness in zip(genomes_by_key.items(), fitnesses):
+                for duplicate in duplicates:
+                    duplicate.fitness = genome.fitness
+                # a timed out evaluation isn't the genome's real fitness, so it isn't cached
+                if fitness is not None:
+                    self._fitness_cache.store(key, fitness)
+
+        logging.debug("Evaluation of %s genomes (%s evaluated, the rest from cache) took %s sec" %
+                      (len(genomes), len(genomes_to_evaluate), time.time() - evaluation_start_time))
+
+    def save_fitness_cache(self):
+        """Writes the fitness cache to config.fitness_cache_path, if caching is enabled and a path was set"""
+        if self._fitness_cache is not None and self._config.fitness_cache_path is not None:
+            self._fitness_cache.save()
+
+    def close(self):
+        """Releases the evaluator's workers"""
+        self.save_fitness_cache()
+        if self._evaluates_in_process:
+            teardown_fitness_function(self._config.fitness_function)
+
+    def _evaluate_from_cache(self, genomes):
+        """Sets the fitness of the genomes found in the cache. Returns a list of the genomes which still need to be
+        evaluated (only one genome of each structure) and a dict, key: genome key, value: list of all genomes with
+        that key among those which need to be evaluated (the first of which is the one evaluated)"""
+        genomes_by_key = {}
+        for genome in genomes:
+            key = genome_key(genome, self._node_registry)
+            if key in genomes_by_key:
+                genomes_by_key[key].append(genome)
+                continue
+            fitness = self._fitness_cache.lookup(key)
+            if fitness is None:
+                genomes_by_key[key] = [genome]
+            else:
+                genome.fitness = fitness
+        return [key_genomes[0] for key_genomes in genomes_by_key.values()], genomes_by_key
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _evaluate_chunks(self, chunks):
+        """Returns the fitness of every genome in chunks as a flat list, None for a genome whose evaluation timed out"""
+        raise NotImplementedError
+
+    def _submit_chunks(self, chunks, callback):
+        """Starts evaluating chunks and calls callback() once they're evaluated. Returns a function returning what
+        _evaluate_chunks(chunks) does. By default the chunks are evaluated right away."""
+        fitnesses = self._evaluate_chunks(chunks)
+        callback()
+        return lambda: fitnesses
+
+
+class Evaluation:
+    """Genomes being evaluated, see Evaluator.submit"""
+
+    def __init__(self, set_fitnesses):
+        self._set_fitnesses = set_fitnesses
+        self._done = False
+
+    def wait(self):
+        """Waits for the evaluation to finish and sets the genomes' fitness. Waiting again does nothing."""
+        if not self._done:
+            self._done = True
+            self._set_fitnesses()
+
+
+class SerialEvaluator(Evaluator):
+    """Evaluates the genomes one after the other in the current process. Timeouts are enforced with SIGALRM, so they
+    only apply when evaluating from the main thread of a platform which supports it."""
+
+    def _evaluate_chunks(self, chunks):
+        fitnesses = []
+        for chunk in chunks:
+            fitnesses += _evaluate_chunk(chunk, self._config, self._timeout)
+        return fitnesses
+
+
+class ProcessPoolEvaluator(Evaluator):
+    """Evaluates chunks in a WorkerPool, whose workers have the config and set up the fitness function once. Timeouts
+    are enforced with SIGALRM inside the worker processes."""
+    _evaluates_in_process = False
+
+    def __init__(self, config, pool=None, node_registry=None):
+        super().__init__(config, node_registry=node_registry)
+        # a pool given by the caller is owned by the caller, we don't close it
+        self._owns_pool = pool is None
+        self._pool = WorkerPool(config) if pool is None else pool
+
+    def close(self):
+        super().close()
+        if self._owns_pool:
+            self._pool.close()
+
+    def _evaluate_chunks(self, chunks):
+        return self._submit_chunks(chunks, _do_nothing)()
+
+    def _submit_chunks(self, chunks, callback):
+        # the workers get the chunks' columnar encoding and rebuild the genomes with their own config, so neither
+        # genome objects nor the config (with the fitness function) are pickled into the tasks
+        get_chunks_fitnesses = self._pool.map_async(functools.partial(_evaluate_chunk_in_worker, timeout=self._timeout),
+                                                    [encode_genomes(chunk) for chunk in chunks], chunksize=1,
+                                                    callback=callback)
+        return lambda: [fitness for chunk_fitnesses in get_chunks_fitnesses() for fitness in chunk_fitnesses]
+
+
+class ThreadPoolEvaluator(Evaluator):
+    """Evaluates chunks in a pool of processes_in_pool threads, for fitness functions which release the GIL (e.g.
+    environments implemented in C). Threads can't be interrupted: a genome which exceeds the timeout is abandoned, its
+    result is discarded once it finishes, and the rest of its chunk is handed to another thread. An evaluation which
+    never returns therefore keeps its thread busy for good."""
+
+    def __init__(self, config, node_registry=None):
+        super().__init__(config, node_registry=node_registry)
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=config.processes_in_pool)
+
+    def close(self):
+        """Cancels the chunks which didn't start and waits for the running evaluations to finish (including abandoned
+        ones, so it never returns if one of them never does) before tearing the fitness function down"""
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        super().close()
+
+    def _evaluate_chunks(self, chunks):
+        if self._timeout is None:
+            futures = [self._executor.submit(_evaluate_chunk, chunk, self._config, None) for chunk in chunks]
+            return [fitness for future in futures for fitness in future.result()]
+        return self._evaluate_chunks_with_timeout(chunks)
+
+    def _evaluate_chunks_with_timeout(self, chunks):
+        genomes = [genome for chunk in chunks for genome in chunk]
+        fitnesses = [None] * len(genomes)
+        lock = threading.Lock()
+        start_times = {}        # key: genome number, value: time its evaluation started
+        finished = set()        # numbers of the genomes which were evaluated or timed out
+        tasks = {}              # key: future, value: the task it runs
+
+        def run_task(task):
+            for genome_number in task.genome_numbers:
+                with lock:
+                    if task.abandoned:
+                        return
+                    start_times[genome_number] = time.time()
+                fitness = evaluate_genome(genomes[genome_number], self._config)
+                with lock:
+                    if genome_number not in finished:
+                        fitnesses[genome_number] = fitness
+                        finished.add(genome_number)
+
+        def submit(genome_numbers):
+            task = _ThreadTask(genome_numbers)
+            tasks[self._executor.submit(run_task, task)] = task
+
+        genome_number = 0
+        for chunk in chunks:
+            submit(list(range(genome_number, genome_number + len(chunk))))
+            genome_number += len(chunk)
+
+        while True:
+            with lock:
+                now = time.time()
+                for genome_number, start_time in start_times.items():
+                    if genome_number not in finished and now - start_time >= self._timeout:
+                        finished.add(genome_number)     # fitness stays None
+                        task = next(task for task in tasks.values()
+                                    if not task.abandoned and genome_number in task.genome_numbers)
+                        task.abandoned = True
+                        not_started = [number for number in task.genome_numbers if number not in start_times]
+                        if not_started:
+                            submit(not_started)
+                if len(finished) == len(genomes):
+                    break
+                running = [now - start_time for number, start_time in start_times.items() if number not in finished]
+            # wake up when a task is done or when the longest running evaluation reaches the timeout
+            wait_time = self._timeout - max(running) if running else self._timeout
+            done, _ = concurrent.futures.wait([future for future, task in tasks.items() if not task.abandoned],
+                                              timeout=max(wait_time, 0), return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                future.result()     # raises the fitness function's exception, if any
+                del tasks[future]
+        return fitnesses
+
+
+class _ThreadTask:
+
+    def __init__(self, genome_numbers):
+        self.genome_numbers = genome_numbers
+        self.abandoned = False
+
+
+class AsyncioEvaluator(Evaluator):
+    """Evaluates the genomes on an asyncio event loop, running at most processes_in_pool chunks concurrently.
+    A coroutine fitness function is awaited directly and is cancelled when it times out. A regular fitness function
+    runs in a thread pool, and like in ThreadPoolEvaluator an evaluation which timed out is abandoned."""
+
+    def __init__(self, config, node_registry=None):
+        super().__init__(config, node_registry=node_registry)
+        self._max_concurrency = max(config.processes_in_pool, 1)
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self._max_concurrency)
+
+    def close(self):
+        """Same as ThreadPoolEvaluator.close"""
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        super().close()
+
+    def _evaluate_chunks(self, chunks):
+        return asyncio.run(self._evaluate_chunks_async(chunks))
+
+    async def _evaluate_chunks_async(self, chunks):
+        semaphore = asyncio.Semaphore(self._max_concurrency)
+        chunks_fitnesses = await asyncio.gather(*[self._evaluate_chunk_async(chunk, semaphore) for chunk in chunks])
+        return [fitness for chunk_fitnesses in chunks_fitnesses for fitness in chunk_fitnesses]
+
+    async def _evaluate_chunk_async(self, chunk, semaphore):
+        async with semaphore:
+            return [await self._evaluate_genome_async(genome) for genome in chunk]
+
+    async def _evaluate_genome_async(self, genome):
+        if asyncio.iscoroutinefunction(self._config.fitness_function):
+            evaluation = self._config.fitness_function(Agent(self._config, genome))
+        else:
+            loop = asyncio.get_running_loop()
+            started = asyncio.Event()
+
+            def evaluate():
+                loop.call_soon_threadsafe(started.set)
+                return evaluate_genome(genome, self._config)
+
+            evaluation = loop.run_in_executor(self._executor, evaluate)
+            # the timeout counts from the moment a thread picks the genome up, not while it waits for a free thread
+            await started.wait()
+        try:
+            return await asyncio.wait_for(evaluation, self._timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class _EvaluationTimeout(Exception):
+    pass
+
+
+def _do_nothing():
+    pass
+
+
+def _evaluate_chunk(chunk, config, timeout):
+    """Returns a list of the fitness of each genome in chunk, None for a genome whose evaluation timed out"""
+    return [_evaluate_genome_with_alarm(genome, config, timeout) for genome in chunk]
+
+
+def _evaluate_chunk_in_worker(encoded_chunk, timeout):
+    """Same as _evaluate_chunk for a chunk encoded by encode_genomes, with the config and the fitness function of the
+    worker process"""
+    setup_worker_fitness_function()
+    config = worker_config()
+    return _evaluate_chunk([decode_genome(encoded_chunk, genome_number, config)
+                            for genome_number in range(number_of_encoded_genomes(encoded_chunk))], config, timeout)
+
+
+def _evaluate_genome_with_alarm(genome, config, timeout):
+    """Evaluates genome, interrupting the evaluation with SIGALRM after timeout seconds. Returns None on timeout.
+    Signals are only delivered to the main thread, elsewhere the timeout is ignored."""
+    if timeout is None or not hasattr(signal, 'setitimer') or threading.current_thread() is not threading.main_thread():
+        return evaluate_genome(genome, config)
+
+    def raise_timeout(signum, frame):
+        raise _EvaluationTimeout()
+
+    previous_handler = signal.signal(signal.SIGALRM, raise_timeout)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        return evaluate_genome(genome, config)
+    except _EvaluationTimeout:
+        return None
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous_handler)
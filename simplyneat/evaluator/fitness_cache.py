@@ -0,0 +1,84 @@
+import hashlib
+import logging
+import os
+import pickle
+
+from collections import OrderedDict
+
+import numpy as np
+
+
+class FitnessCache:
+    """A size bounded cache of fitness values, keyed by the structure of the evaluated genome (see genome_key).
+    When full, the least recently used entry is evicted. Only valid for deterministic fitness functions.
+    If a path is given, the cache is loaded from it (if it exists) and save() writes it back there."""
+
+    def __init__(self, max_size, path=None):
+        if max_size <= 0:
+            raise ValueError("Fitness cache size must be positive")
+        self._max_size = max_size
+        self._path = path
+        self._entries = OrderedDict()   # key: genome key, value: fitness. Ordered from least to most recently used
+        self._hits = 0
+        self._misses = 0
+        if path is not None and os.path.exists(path):
+            self.load(path)
+
+    @property
+    def hits(self):
+        return self._hits
+
+    @property
+    def misses(self):
+        return self._misses
+
+    def __len__(self):
+        return len(self._entries)
+
+    def lookup(self, key):
+        """Returns the cached fitness of key, or None on a miss"""
+        fitness = self._entries.get(key)
+        if fitness is None:
+            self._misses += 1
+            return None
+        self._hits += 1
+        self._entries.move_to_end(key)
+        return fitness
+
+    def store(self, key, fitness):
+        self._entries[key] = fitness
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+
+    def save(self, path=None):
+        """Writes the cache's entries to path, defaulting to the path the cache was created with"""
+        path = self._path if path is None else path
+        if path is None:
+            raise ValueError("No path to save the fitness cache to")
+        # write to a temporary file first so a crash while saving doesn't corrupt an existing cache
+        temporary_path = path + '.tmp'
+        with open(temporary_path, 'wb') as f:
+            pickle.dump(list(self._entries.items()), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary_path, path)
+
+    def load(self, path):
+        with open(path, 'rb') as f:
+            for key, fitness in pickle.load(f):
+                self.store(key, fitness)
+        logging.info("Loaded %s fitness cache entries from %s" % (len(self._entries), path))
+
+
+def genome_key(genome, node_registry):
+    """Returns a canonical hash of the genome's phenotype: the nodes and weight of each of its enabled connection
+    genes. Disabled connections don't affect the network, so genomes which differ only by them share a key.
+    node_registry is the registry the genome's hidden nodes were interned by."""
+    # hidden node indices depend on the order nodes were created in a run, so nodes are keyed by their lineage ids
+    # which are the same across runs. Weights are keyed by their bits, so an int weight of 1 and a float weight of 1.0
+    # match. The genes are sorted since the genome's order of connection genes doesn't affect the network.
+    connections = list(genome.enabled_connection_genes.values())
+    genes = np.empty((len(connections), 3), dtype=np.int64)
+    genes[:, :2] = node_registry.lineage_ids([connection.index for connection in connections]).reshape(-1, 2)
+    genes[:, 2] = np.array([connection.weight for connection in connections], dtype=np.float64).view(np.int64)
+    genes = genes[np.lexsort(genes.T[::-1])]
+    return hashlib.sha1(genes.tobytes()).hexdigest()
@@ -0,0 +1,45 @@
+"""Compact columnar encoding of a list of genomes, to move genomes between processes without pickling them. Only the
+connection genes are stored, those of genome i are rows offsets[i]:offsets[i + 1] of the columns."""
+import numpy as np
+
+from simplyneat.genome.genome import Genome
+
+
+def encode_genomes(genomes):
+    """Returns a dict of arrays encoding genomes"""
+    connections = [connection for genome in genomes for connection in genome.connection_genes.values()]
+    return {
+        'offsets': np.cumsum([0] + [len(genome.connection_genes) for genome in genomes], dtype=np.int64),
+        'sources': np.array([connection.source_node.index for connection in connections], dtype=np.int64),
+        'destinations': np.array([connection.destination_node.index for connection in connections], dtype=np.int64),
+        'weights': np.array([connection.weight for connection in connections], dtype=np.float64),
+        'enabled': np.array([connection.is_enabled() for connection in connections], dtype=bool),
+        # -1 stands for an innovation number which wasn't assigned yet
+        'innovations': np.array([-1 if connection.innovation is None else connection.innovation
+                                 for connection in connections], dtype=np.int64),
+        'split_numbers': np.array([connection.split_number for connection in connections], dtype=np.int64),
+        # NaN stands for a genome which wasn't evaluated yet
+        'fitness': np.array([np.nan if genome.fitness is None else genome.fitness for genome in genomes],
+                            dtype=np.float64),
+    }
+
+
+def decode_genome(arrays, genome_number, config):
+    """Returns genome number genome_number of the encoded arrays as a new Genome"""
+    start, end = arrays['offsets'][genome_number], arrays['offsets'][genome_number + 1]
+    genome = Genome.from_gene_arrays(config,
+                                     sources=arrays['sources'][start:end].tolist(),
+                                     destinations=arrays['destinations'][start:end].tolist(),
+                                     weights=arrays['weights'][start:end].tolist(),
+                                     enabled=arrays['enabled'][start:end].tolist(),
+                                     innovations=[None if innovation < 0 else innovation
+                                                  for innovation in arrays['innovations'][start:end].tolist()],
+                                     split_numbers=arrays['split_numbers'][start:end].tolist())
+    fitness = arrays['fitness'][genome_number]
+    if not np.isnan(fitness):
+        genome.fitness = float(fitness)
+    return genome
+
+
+def number_of_encoded_genomes(arrays):
+    return len(arrays['offsets']) - 1
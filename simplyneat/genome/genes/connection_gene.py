@@ -1,9 +1,14 @@
 import numbers
 
+from simplyneat.genome.genes.node_gene import decode_node
+
 
 class ConnectionGene:
+    __slots__ = ('_source_node', '_dest_node', '_weight', '_split_number', '_enabled', '_innovation', '_index',
+                 '_enabled_connections')
 
-    def __init__(self, source_node, destination_node, weight, split_number, innovation, enabled_flag=True):
+    def __init__(self, source_node, destination_node, weight, split_number, innovation, enabled_flag=True,
+                 enabled_connections=None):
         if not isinstance(weight, numbers.Number):
             raise ValueError("Given weight is not a number")
         if not isinstance(split_number, int):
@@ -15,6 +20,11 @@ class ConnectionGene:
         self._enabled = enabled_flag
         self._innovation = innovation
         self._index = (self._source_node.index, self._dest_node.index)
+        # a dict (its genome's index of enabled connections) the connection keeps itself in, keyed by its index, while
+        # it's enabled. May be None
+        self._enabled_connections = enabled_connections
+        if enabled_connections is not None and enabled_flag is True:
+            enabled_connections[self._index] = self
 
     @property
     def index(self):
@@ -66,11 +76,20 @@ class ConnectionGene:
         Returns true if the flag was actually changed (i.e. wasn't already == new_flag). Else, returns false."""
         prev_flag = self._enabled
         self._enabled = new_flag
+        if prev_flag != new_flag:
+            # keep the enabled connections indexes of the nodes and of the genome up to date
+            self._source_node.update_enabled_connection(self)
+            self._dest_node.update_enabled_connection(self)
+            if self._enabled_connections is not None:
+                if self.is_enabled():
+                    self._enabled_connections[self._index] = self
+                else:
+                    self._enabled_connections.pop(self._index, None)
         return prev_flag != new_flag
 
     def __str__(self):
-        return "Connection Gene: %s,%s,%s,%s,%s" \
-               % (self._index, self._weight, self._split_number, self._enabled, str(self._innovation))
+        return "Connection Gene: %s %s,%s,%s,%s,%s" \
+               % (self._index, (decode_node(self._index[0]), decode_node(self._index[1])), self._weight, self._split_number, self._enabled, str(self._innovation))
 
     def __key(self):
         return self._source_node, self._dest_node, self._weight, self._split_number, self._enabled, self._innovation
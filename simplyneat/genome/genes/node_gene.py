@@ -1,6 +1,12 @@
+import hashlib
+
 from enum import Enum
 
+import numpy as np
+
 class NodeGene:
+    __slots__ = ('_type', '_index', '_incoming_connections', '_outgoing_connections', '_enabled_incoming_connections',
+                 '_enabled_outgoing_connections')
 
     def __init__(self, node_type, node_index):
         if node_type not in NodeType:
@@ -9,8 +15,12 @@ class NodeGene:
         self._type = node_type
         # a number of internal book-keeping, as in the NEAT paper's illustrations
         self._index = node_index
-        self._incoming_connections = []
-        self._outgoing_connections = []
+        # the connections are keyed by connection index. The enabled ones are also kept apart: built on first access
+        # and from then on updated whenever a connection is added, deleted or toggled (see update_enabled_connection)
+        self._incoming_connections = {}
+        self._outgoing_connections = {}
+        self._enabled_incoming_connections = None
+        self._enabled_outgoing_connections = None
 
     @property
     def node_type(self):
@@ -22,39 +32,62 @@ class NodeGene:
 
     @property
     def incoming_connections(self):
-        return self._incoming_connections
+        return self._incoming_connections.values()
 
     @property
     def enabled_incoming_connections(self):
-        return list(filter(lambda connection: connection.is_enabled(), self._incoming_connections))
+        if self._enabled_incoming_connections is None:
+            self._enabled_incoming_connections = _enabled_connections(self._incoming_connections)
+        return self._enabled_incoming_connections.values()
 
     @property
     def outgoing_connections(self):
-        return self._outgoing_connections
+        return self._outgoing_connections.values()
 
     @property
     def enabled_outgoing_connections(self):
-        return list(filter(lambda connection: connection.is_enabled(), self._outgoing_connections))
+        if self._enabled_outgoing_connections is None:
+            self._enabled_outgoing_connections = _enabled_connections(self._outgoing_connections)
+        return self._enabled_outgoing_connections.values()
 
     def add_incoming_connection(self, incoming_connection):
-        self._incoming_connections.append(incoming_connection)
+        index = incoming_connection.index
+        self._incoming_connections[index] = incoming_connection
+        if self._enabled_incoming_connections is not None and incoming_connection.is_enabled():
+            self._enabled_incoming_connections[index] = incoming_connection
 
     # we have 2 different delete function instead of a unified function as we may have a node may have both connection
     # a->b and b->a and thus there might be an ambiguity in regard to which connection we should delete
     def delete_incoming_connection(self, incoming_connection):
-        if incoming_connection not in self._incoming_connections:
-            raise ValueError("Node %s has no incoming connections %s", str(self), str(incoming_connection))
-        else:
-            return self._incoming_connections.remove(incoming_connection)
+        if self._incoming_connections.get(incoming_connection.index) is not incoming_connection:
+            raise ValueError("Node %s has no incoming connections %s" % (str(self), str(incoming_connection)))
+        del self._incoming_connections[incoming_connection.index]
+        if self._enabled_incoming_connections is not None:
+            self._enabled_incoming_connections.pop(incoming_connection.index, None)
 
     def add_outgoing_connection(self, outgoing_connection):
-        self._outgoing_connections.append(outgoing_connection)
+        index = outgoing_connection.index
+        self._outgoing_connections[index] = outgoing_connection
+        if self._enabled_outgoing_connections is not None and outgoing_connection.is_enabled():
+            self._enabled_outgoing_connections[index] = outgoing_connection
 
     def delete_outgoing_connection(self, outgoing_connection):
-        if outgoing_connection not in self._outgoing_connections:
-            raise ValueError("Node %s has no outgoing connection %s", str(self), str(outgoing_connection))
-        else:
-            return self._outgoing_connections.remove(outgoing_connection)
+        if self._outgoing_connections.get(outgoing_connection.index) is not outgoing_connection:
+            raise ValueError("Node %s has no outgoing connection %s" % (str(self), str(outgoing_connection)))
+        del self._outgoing_connections[outgoing_connection.index]
+        if self._enabled_outgoing_connections is not None:
+            self._enabled_outgoing_connections.pop(outgoing_connection.index, None)
+
+    def update_enabled_connection(self, connection):
+        """Called by a connection of the node whose enabled flag changed"""
+        index = connection.index
+        for connections, enabled_connections in ((self._incoming_connections, self._enabled_incoming_connections),
+                                                 (self._outgoing_connections, self._enabled_outgoing_connections)):
+            if enabled_connections is not None and connections.get(index) is connection:
+                if connection.is_enabled():
+                    enabled_connections[index] = connection
+                else:
+                    enabled_connections.pop(index, None)
 
     def is_isolated(self):
         if not self._incoming_connections and not self._outgoing_connections:
@@ -63,7 +96,7 @@ class NodeGene:
 
     #TODO: consider more verbose str
     def __str__(self):
-        return "Node Gene: %s,%s" % (self._index, self._type)
+        return "Node Gene: %s %s,%s" % (self._index, decode_node(self._index), self._type)
 
     def __key(self):
         return self._type, self._index
@@ -74,10 +107,127 @@ class NodeGene:
     # def __hash__(self):
     #     return hash(self.__key())
 
+def _enabled_connections(connections):
+    return {index: connection for index, connection in connections.items() if connection.is_enabled()}
+
+
 #TODO: maybe argument is connection so we can use it to define encoding even if different node activations (internal DS that remmbers how many splits for each activation)
-def encode_node(prev_source_index, prev_dest_index, split_number):
+def encode_node(prev_source_index, prev_dest_index, split_number, node_registry):
     """Returns new node index based on the edge the node is splitting"""
-    return prev_source_index, prev_dest_index, split_number
+    return node_registry.intern(prev_source_index, prev_dest_index, split_number)
+
+
+class NodeRegistry:
+    """Interns the lineage of hidden nodes to small integer node indices.
+    A hidden node is defined by the connection it split: the indices of the connection's source and destination
+    nodes and the connection's split number. Input nodes are 0 to #inputs - 1, output nodes #inputs to
+    #inputs + #outputs - 1, the bias is -1 and hidden nodes are numbered from #inputs + #outputs onwards, in the order
+    they were first created."""
+
+    def __init__(self, first_hidden_index, lineages=()):
+        self._first_hidden_index = first_hidden_index
+        self._lineages = []         # entry [i] is the lineage of node index first_hidden_index + i
+        self._node_indices = {}     # key: lineage, value: node index
+        self._decoded = {}          # key: node index, value: the node's decoded lineage (see decode)
+        self._lineage_ids = []      # entry [i] is the lineage id of node index first_hidden_index + i
+        self._lineage_ids_array = None
+        for source_index, dest_index, split_number in lineages:
+            self.intern(int(source_index), int(dest_index), int(split_number))
+
+    @property
+    def first_hidden_index(self):
+        return self._first_hidden_index
+
+    @property
+    def lineages(self):
+        """A (#hidden nodes, 3) array, row i is the lineage of node index first_hidden_index + i"""
+        return np.array(self._lineages, dtype=np.int64).reshape(-1, 3)
+
+    def __len__(self):
+        return len(self._lineages)
+
+    def intern(self, source_index, dest_index, split_number):
+        """Returns the index of the node splitting connection (source_index, dest_index) with the given split number,
+        registering a new node index if it's the first time the connection is split this way"""
+        lineage = (source_index, dest_index, split_number)
+        node_index = self._node_indices.get(lineage)
+        if node_index is None:
+            node_index = self._first_hidden_index + len(self._lineages)
+            self._lineages.append(lineage)
+            self._node_indices[lineage] = node_index
+            self._lineage_ids.append(_hash_lineage(self._lineage_id(source_index), self._lineage_id(dest_index),
+                                                   split_number))
+            self._lineage_ids_array = None
+        return node_index
+
+    def lineage_ids(self, node_indices):
+        """Returns an array of the lineage ids of an array of node indices: a 64 bit hash of a hidden node's full
+        lineage (see decode), computed once when it's interned, and the node index itself for the other nodes.
+        Unlike node indices, lineage ids don't depend on the order nodes were created in, so they're the same across
+        runs."""
+        if self._lineage_ids_array is None:
+            self._lineage_ids_array = np.array(self._lineage_ids, dtype=np.int64)
+        lineage_ids = np.array(node_indices, dtype=np.int64)
+        hidden = lineage_ids >= self._first_hidden_index
+        lineage_ids[hidden] = self._lineage_ids_array[lineage_ids[hidden] - self._first_hidden_index]
+        return lineage_ids
+
+    def _lineage_id(self, node_index):
+        if node_index < self._first_hidden_index:
+            return node_index
+        return self._lineage_ids[node_index - self._first_hidden_index]
+
+    def lineage(self, node_index):
+        """Returns the (source index, dest index, split number) lineage of a hidden node, None for other nodes"""
+        if node_index < self._first_hidden_index:
+            return None
+        return self._lineages[node_index - self._first_hidden_index]
+
+    def decode(self, node_index):
+        """Returns the node's full lineage as nested (source, dest, split number) tuples whose innermost entries are
+        input, output or bias node indices"""
+        if node_index < self._first_hidden_index:
+            return node_index
+        # iterative, lineages may nest deeper than the recursion limit
+        stack = [node_index]
+        while stack:
+            current = stack[-1]
+            if current in self._decoded:
+                stack.pop()
+                continue
+            source_index, dest_index, split_number = self.lineage(current)
+            undecoded = [index for index in (source_index, dest_index)
+                         if index >= self._first_hidden_index and index not in self._decoded]
+            if undecoded:
+                stack += undecoded
+                continue
+            self._decoded[current] = (self._decoded.get(source_index, source_index),
+                                      self._decoded.get(dest_index, dest_index), split_number)
+            stack.pop()
+        return self._decoded[node_index]
+
+
+def _hash_lineage(source_lineage_id, dest_lineage_id, split_number):
+    digest = hashlib.blake2b(np.array([source_lineage_id, dest_lineage_id, split_number], dtype=np.int64).tobytes(),
+                             digest_size=8).digest()
+    return int.from_bytes(digest, 'little', signed=True)
+
+
+# the registry used to decode node indices in logs and string representations, set by the breeder
+_node_registry = None
+
+
+def set_node_registry(node_registry):
+    global _node_registry
+    _node_registry = node_registry
+
+
+def decode_node(node_index):
+    """Returns the node's lineage (see NodeRegistry.decode), or just the node index if no registry was set or the
+    registry doesn't know the node"""
+    if _node_registry is None or node_index >= _node_registry.first_hidden_index + len(_node_registry):
+        return node_index
+    return _node_registry.decode(node_index)
 
 
 class NodeType(Enum):
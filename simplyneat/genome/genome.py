@@ -1,17 +1,19 @@
 import copy
-import logging
-import random
-import time
 
 import numpy as np
 
 from simplyneat.agent.agent import Agent
+from simplyneat.agent.network import CompiledNetwork
 from simplyneat.config.config import init_logger
 from simplyneat.genome.genes.connection_gene import ConnectionGene
 from simplyneat.genome.genes.node_gene import NodeGene, NodeType
 
 
 class Genome:
+    __slots__ = ('_number_of_input_nodes', '_number_of_output_nodes', 'excess_coefficient', 'disjoint_coefficient',
+                 'weight_difference_coefficient', '_config', '_node_genes', '_connection_genes', '_innovation_arrays',
+                 '_fitness', '_node_indices', '_destination_node_indices', '_enabled_connection_genes',
+                 '_compiled_network')
 
     #todo: consider adding node_genes to the ctor so we can define each nodes activation function
     #todo: that way when we mutate a genome, we can get the nodes list and alter one nodes activation
@@ -35,7 +37,11 @@ class Genome:
         if self._number_of_output_nodes <= 0:
             raise ValueError('number of output nodes must be greater than 0')
 
-        self._node_genes = {}  # Key is node_index (as in encode_node @ node_gene)
+        self._node_genes = {}  # Key is node_index, an int (hidden nodes' are interned by a NodeRegistry @ node_gene)
+        # lists of the node indices, and of the indices of nodes which can be a connection's destination (i.e. not
+        # INPUT or BIAS), so nodes can be sampled uniformly in constant time
+        self._node_indices = []
+        self._destination_node_indices = []
 
         # Gene sequences. The Key is the connection index.
         if connection_genes is None:
@@ -46,16 +52,61 @@ class Genome:
             # during _init_connection_genes_nodes() - replaced with new connection objects.
             self._connection_genes = copy.copy(connection_genes)
 
+        # the enabled connection genes, keyed by connection index. Kept up to date by the connection genes themselves
+        self._enabled_connection_genes = {}
+
+        # columns of the connection genes sorted by innovation number, built on demand (see gene_arrays)
+        self._innovation_arrays = None
+        # the genome's phenotype, compiled on demand (see compiled_network)
+        self._compiled_network = None
+
         self._init_node_genes()
 
         #TODO: can't save in self agent cause tensorflow is not pickleable (doesn't matter -not pickleable becuas config)
         #self._agent = Agent(self._config, self)
 
-        fitness_init_time = time.time()
-        self._fitness = config.fitness_function(Agent(self._config, self))
-        # We only allow non-negative fitness functions
-        assert self._fitness >= 0
-        logging.debug("Fitness calculation (%s) took %s sec" % (str(self._fitness), str(time.time() - fitness_init_time)))
+        # A genome isn't evaluated when it's created, an evaluator sets its fitness later on (see evaluator.py)
+        self._fitness = None
+
+    @classmethod
+    def from_gene_arrays(cls, config, sources, destinations, weights, enabled, innovations, split_numbers):
+        """Returns a new genome whose i-th connection gene goes from node index sources[i] to node index
+        destinations[i] and has the i-th weight, enabled flag, innovation number and split number.
+        Hidden nodes are created as needed."""
+        genome = cls(config)
+        node_genes, connection_genes = genome._node_genes, genome._connection_genes
+        enabled_connection_genes = genome._enabled_connection_genes
+        # nodes which don't exist have to be hidden nodes since all of the other types were already created
+        for node_index in set(sources).union(destinations).difference(node_genes):
+            genome.add_node_gene(NodeType.HIDDEN, node_index)
+        # this loop is on the hot path of crossover and unpickling, so it avoids repeated attribute lookups
+        for source_index, dest_index, weight, enabled_flag, innovation, split_number in \
+                zip(sources, destinations, weights, enabled, innovations, split_numbers):
+            source_node, dest_node = node_genes[source_index], node_genes[dest_index]
+            # the nodes were just taken from the genome, so skip add_connection_gene's checks
+            connection = ConnectionGene(source_node, dest_node, weight, split_number, innovation, enabled_flag,
+                                        enabled_connection_genes)
+            connection_genes[connection.index] = connection
+            source_node.add_outgoing_connection(connection)
+            dest_node.add_incoming_connection(connection)
+        return genome
+
+    def __reduce__(self):
+        # pickled as typed columns of the connection genes instead of the node and connection objects graph, which
+        # is both smaller and faster to rebuild (see from_gene_arrays). The config comes along so a genome unpickles
+        # anywhere, the workers get genomes in the config-free encoding of encoding.py instead
+        connections = list(self._connection_genes.values())
+        return _unpickle_genome, (self._config,
+                                  np.array([connection.source_node.index for connection in connections],
+                                           dtype=np.int64),
+                                  np.array([connection.destination_node.index for connection in connections],
+                                           dtype=np.int64),
+                                  np.array([connection.weight for connection in connections], dtype=np.float64),
+                                  np.array([connection.is_enabled() for connection in connections], dtype=bool),
+                                  np.array([-1 if connection.innovation is None else connection.innovation
+                                            for connection in connections], dtype=np.int64),
+                                  np.array([connection.split_number for connection in connections], dtype=np.int64),
+                                  self._fitness)
 
     #TODO: rethink
     def save_agent(self):
@@ -66,6 +117,16 @@ class Genome:
         """Returns a dictionary of node-genes, the keys are indexes and values are node-genes"""
         return self._node_genes
 
+    @property
+    def node_indices(self):
+        """Returns a list of the indexes of all node-genes"""
+        return self._node_indices
+
+    @property
+    def destination_node_indices(self):
+        """Returns a list of the indexes of the node-genes which can be a connection's destination"""
+        return self._destination_node_indices
+
     @property
     def connection_genes(self):
         """Returns a dict of connection genes, where the key is the connection index of the connection gene value"""
@@ -73,8 +134,64 @@ class Genome:
 
     @property
     def enabled_connection_genes(self):
-        return {index: connection for index, connection in self._connection_genes.items()
-                if connection.is_enabled()}
+        """Returns a dict of the enabled connection genes, where the key is the connection index. Maintained
+        incrementally, so it must not be modified"""
+        return self._enabled_connection_genes
+
+    @property
+    def innovation_arrays(self):
+        """Returns a pair of numpy arrays: the innovation numbers of the connection genes in ascending order, and the
+        weights of the corresponding connection genes"""
+        gene_arrays = self.gene_arrays
+        return gene_arrays['innovations'], gene_arrays['weights']
+
+    @property
+    def gene_arrays(self):
+        """Returns a dict of numpy arrays, the columns of the connection genes sorted by ascending innovation number:
+        innovations, sources, destinations, weights, enabled and split_numbers. Built once and cached until the
+        connection genes change (see invalidate_innovation_arrays)"""
+        if self._innovation_arrays is None:
+            connections = list(self._connection_genes.values())
+            if any(connection.innovation is None for connection in connections):
+                raise ValueError("Not all of the genome's connection genes were assigned an innovation number")
+            innovations = np.array([connection.innovation for connection in connections], dtype=np.int64)
+            order = np.argsort(innovations)
+            connections = [connections[i] for i in order]
+            self._innovation_arrays = {
+                'innovations': innovations[order],
+                'sources': np.array([connection.source_node.index for connection in connections], dtype=np.int64),
+                'destinations': np.array([connection.destination_node.index for connection in connections],
+                                         dtype=np.int64),
+                'weights': np.array([connection.weight for connection in connections], dtype=np.float64),
+                'enabled': np.array([connection.is_enabled() for connection in connections], dtype=bool),
+                'split_numbers': np.array([connection.split_number for connection in connections], dtype=np.int64),
+            }
+        return self._innovation_arrays
+
+    def invalidate_innovation_arrays(self):
+        """Must be called after altering the innovation number, weight, enabled flag or split number of one of the
+        genome's connection genes"""
+        self._innovation_arrays = None
+
+    @property
+    def compiled_network(self):
+        """Returns the genome's network compiled into arrays (see CompiledNetwork). Compiled once and cached until the
+        genome's structure changes (see invalidate_compiled_network), weight changes are patched in place (see
+        set_connection_weight)"""
+        if self._compiled_network is None:
+            self._compiled_network = CompiledNetwork(self._node_genes)
+        return self._compiled_network
+
+    def invalidate_compiled_network(self):
+        """Must be called after enabling or disabling one of the genome's connection genes"""
+        self._compiled_network = None
+
+    def set_connection_weight(self, connection, weight):
+        """Sets the weight of one of the genome's connection genes, keeping the cached arrays up to date"""
+        connection.weight = weight
+        self._innovation_arrays = None
+        if self._compiled_network is not None:
+            self._compiled_network.set_weight(connection.index, weight)
 
     @property
     def size(self):
@@ -84,8 +201,18 @@ class Genome:
 
     @property
     def fitness(self):
+        """Returns the genome's fitness, or None if the genome wasn't evaluated yet"""
         return self._fitness
 
+    @fitness.setter
+    def fitness(self, fitness):
+        # We only allow non-negative fitness functions
+        assert fitness >= 0
+        self._fitness = fitness
+
+    def is_evaluated(self):
+        return self._fitness is not None
+
     def _init_node_genes(self):
         """Initializes node for the entire genome, i.e. adds INPUT, OUTPUT, BIAS nodes which are present in all
         genomes, and adds necessary nodes for a given dictionary of connection_genes"""
@@ -124,7 +251,8 @@ class Genome:
             new_connection = ConnectionGene(source_node, dest_node, weight=connection_gene.weight,
                                             split_number=connection_gene.split_number,
                                             innovation=connection_gene.innovation,
-                                            enabled_flag=connection_gene.is_enabled())
+                                            enabled_flag=connection_gene.is_enabled(),
+                                            enabled_connections=self._enabled_connection_genes)
             assert self._connection_genes[new_connection.index] == connection_gene
             self._connection_genes[new_connection.index] = new_connection
 
@@ -133,11 +261,14 @@ class Genome:
 
     def add_node_gene(self, node_type, node_index):
         """Adds a single node gene to the genome"""
-        #TODO: node index is sometimes tuple and sometimes int (when input\output\bias)
         if node_index in self._node_genes.keys():
             raise ValueError("Node index %s already in genome" % node_index)
         new_node_gene = NodeGene(node_type, node_index)
         self._node_genes[node_index] = new_node_gene
+        self._node_indices.append(node_index)
+        # INPUT\BIAS neurons can't be a destination.
+        if node_type not in (NodeType.INPUT, NodeType.BIAS):
+            self._destination_node_indices.append(node_index)
         return new_node_gene
 
     def add_connection_gene(self, source, dest, weight, split_number, innovation=None, enabled=True):
@@ -145,14 +276,17 @@ class Genome:
         be updated afterwards when it is known (for example, by the breeder which keeps track of innovations in the
         population it breeds.
         Returns the new connection gene created."""
-        if source not in self._node_genes.values():
+        if self._node_genes.get(source.index) is not source:
             raise ValueError("Source node not defined for the genome!")
-        if dest not in self._node_genes.values():           # TODO: error - thinks dest is a tuple
+        if self._node_genes.get(dest.index) is not dest:
             raise ValueError("Destination node not defined for the genome!")
 
         new_connection_gene = ConnectionGene(source, dest, weight=weight, split_number=split_number,
-                                             innovation=innovation, enabled_flag=enabled)
+                                             innovation=innovation, enabled_flag=enabled,
+                                             enabled_connections=self._enabled_connection_genes)
         self._connection_genes[new_connection_gene.index] = new_connection_gene
+        self._innovation_arrays = None
+        self._compiled_network = None
         source.add_outgoing_connection(new_connection_gene)
         dest.add_incoming_connection(new_connection_gene)
 
@@ -164,65 +298,49 @@ class Genome:
                 [str(connection) for connection in self._connection_genes.values()])
 
 
+def _unpickle_genome(config, sources, destinations, weights, enabled, innovations, split_numbers, fitness):
+    genome = Genome.from_gene_arrays(config, sources.tolist(), destinations.tolist(), weights.tolist(), enabled.tolist(),
+                                     [None if innovation < 0 else innovation for innovation in innovations.tolist()],
+                                     split_numbers.tolist())
+    genome._fitness = fitness
+    return genome
+
+
 def compatibility_distance(genome1, genome2):
     """Returns the compatibility distance, a measure of how closely related two genomes are"""
     #TODO: diverging from paper? only count connection genes
-    if len(genome1.connection_genes) == 0 and len(genome2.connection_genes) == 0:
+    innovations1, weights1 = genome1.innovation_arrays
+    innovations2, weights2 = genome2.innovation_arrays
+    if len(innovations1) == 0 and len(innovations2) == 0:
         return 0.0
 
-    # create a new dict with all of the genomes' genes with innovation as key for easy processing later on
-    innovation_to_connections1 = {connection.innovation: connection for connection in genome1.connection_genes.values()}
-    innovation_to_connections2 = {connection.innovation: connection for connection in genome2.connection_genes.values()}
     # N is as defined in the NEAT paper (number of genes in the larger genome. We only consider the connection genes)
-    N = max(len(genome1.connection_genes), len(genome2.connection_genes), 1)
+    N = max(len(innovations1), len(innovations2), 1)
 
-    disjoint, excess = calculate_mismatching_genes(innovation_to_connections1, innovation_to_connections2)
-    matching_connection_genes_innovations = set(innovation_to_connections1.keys()).intersection(set(innovation_to_connections2.keys()))
+    _, matching1, matching2 = np.intersect1d(innovations1, innovations2, assume_unique=True, return_indices=True)
+    number_of_disjoint, number_of_excess = _count_mismatching_genes(innovations1, innovations2, len(matching1))
 
-    if matching_connection_genes_innovations:
-        weight_differences = [abs(innovation_to_connections1[innovation_num].weight - innovation_to_connections2[innovation_num].weight)
-                              for innovation_num in matching_connection_genes_innovations]
-        average_weight_difference = np.mean(weight_differences)
+    if len(matching1):
+        average_weight_difference = np.mean(np.abs(weights1[matching1] - weights2[matching2]))
     else:
         average_weight_difference = 0.0
 
     # TODO: maybe find prettier solution for coefficients
-    distance = genome1.excess_coefficient*len(excess)/N + genome1.disjoint_coefficient*len(disjoint)/N +\
+    distance = genome1.excess_coefficient*number_of_excess/N + genome1.disjoint_coefficient*number_of_disjoint/N +\
            genome1.weight_difference_coefficient*average_weight_difference
-    #TODO: remove below
-    if random.random() < 0.00001:
-        a = [conn.index for conn in genome1.connection_genes.values()]
-        b = [conn.index for conn in genome2.connection_genes.values()]
-        print("%s * %s / %s   +   %s * %s / %s    +   %s * %s = %s.\n conn1: %s\n conn2: %s\n intersection: %s\n diff: %s \n\n" %
-              (genome1.excess_coefficient, len(excess), N, genome1.disjoint_coefficient, len(disjoint), N,
-               genome1.weight_difference_coefficient, average_weight_difference, distance,
-               a, b, set(a).intersection(set(b)), set(a).symmetric_difference(set(b))))
     return distance
 
-#TODO: change to return indices instead of innovation? (and change using funcs accordingly)
-def calculate_mismatching_genes(innovation_to_connections1, innovation_to_connections2):
-    """Returns a pair of lists containing innovation numbers of disjoint and excess connection genes"""
-    if not innovation_to_connections1 or not innovation_to_connections2:
-        # if one of the dictionaries is empty then everything in the other is excess!
-        return [], list(set(innovation_to_connections1.keys()).symmetric_difference(set(innovation_to_connections2.keys())))
-
-    # Max innovation is of connection genes. Node genes don't hold an innovation number.
-    max_innovation_genome1 = max(innovation_to_connections1.keys())
-    max_innovation_genome2 = max(innovation_to_connections2.keys())
-
-    n = min(max_innovation_genome1, max_innovation_genome2)
-    m = max(max_innovation_genome1, max_innovation_genome2)
-
-    # Innovation numbers of genes corresponding to exactly one connection_genes1 or connection_genes2
-    non_matching_connection_genes = set(innovation_to_connections1.keys()).symmetric_difference(set(innovation_to_connections2.keys()))
-    # refer to the NEAT paper for an accurate definition of excess and disjoint genes
-    excess = []
-    disjoint = []
-    for innovation_num in range(m + 1):
-        if innovation_num in non_matching_connection_genes:
-            if innovation_num <= n:
-                disjoint.append(innovation_num)
-            else:
-                excess.append(innovation_num)
-    return disjoint, excess
 
+def _count_mismatching_genes(innovations1, innovations2, number_of_matching):
+    """Returns the number of disjoint and excess genes between two sorted arrays of innovation numbers which have
+    number_of_matching innovation numbers in common"""
+    if len(innovations1) == 0 or len(innovations2) == 0:
+        # if one of the genomes has no genes then everything in the other is excess!
+        return 0, len(innovations1) + len(innovations2)
+    # refer to the NEAT paper for an accurate definition of excess and disjoint genes. Mismatching genes up to the
+    # smaller max innovation number are disjoint, the rest are excess. Matching genes are never above it.
+    n = min(innovations1[-1], innovations2[-1])
+    up_to_n = np.searchsorted(innovations1, n, side='right') + np.searchsorted(innovations2, n, side='right')
+    number_of_disjoint = int(up_to_n) - 2 * number_of_matching
+    number_of_excess = len(innovations1) + len(innovations2) - 2 * number_of_matching - number_of_disjoint
+    return number_of_disjoint, number_of_excess
@@ -0,0 +1,129 @@
+"""Per-generation instrumentation: the breeder times its phases and counts what it did into an Instrumentation, and
+Neat combines that with the population's statistics into one flat record per generation, which it streams to a sink
+(see create_sink) and hands to the run's callback."""
+import contextlib
+import csv
+import json
+import logging
+import os
+import time
+
+from simplyneat.config.config import StatisticsFormat
+
+
+class Instrumentation:
+    """Accumulates named timings (in seconds) and counters, and keeps gauges (values measured as a whole, like the
+    workers' utilization) until take_record() is called, once per generation"""
+
+    def __init__(self):
+        self._timings = {}
+        self._counters = {}
+        self._gauges = {}
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        """Adds the time spent in the with block to timing name"""
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_timing(name, time.perf_counter() - start_time)
+
+    def add_timing(self, name, elapsed_time):
+        self._timings[name] = self._timings.get(name, 0.0) + elapsed_time
+        logging.debug("%s took %s sec", name, elapsed_time)
+
+    def count(self, name, value=1):
+        self._counters[name] = self._counters.get(name, 0) + value
+
+    def gauge(self, name, value):
+        self._gauges[name] = value
+
+    def take_record(self):
+        """Returns the timings, counters and gauges collected since the last call, and starts over"""
+        record = {'timings': self._timings, 'counters': self._counters, 'gauges': self._gauges}
+        self._timings = {}
+        self._counters = {}
+        self._gauges = {}
+        return record
+
+
+class JsonlSink:
+    """Writes each record as a line of JSON"""
+
+    def __init__(self, path, append=False):
+        self._file = open(path, 'a' if append else 'w')
+
+    def write(self, record):
+        self._file.write(json.dumps(record) + '\n')
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class CsvSink:
+    """Writes each record as a CSV row. Nested dicts are flattened to dotted column names and lists are written as
+    JSON. The columns are those of the file's header (when appending) and of the records written so far. A record with
+    new columns (e.g. a timing of a phase which didn't run before) rewrites the file with them added, the earlier rows
+    leaving them empty - columns are rare to appear after the first records, so it's rarely done."""
+
+    def __init__(self, path, append=False):
+        self._path = path
+        self._columns = []
+        if append and os.path.exists(path) and os.path.getsize(path) > 0:
+            with open(path, newline='') as existing_file:
+                self._columns = next(csv.reader(existing_file))
+        self._file = open(path, 'a' if append else 'w', newline='')
+        self._writer = csv.DictWriter(self._file, fieldnames=self._columns, restval='')
+
+    def write(self, record):
+        row = _flatten(record)
+        new_columns = [column for column in row if column not in self._writer.fieldnames]
+        if new_columns:
+            self._add_columns(new_columns)
+        self._writer.writerow(row)
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    def _add_columns(self, new_columns):
+        if self._columns:
+            logging.info("Adding columns %s to %s", new_columns, self._path)
+        self._file.close()
+        with open(self._path, newline='') as old_file:
+            old_rows = list(csv.DictReader(old_file))
+        self._columns = self._columns + new_columns
+        # written aside and then moved over the file, so a crash while rewriting doesn't lose the earlier rows
+        temporary_path = self._path + '.tmp'
+        with open(temporary_path, 'w', newline='') as new_file:
+            writer = csv.DictWriter(new_file, fieldnames=self._columns, restval='')
+            writer.writeheader()
+            writer.writerows(old_rows)
+        os.replace(temporary_path, self._path)
+        self._file = open(self._path, 'a', newline='')
+        self._writer = csv.DictWriter(self._file, fieldnames=self._columns, restval='')
+
+
+def create_sink(config, append=False):
+    """Returns the sink config asks for, or None if config.statistics_path isn't set"""
+    if config.statistics_path is None:
+        return None
+    if config.statistics_format == StatisticsFormat.JSONL:
+        return JsonlSink(config.statistics_path, append)
+    if config.statistics_format == StatisticsFormat.CSV:
+        return CsvSink(config.statistics_path, append)
+    raise ValueError("Statistics format %s unknown" % str(config.statistics_format))
+
+
+def _flatten(record, prefix=''):
+    row = {}
+    for key, value in record.items():
+        if isinstance(value, dict):
+            row.update(_flatten(value, prefix + key + '.'))
+        elif isinstance(value, (list, tuple)):
+            row[prefix + key] = json.dumps(value)
+        else:
+            row[prefix + key] = value
+    return row
@@ -1,55 +1,176 @@
+import time
+
 from simplyneat.breeder.breeder import Breeder
+from simplyneat.checkpoint.checkpoint import Checkpointer, load_checkpoint
 from simplyneat.genome.genome import Genome
+from simplyneat.instrumentation.instrumentation import create_sink
 import logging
 
 from simplyneat.population.population import Population, StatisticsTypes
+from simplyneat.species.species import Species
 
 
 class Neat:
+    """A run of NEAT. Its worker pool (see workers.py) is kept for all of its runs, close it when done - or use it as
+    a context manager:
+        with Neat(config) as neat:
+            statistics, best_genome = neat.run(number_of_generations)"""
 
-    def __init__(self, config):
+    def __init__(self, config, checkpoint=None):
+        """Starts a new run, or continues the run of checkpoint (see resume)"""
         logging.info("Initializing NEAT environment:")
         self._config = config
         logging.info("Config set")
         self._breeder = Breeder(config)
         logging.info("Breeder set")
-        self._initial_genome = Genome(config)   # first organism, the minimal organism the entire population grows from
-        logging.info("Initial genome set")
-        self._population = Population(config, genomes=[self._initial_genome])
-        logging.info("Initial population set")
-        # dictionary of statistics, key is StatisticsType value is a list of statistics
-        self._statistics = {statistic: [] for statistic in StatisticsTypes}
-
-        self._best_genome = Genome(self._config)
+        if checkpoint is None:
+            self._initial_genome = Genome(config)   # first organism, the minimal organism the entire population grows from
+            self._breeder.evaluator.evaluate([self._initial_genome])
+            logging.info("Initial genome set")
+            self._population = Population(config, genomes=[self._initial_genome])
+            logging.info("Initial population set")
+            # dictionary of statistics, key is StatisticsType value is a list of statistics
+            self._statistics = {statistic: [] for statistic in StatisticsTypes}
+            self._best_genome = self._initial_genome
+            self._generation = 0                    # number of generations bred so far
+        else:
+            self._restore(checkpoint)
         self._best_genome_fitness = self._best_genome.fitness
 
+        if config.checkpoint_path is None:
+            self._checkpointer = None
+        else:
+            self._checkpointer = Checkpointer(config.checkpoint_path, config.checkpoints_to_keep,
+                                              resume_generation=None if checkpoint is None else checkpoint.generation,
+                                              checkpoint_interval=config.checkpoint_interval)
+        # a new run starts the statistics file over, later runs and resumed runs append to it
+        self._append_statistics = checkpoint is not None
+        self._closed = False
         logging.info("Initialized NEAT environment")
 
-    def run(self, number_of_generations=0):
+    @classmethod
+    def resume(cls, path, config, generation=None, mmap_mode=None):
+        """Returns a Neat continuing the run checkpointed to path, from its latest checkpoint or from the given
+        generation. The config isn't part of the checkpoint (its fitness function is code), so it's given again."""
+        return cls(config, checkpoint=load_checkpoint(path, config, generation, mmap_mode))
+
+    def close(self):
+        """Shuts down the worker pool, tearing down the fitness function, and saves the fitness cache. Closing again
+        does nothing."""
+        if self._closed:
+            return
+        self._closed = True
+        self._breeder.close()
+        logging.info("Closed NEAT environment")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _restore(self, checkpoint):
+        self._breeder.restore_innovations(checkpoint.innovations_dictionary, checkpoint.innovation_counter,
+                                          checkpoint.node_registry)
+        list_of_species = []
+        for representative, genomes in checkpoint.species:
+            species = Species([representative])
+            species.reset_genomes()
+            for genome in genomes:
+                species.add_genome(genome)
+            list_of_species.append(species)
+        self._population = Population(self._config, genomes=checkpoint.genomes, species=list_of_species,
+                                      speciate=False)
+        self._statistics = {statistic: list(checkpoint.statistics[statistic.value]) for statistic in StatisticsTypes}
+        self._best_genome = checkpoint.best_genome
+        self._generation = checkpoint.generation
+        checkpoint.restore_random_states()
+        logging.info("Restored the checkpoint of generation %s" % checkpoint.generation)
+
+    def run(self, number_of_generations=0, callback=None):
+        """Runs number_of_generations generations. After each one its record - the population's statistics, the
+        breeder's timings and counters (see instrumentation.py), the number of evaluations and their throughput - is
+        streamed to config.statistics_path, if set, and passed to callback, if given. Later runs continue from where
+        the last one stopped, with the same workers."""
         logging.info("Running for %s generations" % str(number_of_generations))
-        for i in range(number_of_generations):
-            logging.info("Generation number %s" % i)
-            self._step()
+        return self._run((self._step() for _ in range(number_of_generations)), callback)
+
+    def _run(self, records, callback):
+        """Writes, passes to callback and checkpoints each record of records, a generator which runs the generations.
+        Returns the statistics and best genome so far."""
+        if self._closed:
+            raise ValueError("Neat is closed")
+        sink = create_sink(self._config, append=self._append_statistics)
+        self._append_statistics = True
+        try:
+            for record in records:
+                if sink is not None:
+                    sink.write(record)
+                if callback is not None:
+                    callback(record)
+                if self._checkpointer is not None and self._checkpointer.is_due(self._generation):
+                    self._save_checkpoint()
+        finally:
+            if sink is not None:
+                sink.close()
 
+        self._breeder.evaluator.save_fitness_cache()
         return self._statistics, self._best_genome
 
     def _step(self):
-        """A single iteration of NEAT's algorithm, test the entire population and get the next generation"""
+        """A single iteration of NEAT's algorithm, test the entire population and get the next generation.
+        Returns the generation's record."""
+        logging.info("Generation number %s" % self._generation)
+        start_time = time.perf_counter()
         self._population = self._breeder.breed_population(self._population)
-        self._add_statistics()
-        self._log_statistics()
+        self._generation += 1
+        return self._finish_generation(time.perf_counter() - start_time)
+
+    def _finish_generation(self, elapsed_time, number_of_evaluations=None):
+        """Records the generation which was just completed, with the time it took and its number of evaluations - by
+        default the number of offsprings bred in it. Returns its record."""
+        record = self._generation_record()
+        if number_of_evaluations is None:
+            number_of_evaluations = record['counters'].get('offsprings', 0)
+        record['evaluations'] = number_of_evaluations
+        record['evaluations_per_second'] = number_of_evaluations / elapsed_time
+        self._add_statistics(record)
+        self._log_statistics(record)
         self._update_best_genome()
+        return record
+
+    def _save_checkpoint(self):
+        self._checkpointer.save(self._generation, self._population, self._best_genome,
+                                {statistic.value: values for statistic, values in self._statistics.items()},
+                                self._breeder.innovations_dictionary, self._breeder.innovation_counter,
+                                self._breeder.node_registry)
+        # the fitness cache keeps its own file, save it along so a resumed run doesn't re-evaluate
+        self._breeder.evaluator.save_fitness_cache()
+
+    def _generation_record(self):
+        """Returns a dict of everything measured about the last generation, each statistic of StatisticsTypes keyed by
+        its lower case value"""
+        record = {'generation': self._generation}
+        record.update(self._population.statistics)
+        fitness_cache = self._breeder.evaluator.fitness_cache
+        if fitness_cache is not None:
+            # the evaluator's counts so far, not the population's, so they're gauges rather than statistics
+            self._breeder.instrumentation.gauge('fitness_cache_hits', fitness_cache.hits)
+            self._breeder.instrumentation.gauge('fitness_cache_misses', fitness_cache.misses)
+        record.update(self._breeder.instrumentation.take_record())
+        return record
 
-    def _add_statistics(self):
-        """Appends to each list of statistics according to how the generation performed. 
-        Assumes population.get_statistic can handle all Enum values"""
+    def _add_statistics(self, record):
+        """Appends to each list of statistics according to how the generation performed."""
         for statistic in StatisticsTypes:
-            self._statistics[statistic].append(self._population.get_statistic(statistic))
+            self._statistics[statistic].append(record[statistic.value.lower()])
 
-    def _log_statistics(self):
+    def _log_statistics(self, record):
         logging.info("Logging population statistics")
         for statistic in StatisticsTypes:
-            logging.info("%s: %s" % (statistic, self._population.get_statistic(statistic)))
+            logging.info("%s: %s" % (statistic, record[statistic.value.lower()]))
+        logging.debug("Generation timings: %s, counters: %s, gauges: %s", record['timings'], record['counters'],
+                      record['gauges'])
 
     def _update_best_genome(self):
         best_genome = self._population.best_genome
@@ -6,36 +6,60 @@ from enum import Enum
 import numpy as np
 
 from simplyneat.genome.genome import compatibility_distance
+from simplyneat.population.speciation import RepresentativeArrays, speciate_in_pool
 from simplyneat.species.species import Species
 
+# up to this many species, a genome is compared with the representatives one at a time, stopping at the first
+# compatible one, which is faster than computing the distances to all of them at once
+_MAX_SPECIES_COMPARED_ONE_AT_A_TIME = 2
+
 
 class Population:
 
-    def __init__(self, config, genomes=None, species=None):
+    def __init__(self, config, genomes=None, species=None, speciate=True, pool=None):
         """Builds the population according to a list of genomes and species. 
-        Assign each organism to one of the given species."""
+        Assign each organism to one of the given species, unless speciate is False - then the species already hold
+        the genomes (e.g. when restored from a checkpoint). If config.parallel_speciation is set and a pool is given,
+        the genomes are speciated in the pool (see speciate_in_pool @ speciation).
+        genomes may be any iterable, e.g. a generator of offsprings as they're bred: each genome is speciated as soon as
+        it's yielded, and only needs to be evaluated once the iterable is exhausted."""
         start_time = time.time()
         if species is None:
             self._list_of_species = []
         else:
             self._list_of_species = species
         if genomes is None:
-            self._genomes = []
-        else:
-            self._genomes = genomes
+            genomes = []
+        self._genomes = []
         self._compatibility_threshold = config.compatibility_threshold      # threshold for being in the same species
         self._size = config.population_size                                 # population size
         self._elite_group_size = config.elite_group_size                    # members of population who always pass on
         self._config = config
+        self._statistics = None                                             # see statistics
+        self._elite_group = None                                            # see elite_group
+        self._coefficients = (config.excess_coefficient, config.disjoint_coefficient,
+                              config.weight_difference_coefficient)
+        self._representative_arrays = None                                  # see _assign_species
+        self._fitness = self._connection_genes = self._hidden_nodes = None  # see _fill_genome_columns
+        self._species_numbers = None                                        # see species_numbers
 
+        if not speciate:
+            self._genomes = list(genomes)
+            self._fill_genome_columns()
+            return
         # divide the genomes into species
-        self._speciate_population()
-        # set new representatives or eliminate extinct species according to new generation genomes
+        if pool is not None and config.parallel_speciation:
+            self._genomes = list(genomes)
+            self._speciate_population_in_pool(pool)
+        else:
+            self._speciate_population(genomes)
+        self._fill_genome_columns()
+        # eliminate extinct species, which have no members, and set new representatives according to new generation
+        # genomes
+        self._list_of_species = [species for species in self._list_of_species if species.size != 0]
         for species in self._list_of_species:
-            if len(species.genomes) != 0:
-                species.randomize_representative()          # set new representative after speciating
-            else:
-                self._list_of_species.remove(species)       # species has no members and is therefore extinct
+            species.randomize_representative()              # set new representative after speciating
+        self._representative_arrays = None
         logging.debug("Population init took %s sec. #%s species of sizes: %s" %
                       (time.time() - start_time, len(self._list_of_species),
                        [species.size for species in self._list_of_species]))
@@ -50,65 +74,164 @@ class Population:
 
     @property
     def elite_group(self):
-        """Returns a list of the best genomes which we'd like to keep for the next generation"""
-        sorted_genomes = sorted(self._genomes, key=lambda genome: genome.fitness, reverse=True)
-        return sorted_genomes[0:self._elite_group_size]
+        """Returns a list of the best genomes which we'd like to keep for the next generation, by descending fitness.
+        Genomes of equal fitness are in population order, as a stable sort of all genomes would leave them."""
+        if self._elite_group is None:
+            number_of_elites = min(self._elite_group_size, len(self._genomes))
+            if number_of_elites <= 0:
+                self._elite_group = []
+                return self._elite_group
+            # the fitness of the worst elite, then all genomes fitter than it and the first ones as fit as it
+            elite_fitness = -np.partition(-self._fitness, number_of_elites - 1)[number_of_elites - 1]
+            fitter = np.flatnonzero(self._fitness > elite_fitness)
+            as_fit = np.flatnonzero(self._fitness == elite_fitness)[:number_of_elites - len(fitter)]
+            elites = np.concatenate([fitter, as_fit])
+            elites = elites[np.argsort(-self._fitness[elites], kind='stable')]
+            self._elite_group = [self._genomes[genome_number] for genome_number in elites.tolist()]
+        return list(self._elite_group)
 
     @property
     def size(self):
         return self._size
 
-    def _add_genome(self, genome):
+    @property
+    def fitness_array(self):
+        """Returns an array of the genomes' fitness, entry [i] is genome i's. Read only."""
+        return self._fitness
+
+    @property
+    def species_numbers(self):
+        """Returns an array of the genomes' species, entry [i] is the index in species of genome i's. Read only."""
+        if self._species_numbers is None:
+            species_number_by_genome = {id(genome): species_number
+                                        for species_number, species in enumerate(self._list_of_species)
+                                        for genome in species.genomes}
+            self._species_numbers = np.array([species_number_by_genome[id(genome)] for genome in self._genomes],
+                                             dtype=np.int64)
+        return self._species_numbers
+
+    def add_genome(self, genome):
+        """Adds an evaluated genome to the population, in the species it's assigned. For steady-state evolution, where
+        the population changes a genome at a time (see steady_state.py)."""
         assert genome not in self._genomes
         self._genomes.append(genome)
-        self._assign_species(genome)
+        species_number = self._assign_species(genome)
+        self._fitness, self._connection_genes, self._hidden_nodes = \
+            (np.append(column, new_column) for column, new_column in
+             zip((self._fitness, self._connection_genes, self._hidden_nodes), self._genome_columns([genome])))
+        if self._species_numbers is not None:
+            self._species_numbers = np.append(self._species_numbers, species_number)
+        self._statistics = None
+        self._elite_group = None
+
+    def remove_genome(self, genome_number):
+        """Removes genome number genome_number from the population and from its species, and the species if it's left
+        empty"""
+        species_number = int(self.species_numbers[genome_number])
+        genome = self._genomes.pop(genome_number)
+        self._fitness, self._connection_genes, self._hidden_nodes, self._species_numbers = \
+            (np.delete(column, genome_number)
+             for column in (self._fitness, self._connection_genes, self._hidden_nodes, self._species_numbers))
+        species = self._list_of_species[species_number]
+        species.remove_genome(genome)
+        if species.size == 0:
+            del self._list_of_species[species_number]
+            self._species_numbers[self._species_numbers > species_number] -= 1
+            # the representatives' arrays are in the species' order
+            self._representative_arrays = None
+        self._statistics = None
+        self._elite_group = None
 
     def _assign_species(self, genome):
         """Assigns a species to a given genome, returning the index of the assigned species"""
         indexes = list(range(len(self._list_of_species)))
         random.shuffle(indexes)     # random permutation of indexes
-        for index in indexes:
-            representative = self._list_of_species[index].representative
-            # try to assign genome to species with given index
-            if compatibility_distance(genome, representative) < self._compatibility_threshold:
+        # the genome joins the first species in the random order whose representative is within threshold of it
+        if len(indexes) <= _MAX_SPECIES_COMPARED_ONE_AT_A_TIME:
+            for index in indexes:
+                if compatibility_distance(genome, self._list_of_species[index].representative) < \
+                        self._compatibility_threshold:
+                    self._list_of_species[index].add_genome(genome)
+                    return index
+        else:
+            if self._representative_arrays is None:
+                # the representatives' genes are encoded once, and only again when a species is founded
+                self._representative_arrays = RepresentativeArrays(
+                    [species.representative for species in self._list_of_species], self._coefficients)
+            indexes = np.array(indexes)
+            distances = self._representative_arrays.distances(genome, self._compatibility_threshold)
+            compatible_indexes = indexes[distances[indexes] < self._compatibility_threshold]
+            if len(compatible_indexes):
+                index = int(compatible_indexes[0])
                 self._list_of_species[index].add_genome(genome)
                 return index
         # The genome doesn't belong to an existing species. This is a new species, with only genome as a member for now.
         self._list_of_species.append(Species([genome]))
+        if self._representative_arrays is not None:
+            self._representative_arrays.add(genome)
         return len(self._list_of_species) - 1  # the indexes are 0-based while len obviously isn't
 
-    def _speciate_population(self):
-        """Assign a species for every genome in the current population"""
+    def _speciate_population(self, genomes):
+        """Adds the genomes to the population, assigning a species for every genome"""
         speciation_start_time = time.time()
-        for genome in self._genomes:
+        for genome in genomes:
+            self._genomes.append(genome)
             self._assign_species(genome)
         logging.debug("Speciation took %s sec" % (time.time() - speciation_start_time))
 
+    def _speciate_population_in_pool(self, pool):
+        """Same as _speciate_population, except that the existing species are tried in one random order for all
+        genomes, so the result doesn't depend on how the genomes are split between the workers"""
+        speciation_start_time = time.time()
+        number_of_species = len(self._list_of_species)
+        species_numbers = speciate_in_pool(self._genomes, [species.representative for species in self._list_of_species],
+                                           self._coefficients, self._compatibility_threshold, pool,
+                                           self._config.processes_in_pool)
+        for genome, species_number in zip(self._genomes, species_numbers.tolist()):
+            if species_number < len(self._list_of_species):
+                self._list_of_species[species_number].add_genome(genome)
+            else:
+                # new species are numbered in the order they were founded, by their first genome
+                assert species_number == len(self._list_of_species)
+                self._list_of_species.append(Species([genome]))
+        logging.debug("Speciation in pool took %s sec, %s new species" %
+                      (time.time() - speciation_start_time, len(self._list_of_species) - number_of_species))
+
     def get_statistic(self, statistic):
         """Returns a certain statistic which is kept by the population.
         Statistic is an enum of type StatisticsType. Make sure to handle all statistics."""
-        if statistic not in StatisticsTypes:
+        if statistic not in StatisticsTypes or statistic.value.lower() not in self.statistics:
             raise ValueError("Statistic type unknown to population")
-        if statistic == StatisticsTypes.MAX_FITNESS:
-            return self.max_fitness
-        if statistic == StatisticsTypes.MIN_FITNESS:
-            return self.min_fitness
-        if statistic == StatisticsTypes.AVERAGE_FITNESS:
-            return self.average_fitness
-        if statistic == StatisticsTypes.NUM_SPECIES:
-            return self.number_of_species
+        return self.statistics[statistic.value.lower()]
+
+    @property
+    def statistics(self):
+        """Returns a dict of the population's statistics: those of StatisticsTypes it keeps (keyed by their lower case
+        value), the sizes of its species and the distributions of its genomes' sizes. Computed from the genome columns
+        on first access."""
+        if self._statistics is None:
+            self._statistics = {
+                StatisticsTypes.MAX_FITNESS.value.lower(): float(self._fitness.max()),
+                StatisticsTypes.MIN_FITNESS.value.lower(): float(self._fitness.min()),
+                StatisticsTypes.AVERAGE_FITNESS.value.lower(): float(self._fitness.mean()),
+                StatisticsTypes.NUM_SPECIES.value.lower(): self.number_of_species,
+                'species_sizes': [species.size for species in self._list_of_species],
+                'connection_genes': _distribution(self._connection_genes),
+                'hidden_nodes': _distribution(self._hidden_nodes),
+            }
+        return self._statistics
 
     @property
     def max_fitness(self):
-        return max([genome.fitness for genome in self._genomes])
+        return self.statistics[StatisticsTypes.MAX_FITNESS.value.lower()]
 
     @property
     def min_fitness(self):
-        return min([genome.fitness for genome in self._genomes])
+        return self.statistics[StatisticsTypes.MIN_FITNESS.value.lower()]
 
     @property
     def average_fitness(self):
-        return np.mean([genome.fitness for genome in self._genomes])
+        return self.statistics[StatisticsTypes.AVERAGE_FITNESS.value.lower()]
 
     @property
     def number_of_species(self):
@@ -116,12 +239,36 @@ class Population:
 
     @property
     def best_genome(self):
-        return max(self._genomes, key=lambda genome: genome.fitness)
+        # the first of the fittest genomes, like max
+        return self._genomes[int(np.argmax(self._fitness))]
+
+    def _fill_genome_columns(self):
+        # the genomes' fitness, numbers of connection genes and of hidden nodes as columns, entry [i] is genome i's.
+        # The genomes are final once the population is built, so they're filled once.
+        self._fitness, self._connection_genes, self._hidden_nodes = self._genome_columns(self._genomes)
+
+    def _genome_columns(self, genomes):
+        """Returns arrays of the fitness (nan if not evaluated), the numbers of connection genes and the numbers of hidden
+        nodes of genomes"""
+        number_of_fixed_nodes = self._config.number_of_input_nodes + self._config.number_of_output_nodes + 1
+        fitness = np.empty(len(genomes))
+        connection_genes = np.empty(len(genomes), dtype=np.int64)
+        hidden_nodes = np.empty(len(genomes), dtype=np.int64)
+        for genome_number, genome in enumerate(genomes):
+            fitness[genome_number] = np.nan if genome.fitness is None else genome.fitness
+            connection_genes[genome_number] = len(genome.connection_genes)
+            hidden_nodes[genome_number] = len(genome.node_genes) - number_of_fixed_nodes
+        return fitness, connection_genes, hidden_nodes
 
     def __str__(self):
         return 'Population with %s species and %s genomes: \nSpecies: %s' \
                % (len(self.species), len(self._genomes), self.species)
 
+def _distribution(values):
+    return {'min': int(values.min()), 'max': int(values.max()), 'mean': float(values.mean()),
+            'median': float(np.median(values))}
+
+
 #TODO: refactor out to stats class
 class StatisticsTypes(Enum):
     MAX_FITNESS = 'MAX_FITNESS'
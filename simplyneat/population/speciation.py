@@ -0,0 +1,167 @@
+"""Speciation kernels: the compatibility distances of a genome to all species representatives at once, over dense
+arrays of the representatives' genes built once per generation. Distances that can't come under the compatibility
+threshold are cut short: a lower bound from the genome sizes skips most representatives before their genes are
+compared, and the weight differences are only summed for representatives whose disjoint and excess genes leave room
+under the threshold. Same distance as compatibility_distance @ genome."""
+import functools
+
+import numpy as np
+
+from simplyneat.breeder.shared_arrays import SharedArrays, attach_shared_arrays
+
+
+class RepresentativeArrays:
+    """The species representatives' genes as dense arrays, column k standing for the k-th smallest innovation number
+    of any representative. Representatives of new species are added with add."""
+
+    def __init__(self, representatives, coefficients):
+        self._coefficients = coefficients      # excess, disjoint and weight difference coefficients
+        self._number_of_representatives = 0
+        # list of (representatives, their encoded arrays) blocks, in the representatives' order
+        self._blocks = []
+        if representatives:
+            self._blocks.append((list(representatives), _encode_representatives(representatives)))
+            self._number_of_representatives = len(representatives)
+
+    def __len__(self):
+        return self._number_of_representatives
+
+    def add(self, representative):
+        # like a binary counter, the last blocks are merged while they aren't larger than the new one, so adding is
+        # amortized O(log #representatives) encodings and there are O(log #representatives) blocks
+        representatives = [representative]
+        while self._blocks and len(self._blocks[-1][0]) <= len(representatives):
+            representatives = self._blocks.pop()[0] + representatives
+        self._blocks.append((representatives, _encode_representatives(representatives)))
+        self._number_of_representatives += 1
+
+    def distances(self, genome, compatibility_threshold):
+        """Returns the compatibility distances of genome to the representatives, np.inf for those it's certainly not
+        within compatibility_threshold of"""
+        innovations, weights = genome.innovation_arrays
+        if len(self._blocks) == 1:
+            return _distances(self._blocks[0][1], innovations, weights, self._coefficients, compatibility_threshold)
+        return np.concatenate([np.empty(0)] + [_distances(arrays, innovations, weights, self._coefficients,
+                                                          compatibility_threshold) for _, arrays in self._blocks])
+
+
+def speciate_in_pool(genomes, representatives, coefficients, compatibility_threshold, pool, number_of_workers):
+    """Assigns each genome a species, with the genomes split in chunks between the pool's workers. Returns an array,
+    entry [i] is the species number of genome i: numbers below len(representatives) are the existing species, the rest
+    are new species, numbered in the order they're founded.
+    The species are tried in one random order for the whole generation, so a genome's species doesn't depend on the
+    chunks. Genomes which fit none of the existing species are then speciated in order, in the calling process, into
+    the new species - so the new species don't depend on the chunks either."""
+    arrays = {'representative_' + name: array for name, array in _encode_representatives(representatives).items()}
+    innovation_arrays = [genome.innovation_arrays for genome in genomes]
+    arrays['offsets'] = np.cumsum([0] + [len(innovations) for innovations, _ in innovation_arrays], dtype=np.int64)
+    arrays['innovations'] = np.concatenate([innovations for innovations, _ in innovation_arrays] +
+                                           [np.empty(0, dtype=np.int64)])
+    arrays['weights'] = np.concatenate([weights for _, weights in innovation_arrays] + [np.empty(0)])
+    arrays['species_order'] = np.random.permutation(len(representatives))
+
+    number_of_blocks = max(1, min(len(genomes), 4 * number_of_workers))
+    row_blocks = [rows for rows in np.array_split(np.arange(len(genomes)), number_of_blocks) if len(rows)]
+    with SharedArrays(arrays) as shared_arrays:
+        species_numbers = np.concatenate(
+            [np.empty(0, dtype=np.int64)] +
+            pool.map(functools.partial(_assign_rows_in_shared_memory, descriptor=shared_arrays.descriptor,
+                                       coefficients=coefficients, compatibility_threshold=compatibility_threshold),
+                     row_blocks))
+
+    new_representative_arrays = RepresentativeArrays([], coefficients)
+    for genome_number in np.flatnonzero(species_numbers < 0).tolist():
+        genome = genomes[genome_number]
+        compatible = np.flatnonzero(new_representative_arrays.distances(genome, compatibility_threshold) <
+                                    compatibility_threshold)
+        if len(compatible):
+            species_numbers[genome_number] = len(representatives) + compatible[0]
+        else:
+            species_numbers[genome_number] = len(representatives) + len(new_representative_arrays)
+            new_representative_arrays.add(genome)
+    return species_numbers
+
+
+def _encode_representatives(representatives):
+    innovation_arrays = [representative.innovation_arrays for representative in representatives]
+    all_innovations = np.unique(np.concatenate([innovations for innovations, _ in innovation_arrays] +
+                                               [np.empty(0, dtype=np.int64)]))
+    present = np.zeros((len(representatives), len(all_innovations)), dtype=bool)
+    weights = np.zeros((len(representatives), len(all_innovations)))
+    for row, (innovations, representative_weights) in enumerate(innovation_arrays):
+        columns = np.searchsorted(all_innovations, innovations)
+        present[row, columns] = True
+        weights[row, columns] = representative_weights
+    # entry [i, k] is the number of genes of representative i in the first k columns
+    cumulative_counts = np.zeros((len(representatives), len(all_innovations) + 1), dtype=np.int64)
+    np.cumsum(present, axis=1, out=cumulative_counts[:, 1:])
+    return {'innovations': all_innovations, 'present': present, 'weights': weights,
+            'cumulative_counts': cumulative_counts, 'lengths': cumulative_counts[:, -1].copy(),
+            # -1 for a representative without genes
+            'max_innovations': np.array([innovations[-1] if len(innovations) else -1
+                                         for innovations, _ in innovation_arrays], dtype=np.int64)}
+
+
+def _distances(representative_arrays, innovations, weights, coefficients, compatibility_threshold):
+    """See RepresentativeArrays.distances"""
+    excess_coefficient, disjoint_coefficient, weight_difference_coefficient = coefficients
+    all_innovations, lengths = representative_arrays['innovations'], representative_arrays['lengths']
+    number_of_genes = len(innovations)
+    distances = np.full(len(lengths), np.inf)
+
+    # N is as in compatibility_distance. At least the difference in size of two genomes' genes are mismatching.
+    N = np.maximum(lengths, max(number_of_genes, 1))
+    candidates = np.flatnonzero(min(excess_coefficient, disjoint_coefficient) * np.abs(lengths - number_of_genes) <
+                                compatibility_threshold * N)
+    if not len(candidates):
+        return distances
+
+    # the genome's genes which any representative has, and their columns
+    columns = all_innovations.searchsorted(innovations)
+    found = columns < len(all_innovations)
+    found[found] = all_innovations[columns[found]] == innovations[found]
+    columns, found_weights = columns[found], weights[found]
+    rows = candidates[:, np.newaxis]
+    matching = representative_arrays['present'][rows, columns]
+    number_of_matching = matching.sum(axis=1)
+
+    # mismatching genes up to the smaller max innovation number are disjoint, the rest are excess. An empty genome's
+    # max innovation number is -1, so all of the other genome's genes are excess
+    n = np.minimum(representative_arrays['max_innovations'][candidates], innovations[-1] if number_of_genes else -1)
+    up_to_n = innovations.searchsorted(n, side='right') + \
+        representative_arrays['cumulative_counts'][candidates, all_innovations.searchsorted(n, side='right')]
+    number_of_disjoint = up_to_n - 2 * number_of_matching
+    number_of_excess = lengths[candidates] + number_of_genes - 2 * number_of_matching - number_of_disjoint
+    partial_distances = (excess_coefficient * number_of_excess + disjoint_coefficient * number_of_disjoint) / \
+        N[candidates]
+
+    # the weight differences only matter where the partial distance is still under the threshold
+    remaining = partial_distances < compatibility_threshold
+    if not remaining.any():
+        return distances
+    matching, number_of_matching = matching[remaining], number_of_matching[remaining]
+    weight_differences = (np.abs(representative_arrays['weights'][rows[remaining], columns] - found_weights) *
+                          matching).sum(axis=1)
+    average_weight_differences = np.divide(weight_differences, number_of_matching,
+                                           out=np.zeros(len(weight_differences)), where=number_of_matching > 0)
+    distances[candidates[remaining]] = partial_distances[remaining] + \
+        weight_difference_coefficient * average_weight_differences
+    return distances
+
+
+def _assign_rows_in_shared_memory(rows, descriptor, coefficients, compatibility_threshold):
+    """Returns, for each genome number in rows, the first species in the generation's species order it's within
+    compatibility_threshold of, -1 if there is none"""
+    with attach_shared_arrays(descriptor) as arrays:
+        representative_arrays = {name[len('representative_'):]: array for name, array in arrays.items()
+                                 if name.startswith('representative_')}
+        species_order = arrays['species_order']
+        species_numbers = np.full(len(rows), -1, dtype=np.int64)
+        for k, row in enumerate(rows.tolist()):
+            start, end = arrays['offsets'][row], arrays['offsets'][row + 1]
+            distances = _distances(representative_arrays, arrays['innovations'][start:end],
+                                   arrays['weights'][start:end], coefficients, compatibility_threshold)
+            compatible = species_order[distances[species_order] < compatibility_threshold]
+            if len(compatible):
+                species_numbers[k] = compatible[0]
+        return species_numbers
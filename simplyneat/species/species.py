@@ -34,6 +34,10 @@ class Species:
             raise ValueError("add_genome argument should be an instance of %s, not %s", Genome.__class__, genome.__class__)
         self._genomes.append(genome)
 
+    def remove_genome(self, genome):
+        """Removes genome from the species, the representative stays even if it's the one removed"""
+        self._genomes.remove(genome)
+
     def reset_genomes(self):
         """Removes all genomes from species while maintaining the previous representative"""
         self._genomes = []
@@ -0,0 +1,103 @@
+"""Steady-state evolution, after rtNEAT (Stanley, Bryant & Miikkulainen 2005): there's no generation barrier. A few
+evaluations are kept in flight at all times, and whenever one of them completes, its offspring replaces the worst
+genome of the population and a new offspring of the population as it is then is sent to evaluation. When evaluation
+times vary a lot between genomes, the workers don't wait for the slowest genome of every generation.
+As in rtNEAT, only genomes which have been in the population for a minimum age - a number of completed evaluations -
+may be replaced, so a new genome has the time to breed before it can be dropped."""
+import functools
+import logging
+import queue
+import time
+
+import numpy as np
+
+from simplyneat.neat import Neat
+
+
+class SteadyStateNeat(Neat):
+    """A Neat which evolves its population a genome at a time. Every config.population_size completed evaluations
+    count as a generation: its record (with evaluations_per_second, to compare with Neat.run) is streamed, passed to
+    the callback and checkpointed like those of Neat.run. Evaluations still in flight and the genomes' ages aren't
+    checkpointed: the genomes of a resumed population are all old enough to be replaced."""
+
+    def __init__(self, config, checkpoint=None):
+        super().__init__(config, checkpoint)
+        # two evaluations in flight per worker, so a worker has the next genome at hand while the last one it evaluated
+        # replaces a genome and breeds its successor
+        self._evaluations_in_flight = 2 * max(1, config.processes_in_pool)
+        self._evaluations_since_record = 0          # evaluations completed since the last record
+        self._time_since_record = 0.0               # seconds spent running since the last record
+        if config.steady_state_minimum_age is None:
+            self._minimum_age = config.population_size // 4
+        else:
+            self._minimum_age = config.steady_state_minimum_age
+        if self._minimum_age < 0:
+            raise ValueError("steady_state_minimum_age must be non-negative")
+        self._number_of_placements = 0              # offsprings placed in the population so far
+        # entry [i] is the number of placements before genome number i was placed, see _replace_worst_genome
+        self._placement_times = None
+
+    def run(self, number_of_evaluations=0, callback=None):
+        """Runs until number_of_evaluations more offsprings are evaluated and placed in the population. Evaluations
+        after the run's last full generation count towards the next run's first generation."""
+        logging.info("Running for %s evaluations" % str(number_of_evaluations))
+        return self._run(self._evaluate_steadily(number_of_evaluations), callback)
+
+    def _evaluate_steadily(self, number_of_evaluations):
+        """Yields the record of every generation completed"""
+        completed = queue.Queue()       # offsprings whose evaluation is done, put by the evaluator
+        evaluations = {}                # key: id of an offspring in flight, value: its Evaluation
+        number_submitted = 0
+        number_completed = 0
+        if self._evaluations_since_record == 0:
+            self._breeder.reset_worker_utilization()
+        start_time = time.perf_counter()
+        while number_completed < number_of_evaluations:
+            while len(evaluations) < self._evaluations_in_flight and number_submitted < number_of_evaluations:
+                offspring = self._breeder.breed_offspring(self._population)
+                evaluations[id(offspring)] = self._breeder.evaluator.submit(
+                    [offspring], callback=functools.partial(completed.put, offspring))
+                number_submitted += 1
+            offspring = completed.get()
+            evaluations.pop(id(offspring)).wait()
+            self._replace_worst_genome(offspring)
+            number_completed += 1
+            self._evaluations_since_record += 1
+            if self._evaluations_since_record == self._config.population_size:
+                self._time_since_record += time.perf_counter() - start_time
+                self._generation += 1
+                self._breeder.record_worker_utilization(self._time_since_record)
+                record = self._finish_generation(self._time_since_record, self._evaluations_since_record)
+                self._evaluations_since_record = 0
+                self._time_since_record = 0.0
+                yield record
+                # the time spent handling the record isn't the engine's
+                start_time = time.perf_counter()
+        self._time_since_record += time.perf_counter() - start_time
+
+    def _replace_worst_genome(self, offspring):
+        """Adds offspring to the population, in place of the worst genome of at least the minimum age once the
+        population is full"""
+        if self._placement_times is None:
+            # the genomes which were in the population before it evolved steadily are old enough
+            self._placement_times = np.full(len(self._population.genomes), -np.inf)
+        if len(self._population.genomes) >= self._config.population_size:
+            ages = self._number_of_placements - self._placement_times
+            genome_number = _worst_genome_number(self._population, ages >= self._minimum_age)
+            self._population.remove_genome(genome_number)
+            self._placement_times = np.delete(self._placement_times, genome_number)
+        self._population.add_genome(offspring)
+        self._placement_times = np.append(self._placement_times, self._number_of_placements)
+        self._number_of_placements += 1
+        self._update_best_genome()
+
+
+def _worst_genome_number(population, eligible):
+    """Returns the number of the genome of the lowest adjusted fitness - its fitness divided by its species' size, as
+    in rtNEAT - among the genomes where the boolean array eligible is True, or among all of them if none is"""
+    species_numbers = population.species_numbers
+    species_sizes = np.bincount(species_numbers)
+    adjusted_fitness = population.fitness_array / species_sizes[species_numbers]
+    if eligible.any():
+        adjusted_fitness[~eligible] = np.inf
+    return int(np.argmin(adjusted_fitness))
@@ -0,0 +1,136 @@
+"""The worker processes shared by breeding, speciation, fitness sharing and evaluation. Each worker gets the config
+once, from the pool's initializer, so tasks don't ship it (and its fitness function) again and again. A fitness
+function may be an object with setup() and teardown() methods, e.g. to make a simulator or a gym environment once and
+reuse it for all the evaluations: setup() is called once in every worker, before its first evaluation, and teardown()
+when the pool is closed. Evaluators which evaluate in the calling process call them there instead, see Evaluator."""
+import functools
+import os
+import time
+
+from multiprocessing import Pool, util
+
+# the config installed in this worker process by _initialize_worker, None outside of the workers
+_worker_config = None
+_fitness_function_set_up = False                   # see setup_worker_fitness_function
+
+
+class WorkerPool:
+    """A multiprocessing pool of config.processes_in_pool workers, kept for the whole run. The owner must close() it
+    (or use it as a context manager) so the workers tear down their fitness function and exit.
+    The functions run in the pool may get the config with worker_config(). The time each worker spends running them
+    is kept until take_busy_times() is called, e.g. to measure the workers' utilization."""
+
+    def __init__(self, config):
+        self._number_of_workers = config.processes_in_pool
+        self._pool = Pool(self._number_of_workers, initializer=_initialize_worker, initargs=(config,))
+        self._closed = False
+        self._busy_times = {}       # key: worker's pid, value: seconds it spent running tasks
+
+    @property
+    def number_of_workers(self):
+        return self._number_of_workers
+
+    def map(self, function, iterable, chunksize=None):
+        """Same as multiprocessing.Pool.map"""
+        self._check_open()
+        return [self._record(timed_result)
+                for timed_result in self._pool.map(functools.partial(_run_timed, function), iterable, chunksize)]
+
+    def map_async(self, function, iterable, chunksize=None, callback=None):
+        """Same as multiprocessing.Pool.map, without waiting for the results. Returns a function which waits for them
+        and returns them. If given, callback() is called from another thread once they're ready (or failed)."""
+        self._check_open()
+        if callback is None:
+            ready_callback = None
+        else:
+            def ready_callback(_):
+                callback()
+        async_result = self._pool.map_async(functools.partial(_run_timed, function), iterable, chunksize,
+                                            callback=ready_callback, error_callback=ready_callback)
+        return lambda: [self._record(timed_result) for timed_result in async_result.get()]
+
+    def imap_unordered(self, function, iterable, chunksize=1):
+        """Same as multiprocessing.Pool.imap_unordered: yields the results as soon as the workers return them"""
+        self._check_open()
+        for timed_result in self._pool.imap_unordered(functools.partial(_run_timed, function), iterable, chunksize):
+            yield self._record(timed_result)
+
+    def take_busy_times(self):
+        """Returns a list of the seconds each worker spent running tasks since the last call, and starts over. Workers
+        which ran no task are 0."""
+        busy_times = sorted(self._busy_times.values(), reverse=True)
+        busy_times += [0.0] * (self._number_of_workers - len(busy_times))
+        self._busy_times = {}
+        return busy_times
+
+    def close(self):
+        """Waits for the workers to finish their tasks, tear down and exit. Closing again does nothing."""
+        if self._closed:
+            return
+        self._closed = True
+        self._pool.close()
+        self._pool.join()
+
+    def terminate(self):
+        """Kills the workers without waiting for them, so their fitness function isn't torn down"""
+        self._closed = True
+        self._pool.terminate()
+        self._pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _check_open(self):
+        if self._closed:
+            raise ValueError("Worker pool is closed")
+
+    def _record(self, timed_result):
+        result, pid, busy_time = timed_result
+        self._busy_times[pid] = self._busy_times.get(pid, 0.0) + busy_time
+        return result
+
+
+def worker_config():
+    """Returns the config of the worker process this is called in"""
+    assert _worker_config is not None, "not in a worker of a WorkerPool"
+    return _worker_config
+
+
+def setup_worker_fitness_function():
+    """Sets up the fitness function of the worker process this is called in, the first time it's called"""
+    global _fitness_function_set_up
+    if _fitness_function_set_up:
+        return
+    _fitness_function_set_up = True
+    fitness_function = worker_config().fitness_function
+    setup_fitness_function(fitness_function)
+    # run when the worker exits after the pool is closed, not if it's terminated
+    util.Finalize(None, teardown_fitness_function, args=(fitness_function,), exitpriority=10)
+
+
+def setup_fitness_function(fitness_function):
+    """Calls fitness_function.setup() if it has one"""
+    setup = getattr(fitness_function, 'setup', None)
+    if callable(setup):
+        setup()
+
+
+def teardown_fitness_function(fitness_function):
+    """Calls fitness_function.teardown() if it has one"""
+    teardown = getattr(fitness_function, 'teardown', None)
+    if callable(teardown):
+        teardown()
+
+
+def _run_timed(function, item):
+    start_time = time.perf_counter()
+    result = function(item)
+    return result, os.getpid(), time.perf_counter() - start_time
+
+
+def _initialize_worker(config):
+    global _worker_config
+    _worker_config = config